@@ -8,6 +8,8 @@ setup(
         'console_scripts': [
             'external_hd_index = sandbox.gcnr.sandbox.external_hd_index:main',
             'external_hd_query = sandbox.gcnr.sandbox.external_hd_index:query',
+            'external_hd_watch = sandbox.gcnr.sandbox.external_hd_watch:main',
+            'external_hd_du = sandbox.gcnr.sandbox.external_hd_index:du',
             # TODO: ideally we want something like "external_hd query" (subcommands)
             'planetpython = sandbox.gcnr.planetpython.planetpython_index:main',
         ]
@@ -0,0 +1,150 @@
+"""
+Arrow support for DataFramed: translation of a Schema into a ``pyarrow.Schema`` and validation of Arrow
+tables (a cast plus a few checks done by Arrow compute kernels, without going through Python objects).
+
+pyarrow is an optional dependency, this module is only imported when one of the Arrow methods is used.
+"""
+from __future__ import annotations
+
+import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from dataframed.validation import ColumnValidator
+
+
+ARROW_TYPES = {
+    bool: pa.bool_(),
+    int: pa.int64(),
+    float: pa.float64(),
+    str: pa.string(),
+    bytes: pa.binary(),
+    datetime.datetime: pa.timestamp('ns'),
+    datetime.date: pa.date32(),
+    datetime.timedelta: pa.duration('ns'),
+}
+
+# The Arrow types that can be (safely) cast to the Arrow type of the Schema annotation
+COMPATIBLE_TYPES = {
+    bool: pa.types.is_boolean,
+    int: pa.types.is_integer,
+    float: pa.types.is_floating,
+    str: lambda t: pa.types.is_string(t) or pa.types.is_large_string(t),
+    bytes: lambda t: pa.types.is_binary(t) or pa.types.is_large_binary(t),
+    datetime.datetime: pa.types.is_timestamp,
+    datetime.date: pa.types.is_date,
+    datetime.timedelta: pa.types.is_duration,
+}
+
+# string columns are converted to ``string[pyarrow]`` (instead of Python objects)
+STRING_DTYPES = {
+    pa.string(): pd.StringDtype('pyarrow'),
+    pa.large_string(): pd.StringDtype('pyarrow'),
+}
+
+# The nullable pandas dtypes of the Arrow integer columns that have nulls (they'd be floats otherwise)
+NULLABLE_INT_DTYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype(),
+}
+
+
+def arrow_type(validator: ColumnValidator) -> pa.DataType | None:
+    """
+    Returns the Arrow type for the column, or None when the annotation can't be represented in Arrow
+    (e.g. unions or user-defined types).
+    """
+    if len(validator.types) != 1:
+        return None
+    return ARROW_TYPES.get(validator.types[0])
+
+
+def arrow_schema(validators: dict[str, ColumnValidator]) -> pa.Schema:
+    fields = []
+    for name, validator in validators.items():
+        if (type_ := arrow_type(validator)) is None:
+            raise TypeError(f'Column: {name} with annotation {validator.annotation!r} has no Arrow equivalent')
+        fields.append(pa.field(name, type_, nullable=validator.nullable))
+    return pa.schema(fields)
+
+
+def check_table(table: pa.Table, validators: dict[str, ColumnValidator],
+                name: str) -> tuple[pa.Table, list[str]]:
+    """
+    Validates (and casts to the Arrow types of the Schema) the columns of ``table``.
+
+    Returns the cast table and the columns that still need to be validated by pandas (the ones with
+    Check constraints or a Coerce function, and the ones that have no Arrow equivalent).
+    """
+    unchecked = []
+    for key, validator in validators.items():
+        if key not in table.column_names:
+            continue
+
+        type_ = arrow_type(validator)
+        if type_ is None or validator.coerce is not None:
+            unchecked.append(key)
+            continue
+
+        index = table.column_names.index(key)
+        column = table.column(index)
+        invalid = _find_invalid(column, validator)
+        if invalid is None and column.type != type_ and not pa.types.is_dictionary(column.type):
+            try:
+                column = column.cast(type_, safe=True)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                invalid = f'{column.type} ({e})'
+            else:
+                table = table.set_column(index, pa.field(key, type_, nullable=validator.nullable), column)
+
+        if invalid is not None:
+            raise TypeError(f'{name} column: {key} needs type to be'
+                            f' to be {validator.annotation} - got: {invalid}')
+
+        if validator.checks:
+            unchecked.append(key)
+
+    return table, unchecked
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    Converts ``table`` to a DataFrame whose strings are ``string[pyarrow]`` columns, and whose integer
+    columns with nulls are nullable integers of the same width (e.g. ``Int32``) instead of floats.
+    """
+    df = table.to_pandas(types_mapper=STRING_DTYPES.get)
+    # (a types_mapper only sees the type, the columns without nulls keep their NumPy dtype)
+    for key, column in zip(table.column_names, table.columns):
+        if column.null_count and column.type in NULLABLE_INT_DTYPES and key in df.columns:
+            df[key] = NULLABLE_INT_DTYPES[column.type].__from_arrow__(column)
+    return df
+
+
+def _find_invalid(column: pa.ChunkedArray, validator: ColumnValidator) -> str | None:
+    type_ = column.type.value_type if pa.types.is_dictionary(column.type) else column.type
+
+    if pa.types.is_null(type_):
+        return None if validator.nullable else 'null'
+
+    if not COMPATIBLE_TYPES[validator.types[0]](type_):
+        # (integral floats with nulls, as pandas writes int columns with missing values, are cast to int)
+        if not (validator.types[0] is int and validator.nullable and pa.types.is_floating(type_)):
+            return str(column.type)
+
+    if not validator.nullable and column.null_count:
+        return 'null'
+
+    if validator.choices is not None:
+        values = column.drop_null()
+        mask = pc.is_in(values, value_set=pa.array(sorted(validator.choices), type=type_))
+        if pc.all(mask).as_py() is False:
+            return repr(pc.filter(values, pc.invert(mask))[0].as_py())
+
+    return None
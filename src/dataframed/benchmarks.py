@@ -0,0 +1,131 @@
+"""
+Benchmarks for the overhead of DataFramed over plain pandas DataFrames (time and peak memory).
+
+They need pytest-benchmark and are not collected by default, run them with:
+
+    pytest dataframed/benchmarks.py --benchmark-group-by=group,param:rows,param:cols
+
+By default only the small sizes are run, set DATAFRAMED_BENCH_FULL=1 for the full grid (1e3 to 1e7 rows,
+1 to 200 columns). Every benchmark has a ``pandas`` and a ``framed`` flavour so they can be compared side
+by side, and the peak memory of a single call (as seen by tracemalloc) is reported in ``extra_info``.
+"""
+from __future__ import annotations
+
+import io
+import os
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataframed.framed import DataFramed
+
+pytest.importorskip('pytest_benchmark')
+
+
+if os.getenv('DATAFRAMED_BENCH_FULL'):
+    ROWS = [1_000, 100_000, 10_000_000]
+    COLS = [1, 20, 200]
+else:
+    ROWS = [1_000, 100_000]
+    COLS = [1, 20]
+
+# the biggest frames would need too much memory (1e7 x 200 x 8 bytes = 16 GB)
+MAX_CELLS = 200_000_000
+
+SIZES = [(rows, cols) for rows in ROWS for cols in COLS if rows * cols <= MAX_CELLS]
+
+TYPES = [int, float, str]
+
+
+def make_class(cols: int) -> type[DataFramed]:
+    Schema = type('Schema', (), {'__annotations__': {f'c{i}': TYPES[i % len(TYPES)] for i in range(cols)}})
+    return type(f'Framed{cols}', (DataFramed,), {'Schema': Schema})
+
+
+def make_values(type_: type, rows: int):
+    if type_ is int:
+        return np.arange(rows)
+    if type_ is float:
+        return np.arange(rows) + 0.5
+    return np.array(['abc'] * rows, dtype=object)
+
+
+def make_frame(cols: int, rows: int) -> pd.DataFrame:
+    return pd.DataFrame({f'c{i}': make_values(TYPES[i % len(TYPES)], rows) for i in range(cols)})
+
+
+def run(benchmark, func, *args):
+    """
+    Benchmarks ``func`` and records the peak memory of a single (extra) call.
+    """
+    result = benchmark(func, *args)
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info['peak_memory_mb'] = round(peak / 2 ** 20, 3)
+    return result
+
+
+@pytest.fixture(params=['pandas', 'framed'])
+def flavour(request):
+    return request.param
+
+
+@pytest.fixture(params=SIZES, ids=[f'{rows}x{cols}' for rows, cols in SIZES])
+def size(request):
+    return request.param
+
+
+def frame_class(flavour: str, cols: int) -> type[pd.DataFrame]:
+    return pd.DataFrame if flavour == 'pandas' else make_class(cols)
+
+
+@pytest.mark.benchmark(group='construction')
+def test_construction(benchmark, flavour, size):
+    rows, cols = size
+    cls, df = frame_class(flavour, cols), make_frame(cols, rows)
+    run(benchmark, cls, df)
+
+
+@pytest.mark.benchmark(group='copy')
+def test_copy(benchmark, flavour, size):
+    rows, cols = size
+    df = frame_class(flavour, cols)(make_frame(cols, rows))
+    run(benchmark, df.copy)
+
+
+@pytest.mark.benchmark(group='from_json')
+def test_from_json(benchmark, flavour, size):
+    rows, cols = size
+    cls, json_str = frame_class(flavour, cols), make_frame(cols, rows).to_json()
+    if flavour == 'pandas':
+        run(benchmark, lambda s: pd.read_json(io.StringIO(s)), json_str)
+    else:
+        run(benchmark, cls.from_json, json_str)
+
+
+@pytest.mark.parametrize('value_kind', ['scalar', 'list', 'series', 'generator'])
+@pytest.mark.parametrize('rows', ROWS)
+@pytest.mark.benchmark(group='setitem')
+def test_setitem(benchmark, flavour, rows, value_kind):
+    if flavour == 'pandas' and value_kind == 'generator':
+        pytest.skip('pandas does not accept generators')
+    df = frame_class(flavour, 3)(make_frame(3, rows))
+    values = make_values(str, rows)
+
+    def setitem():
+        if value_kind == 'scalar':
+            df['c2'] = 'abc'
+        elif value_kind == 'list':
+            df['c2'] = values.tolist()
+        elif value_kind == 'series':
+            df['c2'] = pd.Series(values)
+        else:
+            df['c2'] = (v for v in values)
+
+    run(benchmark, setitem)
@@ -1,30 +1,73 @@
 from __future__ import annotations
+import datetime
+import contextlib
+import io
 import json
+import numpy as np
 import pandas as pd
 
 # TODO: how about the order of the columns? What if one wants/needs to enforce order?
 import typing
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
 
 import pytest
 
+from pandas.api.types import infer_dtype, is_list_like
 from pandas._typing import Axes, Dtype
 from pandas.testing import assert_frame_equal
 
+from dataframed.validation import (Check, Coerce, SamplePolicy, SampleReport, compile_schema,
+                                   find_invalid_columns)
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
 
 class DataFramed(pd.DataFrame):
     """
     A pandas DataFrame Proxy object that allows schema definition and validation.
     """
-    def __init_subclass__(cls, **kwargs):
+    # deferred validation (see deferred()) - the Schema columns assigned but not validated yet
+    _deferring: bool = False
+    _pending_columns: frozenset[str] = frozenset()
+
+    # results of pandas operations (see _constructor_from_mgr) - the Schema columns that kept their dtype
+    # but whose values still need to be checked, unless __finalize__ tells us the operation preserves values
+    _unverified_columns: frozenset[str] = frozenset()
+
+    # number of workers used to validate the columns in parallel (None: serial) - see find_invalid_columns(),
+    # it is given as a class keyword: class MyDataFrame(DataFramed, validation_workers=8)
+    _validation_workers: int | None = None
+
+    # validation policy (None: every value is checked) - also a class keyword: validation='sample'
+    # (or validation=SamplePolicy(...)) checks only a sample of the values of the columns that can't be
+    # validated by their dtype alone, see validation_report and validate(full=True)
+    _sample_policy: SamplePolicy | None = None
+    _sample_reports: dict[str, SampleReport] = {}
+
+    def __init_subclass__(cls, validation_workers: int | None = None,
+                          validation: str | SamplePolicy | None = None, **kwargs):
         super().__init_subclass__(**kwargs)
+        if validation_workers is not None:
+            cls._validation_workers = validation_workers
+        if validation == 'full':
+            cls._sample_policy = None
+        elif validation == 'sample':
+            cls._sample_policy = SamplePolicy()
+        elif isinstance(validation, SamplePolicy):
+            cls._sample_policy = validation
+        elif validation is not None:
+            raise ValueError(f"Unknown validation policy: {validation!r} (expected 'full' or 'sample')")
         Schema = getattr(cls, 'Schema', None)
         if Schema is not None and isinstance(Schema, type):
             # look at annotations
-            type_hints = typing.get_type_hints(Schema)
+            type_hints = typing.get_type_hints(Schema, include_extras=True)
         else:
             type_hints = {}
 
         cls._type_hints = type_hints
+        # the Schema is interpreted only once, here - the validators are reused for every check
+        cls._validators = compile_schema(type_hints)
 
     def __init__(
         self,
@@ -34,7 +77,7 @@ class DataFramed(pd.DataFrame):
         dtype: Dtype | None = None,
         copy: bool | None = None,
     ):
-        if not (df_given := isinstance(data, pd.DataFrame) and type(data) is not type(self)):
+        if not isinstance(data, pd.DataFrame):
             if columns is None:
                 columns = list(self._type_hints)
                 # if dtype is None:
@@ -42,45 +85,270 @@ class DataFramed(pd.DataFrame):
             elif missing := set(self._type_hints) - set(columns):
                     raise ValueError(f'{type(self).__name__} is missing required columns: {missing}')
 
+            if data is not None:
+                # the data needs to be validated as well - we let pandas build the frame and check its blocks
+                data = pd.DataFrame(data=data, index=index, columns=columns, dtype=dtype, copy=copy)
+                index = columns = dtype = None
+                copy = False
+
+        if isinstance(data, DataFramed) and (data._pending_columns or data._unverified_columns):
+            # (its deferred checks would be lost otherwise, the new frame has nothing pending)
+            data.validate()
+
+        if isinstance(data, pd.DataFrame) and (index is not None or columns is not None or dtype is not None):
+            # reindexing or casting can introduce missing values or change the dtypes, so the frame is built
+            # first and then validated
+            data = pd.DataFrame(data=data, index=index, columns=columns, dtype=dtype, copy=copy)
+            index = columns = dtype = None
+            copy = False
+
+        if isinstance(data, pd.DataFrame) and type(data) is not type(self):
+            # Validate the columns of the given DataFrame in place (no copies and no re-insertion of
+            # columns), the blocks are then adopted as they are by the DataFrame constructor
+            data, reports = self._validate_frame(data)
+        else:
+            reports = {}
+
         super().__init__(data=data, index=index, columns=columns, dtype=dtype, copy=copy)
+        if reports:
+            self._sample_reports = reports
 
-        if df_given:
-            # Post-validation needed
-            # When we're given another DataFrame in the constructor we just re-assign all the columns
-            # to make it go through __setitem__ and trigger the type validation
-            # This is extremely inefficient and almost madness... but it does the job for this PoC
-            for c in self.columns:
-                self[c] = self[c]
+    @classmethod
+    def _adopt(cls, df: pd.DataFrame) -> "Self":
+        """
+        Wraps a DataFrame that is known to be valid already, sharing its data (no validation and no copies).
+        """
+        obj = cls.__new__(cls)
+        pd.DataFrame.__init__(obj, df, copy=False)
+        return obj
+
+    @classmethod
+    def _validate_frame(cls, df: pd.DataFrame,
+                        columns: Iterable[str] | None = None) -> tuple[pd.DataFrame, dict[str, SampleReport]]:
+        """
+        Validates the Schema columns of ``df`` (or only the given ``columns``), returning it as it is unless
+        some column needs to be coerced (in that case only the coerced columns are replaced, in a shallow
+        copy of ``df``), together with the reports of the columns validated by sampling.
+        """
+        to_validate = {}
+        for key in (cls._validators if columns is None else columns):
+            validator = cls._validators[key]
+            if key in df.columns:
+                if validator.coerce is not None:
+                    df = df.copy(deep=False)
+                    df[key] = validator.prepare(df[key])
+                to_validate[key] = df[key]
+        return df, cls._validate_columns(to_validate)
+
+    @classmethod
+    def _validate_columns(cls, columns: dict[str, typing.Any], full: bool = False) -> dict[str, SampleReport]:
+        """
+        Validates the given columns, returning the reports of the ones validated by sampling.
+        """
+        to_validate, reports = [], {}
+        for key, values in columns.items():
+            validator = cls._validators[key]
+            if cls._sample_policy is not None and not full:
+                values, report = cls._sample_policy.sample(validator, values)
+                if report is not None:
+                    reports[key] = report
+            to_validate.append((validator, values))
+
+        results = find_invalid_columns(to_validate, workers=cls._validation_workers)
+        for key, invalid in zip(columns, results):
+            if invalid is not None:
+                raise TypeError(f'{cls.__name__} column: {key} needs type to be'
+                                f' to be {cls._type_hints[key]} - got: {invalid}')
+        return reports
 
     def __setitem__(self, key, value):
         if isinstance(key, str): # only strings
-            if key in self._type_hints:
-                type_ = self._type_hints[key]
+            if key in self._validators:
+                validator = self._validators[key]
 
-                try:
-                    iter(value)
-                except TypeError:
-                    # object is not iterable ...
-                    if not isinstance(value, type_):   # TODO: do we want to be strict? do we want to coerce?
+                # if it's given a generator we consume it here and pass the materialized values along
+                value = validator.prepare(value)
+
+                if self._deferring:
+                    self._pending_columns = self._pending_columns | {key}
+                elif not is_list_like(value):
+                    # scalar (strings included) - it will be broadcast to the whole column
+                    if (invalid := validator.find_invalid_scalar(value)) is not None:
                         raise TypeError(f'{type(self).__name__} requires values for column: {key}'
-                                        f' to be {type_} - got: {type(value).__name__}')
+                                        f' to be {self._type_hints[key]} - got: {invalid}')
                 else:
-                    # it is iterable
-                    if isinstance(value, str) and type_ is not str:  # TODO: support bytes and other user strings?
-                        raise TypeError(f'{type(self).__name__} column: {key} needs type to be'
-                                        f' to be {type_} - got: {type(value).__name__}')
-                    else:
-                        # if it's given a generator we're going to extinguish it here... # TODO: generator case
-                        for v in value:
-                            if not isinstance(v, type_):
-                                raise TypeError(f'{type(self).__name__} column: {key} needs type to be'
-                                                f' to be {type_} - got: {type(v).__name__}')
+                    reports = self._validate_columns({key: value})
+                    self._sample_reports = {k: r for k, r in self._sample_reports.items() if k != key} | reports
 
 
         # print('calling super', repr(key), repr(value))
         # If it didn't raise, then it's good to proceed ...
         super().__setitem__(key, value)
 
+    @contextlib.contextmanager
+    def deferred(self) -> Iterator["Self"]:
+        """
+        Defers the validation of the Schema columns assigned inside the with-block: they're all validated
+        once, in a single batch, when the block exits (so assigning the same column several times or building
+        a frame column by column pays for a single validation per column).
+
+        If the block raises, the columns assigned so far are left pending and can be checked with validate().
+        """
+        if self._deferring:
+            # nested blocks - the outermost one validates
+            yield self
+            return
+
+        self._deferring = True
+        try:
+            yield self
+        finally:
+            self._deferring = False
+        self.validate()
+
+    def validate(self, full: bool = False) -> "Self":
+        """
+        Validates the Schema columns whose validation was deferred (see deferred()).
+
+        With ``full=True`` all the Schema columns are validated, checking every single value (even when
+        the validation policy of the class is 'sample').
+        """
+        pending = self._pending_columns | self._unverified_columns
+        if full:
+            self._validate_columns({key: self[key] for key in self._validators if key in self.columns}, full=True)
+            self._sample_reports = {}
+        else:
+            reports = self._validate_columns({key: self[key] for key in pending if key in self.columns})
+            self._sample_reports = self._sample_reports | reports
+        self._pending_columns = self._pending_columns - pending
+        self._unverified_columns = self._unverified_columns - pending
+        return self
+
+    @property
+    def validation_report(self) -> dict[str, SampleReport]:
+        """
+        The Schema columns that were validated by sampling (see SamplePolicy) and what that achieved -
+        the columns that are not here had all their values checked.
+        """
+        return dict(self._sample_reports)
+
+    # Propagation through pandas operations: results keep the subclass type as long as they still have all
+    # the Schema columns (and valid values), otherwise they fall back to plain DataFrames.
+
+    @property
+    def _constructor(self) -> Callable[..., pd.DataFrame]:
+        return self._construct_or_fallback
+
+    @classmethod
+    def _construct_or_fallback(cls, data=None, *args, **kwargs) -> pd.DataFrame:
+        if isinstance(data, pd.DataFrame) and not set(cls._type_hints).issubset(data.columns):
+            return pd.DataFrame(data, *args, **kwargs)
+        try:
+            return cls(data, *args, **kwargs)
+        except (TypeError, ValueError):
+            # invalid values, or missing Schema columns (e.g. the transpose gives new columns)
+            return pd.DataFrame(data, *args, **kwargs)
+
+    def _constructor_from_mgr(self, mgr, axes) -> pd.DataFrame:
+        df = pd.DataFrame._from_mgr(mgr, axes=axes)
+        if not set(self._type_hints).issubset(df.columns) or not df.columns.is_unique:
+            return df
+
+        # The Schema columns whose dtype changed are validated right away. The ones that kept their dtype are
+        # valid already when the dtype alone proves it (e.g. int64 for an int column), otherwise they're
+        # left unverified until __finalize__ tells us which operation produced them.
+        source_dtypes, dtypes = self.dtypes, df.dtypes
+        changed, unverified = list(self._pending_columns | self._unverified_columns), set()
+        for key, validator in self._validators.items():
+            if key in changed:
+                continue
+            if key not in source_dtypes or dtypes[key] != source_dtypes[key]:
+                changed.append(key)
+            elif not validator.is_proven_by(dtypes[key]):
+                unverified.add(key)
+
+        try:
+            df, reports = self._validate_frame(df, changed)
+        except TypeError:
+            return df
+
+        obj = self._adopt(df)
+        obj._unverified_columns = frozenset(unverified)
+        if self._sample_reports or reports:
+            obj._sample_reports = self._sample_reports | reports
+        return obj
+
+    def _has_schema_columns(self, df: pd.DataFrame) -> bool:
+        return set(self._type_hints).issubset(df.columns) and df.columns.is_unique
+
+    def __finalize__(self, other, method: str | None = None, **kwargs) -> pd.DataFrame:
+        result = super().__finalize__(other, method=method, **kwargs)
+        if not self._has_schema_columns(result):
+            # the columns were changed after _constructor_from_mgr (e.g. rename works on a shallow copy)
+            return pd.DataFrame(result)
+        if result._unverified_columns:
+            if method in VALUE_PRESERVING_METHODS and isinstance(other, DataFramed):
+                # e.g. row selection or reordering - the values were taken from a valid frame
+                result._unverified_columns = frozenset()
+            else:
+                try:
+                    result.validate()
+                except TypeError:
+                    return pd.DataFrame(result)
+        return result
+
+    def _slice(self, slobj: slice, axis: int = 0) -> pd.DataFrame:
+        # same as pandas, which finalizes the slices (head, tail, iloc[a:b]...) without telling the method
+        axis = self._get_block_manager_axis(axis)
+        new_mgr = self._mgr.get_slice(slobj, axis=axis)
+        result = self._constructor_from_mgr(new_mgr, axes=new_mgr.axes)
+        return result.__finalize__(self, method='slice')
+
+    # The axes can also be replaced after the result was built (shallow copy and then new labels, or the manager
+    # of another frame for inplace operations), the Schema columns are checked there too.
+
+    def _set_axis_nocheck(self, labels, axis, inplace: bool):
+        result = super()._set_axis_nocheck(labels, axis, inplace)
+        if not inplace and not self._has_schema_columns(result):
+            # e.g. set_axis
+            return pd.DataFrame(result)
+        return result
+
+    def _update_inplace(self, result) -> None:
+        if not self._has_schema_columns(result):
+            missing = [c for c in self._type_hints if c not in result.columns] or 'duplicated columns'
+            raise RuntimeError(f'Cannot change columns: {missing} which are part of '
+                               f'the schema for {type(self).__name__}')
+        super()._update_inplace(result)
+
+    def rename(self, *args, inplace: bool = False, **kwargs):
+        if inplace:
+            # pandas would rename the columns of this frame in place before _update_inplace (that can't be undone)
+            self._update_inplace(self.rename(*args, **kwargs))
+            return None
+        return super().rename(*args, **kwargs)
+
+    def set_index(self, keys, *, inplace: bool = False, **kwargs):
+        # pandas deletes the columns moved to the index from a shallow copy (or from this frame, inplace)
+        result = pd.DataFrame(self).set_index(keys, **kwargs)
+        if inplace:
+            self._update_inplace(result)
+            return None
+        return self._construct_or_fallback(result)
+
+    def _drop_labels_or_levels(self, keys, axis: int = 0) -> pd.DataFrame:
+        # pandas drops them inplace on a shallow copy (e.g. the key columns of merge), which is only its result
+        return pd.DataFrame(self)._drop_labels_or_levels(keys, axis)
+
+    def drop(self, labels=None, *, axis=0, index=None, columns=None, inplace=False, **kwargs):
+        dropped = labels if columns is None and axis in (1, 'columns') else columns
+        if dropped is not None:
+            dropped = [dropped] if isinstance(dropped, str) or not is_list_like(dropped) else dropped
+            if schema_columns := [c for c in dropped if c in self._type_hints]:
+                raise RuntimeError(f'Cannot drop columns: {schema_columns} which are part of '
+                                   f'the schema for {type(self).__name__}')
+        return super().drop(labels, axis=axis, index=index, columns=columns, inplace=inplace, **kwargs)
+
     def __delitem__(self, key):
         if key in self._type_hints:
             raise RuntimeError(f'Cannot drop column: {key} which is part of '
@@ -88,18 +356,157 @@ class DataFramed(pd.DataFrame):
         else:
             return super().__delitem__(key)
 
-    def copy(self) -> "Self":
-        return type(self)(self)
+    def copy(self, deep: bool = True) -> "Self":
+        # we're copying a frame that was already validated - no need to validate it again
+        self.validate()
+        return super().copy(deep=deep)
 
     @classmethod
     def from_json(cls, json_str: str) -> "Self":
-        df = pd.read_json(json_str)
+        df = pd.read_json(io.StringIO(json_str))
         return cls(df)
 
+    # Chunked ingestion: when a chunksize is given the input is read (and validated) one chunk at a time,
+    # so a bad row fails as soon as its chunk arrives. With iterator=True a generator of typed frames is
+    # returned instead of the concatenation of all the chunks, keeping the memory bounded by the chunksize.
+
+    @classmethod
+    def from_json_lines(cls, path_or_buf, chunksize: int | None = None, iterator: bool = False,
+                        **kwargs) -> "Self | Iterator[Self]":
+        """
+        Reads newline-delimited JSON (extra keyword arguments are given to ``pd.read_json``).
+        """
+        if chunksize is None:
+            return cls(pd.read_json(path_or_buf, lines=True, **kwargs))
+        reader = pd.read_json(path_or_buf, lines=True, chunksize=chunksize, **kwargs)
+        return cls._from_chunks(reader, iterator)
+
+    @classmethod
+    def from_csv(cls, path_or_buf, chunksize: int | None = None, iterator: bool = False,
+                 **kwargs) -> "Self | Iterator[Self]":
+        """
+        Reads a CSV file (extra keyword arguments are given to ``pd.read_csv``).
+        """
+        if chunksize is None:
+            return cls(pd.read_csv(path_or_buf, **kwargs))
+        reader = pd.read_csv(path_or_buf, chunksize=chunksize, **kwargs)
+        return cls._from_chunks(reader, iterator)
+
+    @classmethod
+    def from_parquet(cls, path, chunksize: int | None = None, iterator: bool = False,
+                     columns: list[str] | None = None) -> "Self | Iterator[Self]":
+        """
+        Reads a Parquet file, in record batches of ``chunksize`` rows when a chunksize is given.
+        """
+        import pyarrow.parquet as pq
+
+        if chunksize is None:
+            return cls.from_arrow(pq.read_table(path, columns=columns))
+
+        # every record batch starts its index at 0, the chunks get a continuous index (as with read_csv)
+        offset = 0
+
+        def from_batch(table: "pa.Table") -> "Self":
+            nonlocal offset
+            df = cls.from_arrow(table)
+            df.index = pd.RangeIndex(offset, offset + len(df))
+            offset += len(df)
+            return df
+
+        return cls._from_chunks(_iter_parquet(path, chunksize, columns), iterator, from_batch)
+
+    @classmethod
+    def _from_chunks(cls, chunks: Iterable, iterator: bool,
+                     from_chunk: Callable | None = None) -> "Self | Iterator[Self]":
+        frames = cls._validate_chunks(chunks, from_chunk or cls)
+        if iterator:
+            return frames
+        frames = list(frames)
+        if not frames:
+            return cls()
+        # every chunk was validated already, no need to validate the concatenation
+        return cls._adopt(pd.concat([pd.DataFrame(f) for f in frames]))
+
+    @classmethod
+    def _validate_chunks(cls, chunks: Iterable, from_chunk: Callable) -> "Iterator[Self]":
+        with contextlib.closing(chunks) if hasattr(chunks, 'close') else contextlib.nullcontext():
+            for chunk in chunks:
+                yield from_chunk(chunk)
+
+    # Arrow: the Schema is translated into a pyarrow.Schema and Arrow tables are validated on the Arrow side
+    # (a cast and a few compute kernels), their strings become string[pyarrow] columns (no Python objects).
+
+    @classmethod
+    def arrow_schema(cls) -> "pa.Schema":
+        from dataframed.arrow import arrow_schema
+        return arrow_schema(cls._validators)
+
+    @classmethod
+    def from_arrow(cls, table: "pa.Table") -> "Self":
+        from dataframed.arrow import check_table, to_pandas
+
+        table, unchecked = check_table(table, cls._validators, cls.__name__)
+        df = to_pandas(table)
+        # only the columns that couldn't be checked by Arrow need to be validated here
+        df, reports = cls._validate_frame(df, unchecked)
+        obj = cls._adopt(df)
+        if reports:
+            obj._sample_reports = reports
+        return obj
+
+    @classmethod
+    def from_feather(cls, path, columns: list[str] | None = None) -> "Self":
+        import pyarrow.feather
+
+        return cls.from_arrow(pyarrow.feather.read_table(path, columns=columns))
+
+    def to_arrow(self, preserve_index: bool | None = None) -> "pa.Table":
+        """
+        Converts to an Arrow table whose Schema columns have the types given by arrow_schema()
+        (the other columns have the types inferred by pyarrow).
+        """
+        import pyarrow as pa
+        from dataframed.arrow import arrow_type
+
+        self.validate()
+        table = pa.Table.from_pandas(self, preserve_index=preserve_index)
+        schema = table.schema
+        for key, validator in self._validators.items():
+            if (type_ := arrow_type(validator)) is not None and key in schema.names:
+                index = schema.get_field_index(key)
+                schema = schema.set(index, pa.field(key, type_, nullable=validator.nullable))
+        return table.cast(schema)
+
+    def with_arrow_strings(self) -> "Self":
+        """
+        Returns a (shallow) copy where the string columns are stored as ``string[pyarrow]`` instead of
+        Python objects.
+        """
+        self.validate()
+        df = pd.DataFrame.copy(self, deep=False)
+        for key, values in self.items():
+            if values.dtype == object and infer_dtype(values, skipna=True) == 'string':
+                df[key] = values.astype(pd.StringDtype('pyarrow'))
+        # the values are still the same strings (and the same missing values)
+        return self._adopt(df)
+
     # TODO: the DataFrame API is quite long, so this Proxy object will need to implement a lot more 
     #       to be really comprehensive
 
 
+# The operations (as given to __finalize__) whose results only hold values taken from the source frame
+VALUE_PRESERVING_METHODS = {'take', 'slice', 'sort_values', 'sort_index', 'copy'}
+
+
+def _iter_parquet(path, chunksize: int, columns: list[str] | None) -> "Iterator[pa.Table]":
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with pq.ParquetFile(path) as parquet_file:
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield pa.Table.from_batches([batch])
+
+
 
 
 # Tests
@@ -142,7 +549,6 @@ def test_cannot_drop_columns_that_belong_to_schema():
 
     df = MyDataFrame(data=[{'name': 'joe'}, {'name': 'jane'}])
 
-    # TODO: this fails... it doesn't call __delitem__ under the hood...
     with pytest.raises(RuntimeError):
         df.drop(columns=['name'])
 
@@ -171,6 +577,108 @@ def test_type_checking_on_column_assignment():
     assert list(df['name']) == ['Charlie', 'Charlie']
 
 
+def test_type_checking_on_column_assignment_with_arrays():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            age: int
+
+    df = MyDataFrame()
+    df['name'] = pd.Series(['Alice', 'Bob'])
+    df['age'] = np.array([55, 58])
+
+    with pytest.raises(TypeError):
+        df['age'] = np.array([55.0, 58.0])
+
+    with pytest.raises(TypeError):
+        df['age'] = pd.Series(['55', '58'])
+
+    with pytest.raises(TypeError):
+        df['name'] = pd.Series(['Alice', None])
+
+    df['name'] = np.array(['Alice', 'Bob'])
+
+    with pytest.raises(TypeError):
+        df['name'] = np.array([b'Alice', b'Bob'])
+
+    assert list(df['name']) == ['Alice', 'Bob']
+    assert list(df['age']) == [55, 58]
+
+
+def test_type_checking_on_column_assignment_with_generator():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+
+    df = MyDataFrame()
+    df['name'] = (n for n in ['Alice', 'Bob'])
+
+    assert list(df['name']) == ['Alice', 'Bob']
+
+    with pytest.raises(TypeError):
+        df['name'] = (n for n in ['Alice', 1])
+
+
+def test_schema_is_compiled_once_per_subclass():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            age: typing.Optional[int]
+
+    assert set(MyDataFrame._validators) == {'name', 'age'}
+    assert MyDataFrame._validators['age'].nullable
+    assert MyDataFrame()._validators is MyDataFrame._validators
+
+
+def test_constraints_and_coercion():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            status: typing.Literal['active', 'inactive']
+            age: typing.Annotated[int, Check(lambda s: s >= 0, 'non-negative')]
+            born: typing.Annotated[datetime.datetime, Coerce(pd.to_datetime)]
+
+    df = MyDataFrame(data={'name': ['Alice'], 'status': ['active'], 'age': [55], 'born': ['1970-01-01']})
+    assert df['born'].dtype.kind == 'M'
+
+    with pytest.raises(TypeError):
+        df['status'] = 'unknown'
+
+    with pytest.raises(TypeError):
+        df['age'] = -1
+
+    with pytest.raises(TypeError):
+        MyDataFrame(pd.DataFrame({'age': [-1]}))
+
+    df['born'] = '1980-01-01'
+    assert df['born'].iloc[0] == datetime.datetime(1980, 1, 1)
+
+
+def test_data_given_to_the_constructor_is_validated():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+
+    with pytest.raises(TypeError):
+        MyDataFrame(data=[{'name': 1}])
+
+
+def test_dataframe_given_to_the_constructor_is_validated_after_reindexing_and_casting():
+    df = pd.DataFrame({'name': ['Alice'], 'age': [55]})
+
+    with pytest.raises(TypeError):
+        People(df, index=[0, 1])
+    with pytest.raises(TypeError):
+        People(People(df), index=[0, 1])
+    with pytest.raises(TypeError):
+        People(pd.DataFrame({'name': ['1'], 'age': [55]}), dtype=float)
+
+    people = People(df, columns=['age', 'name'], index=[0])
+    assert type(people) is People
+    assert list(people.columns) == ['age', 'name']
+    assert people['age'].dtype == np.int64
+
+
 def test_copy_returns_same_type():
     class MyDataFrame(DataFramed):
         class Schema:
@@ -182,6 +690,34 @@ def test_copy_returns_same_type():
     assert type(df_copy) is MyDataFrame
 
 
+def test_copy_keeps_extra_columns_and_does_not_share_data():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+
+    df = MyDataFrame(pd.DataFrame({'name': ['Alice', 'Bob'], 'age': [55, 58]}))
+    df_copy = df.copy()
+    df_copy.loc[0, 'age'] = 1
+
+    assert list(df_copy.columns) == ['name', 'age']
+    assert list(df['age']) == [55, 58]
+
+
+def test_construction_from_dataframe_shares_data():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            age: int
+
+    source = pd.DataFrame({'age': np.arange(5)})
+    df = MyDataFrame(source)
+
+    assert type(df) is MyDataFrame
+    assert np.shares_memory(df['age'].to_numpy(), source['age'].to_numpy())
+
+    with pytest.raises(TypeError):
+        MyDataFrame(pd.DataFrame({'age': ['55', '58']}))
+
+
 def test_from_json():
     class MyDataFrame(DataFramed):
         class Schema:
@@ -225,3 +761,416 @@ def test_from_json_valid_but_with_extra_cols():
     # assert expected.equals(df)
 
     assert_frame_equal(expected, df, check_frame_type=False)
+
+
+def test_deferred_validation():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            age: int
+
+    df = MyDataFrame()
+    with df.deferred():
+        df['name'] = ['Alice', 'Bob']
+        df['age'] = ['not', 'validated']
+        df['age'] = [55, 58]
+        assert df._pending_columns == {'name', 'age'}
+
+    assert df._pending_columns == frozenset()
+    assert list(df['age']) == [55, 58]
+
+    with pytest.raises(TypeError):
+        with df.deferred():
+            df['name'] = [1, 2]
+
+
+def test_deferred_validation_with_explicit_validate():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+
+    df = MyDataFrame()
+    with pytest.raises(ValueError):
+        with df.deferred():
+            df['name'] = [1, 2]
+            raise ValueError('boom')
+
+    assert df._pending_columns == {'name'}
+    with pytest.raises(TypeError):
+        df.validate()
+
+
+def test_deferred_columns_are_validated_when_the_frame_is_wrapped():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+
+    df = MyDataFrame()
+    with pytest.raises(TypeError):
+        with df.deferred():
+            df['name'] = [1, 2]
+            MyDataFrame(df)
+
+    df['name'] = ['Alice', 'Bob']
+    with df.deferred():
+        df['name'] = ['Charlie', 'Dan']
+        other = MyDataFrame(df)
+    assert other._pending_columns == df._pending_columns == frozenset()
+
+
+def test_deferred_validation_is_per_frame():
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+
+    df, other = MyDataFrame(), MyDataFrame()
+    with df.deferred():
+        with pytest.raises(TypeError):
+            other['name'] = [1]
+
+
+def test_row_selection_and_reordering_keep_the_type_without_revalidation(monkeypatch):
+    df = People(pd.DataFrame({'name': np.array(['Alice', 'Bob', 'Charlie'], dtype=object), 'age': [55, 58, 60]}))
+
+    def fail(values):
+        raise AssertionError('should not validate')
+
+    monkeypatch.setattr(People._validators['name'], 'find_invalid', fail)
+    monkeypatch.setattr(People._validators['age'], 'find_invalid', fail)
+
+    for result in [df[df['age'] > 55], df.sort_values('age', ascending=False), df.iloc[[2, 0]],
+                   df.loc[df['age'] < 60], df.copy(), df.head(2), df.tail(1), df.iloc[1:], df[::2],
+                   df.loc[1:2]]:
+        assert type(result) is People
+        assert result._unverified_columns == frozenset()
+
+
+def test_operations_revalidate_changed_columns():
+    df = People(pd.DataFrame({'name': ['Alice', 'Bob'], 'age': [55, 58]}))
+
+    assert type(df.head(1)) is People
+    assert type(df.dropna()) is People
+    assert type(df.replace('Alice', 'Alicia')) is People
+    assert type(df.astype({'age': 'int32'})) is People
+
+    # the results are not valid anymore
+    assert type(df.replace('Alice', 1)) is pd.DataFrame
+    assert type(df.astype({'age': float})) is pd.DataFrame
+    assert type(df.isna()) is pd.DataFrame
+    # the Schema columns are gone
+    assert type(df[['age']]) is pd.DataFrame
+    assert type(df.merge(df, on='age')) is pd.DataFrame
+
+
+def test_drop_columns_that_are_not_part_of_schema():
+    df = People(pd.DataFrame({'name': ['Alice', 'Bob'], 'age': [55, 58], 'extra': [1, 2]}))
+
+    assert list(df.drop(columns='extra').columns) == ['name', 'age']
+    assert type(df.drop(columns='extra')) is People
+    assert len(df.drop(index=0)) == 1
+
+    with pytest.raises(RuntimeError):
+        df.drop('age', axis=1)
+
+
+def test_renaming_schema_columns():
+    df = People(pd.DataFrame({'name': ['Alice', 'Bob'], 'age': [55, 58], 'extra': [1, 2]}))
+
+    assert type(df.rename(columns={'extra': 'other'})) is People
+    assert type(df.rename(columns={'name': 'nm'})) is pd.DataFrame
+    assert type(df.rename(columns=str.upper)) is pd.DataFrame
+    assert type(df.set_axis(['a', 'b', 'c'], axis=1)) is pd.DataFrame
+    assert type(df.set_axis(['name', 'age', 'x'], axis=1)) is People
+    assert type(df.set_axis([5, 6], axis=0)) is People
+    assert type(df.add_prefix('x_')) is pd.DataFrame
+
+    with pytest.raises(RuntimeError):
+        df.rename(columns={'name': 'nm'}, inplace=True)
+    with pytest.raises(RuntimeError):
+        df.rename(columns={'extra': 'name'}, inplace=True)
+    assert list(df.columns) == ['name', 'age', 'extra']
+
+    df.rename(columns={'extra': 'other'}, inplace=True)
+    assert list(df.columns) == ['name', 'age', 'other']
+
+
+def test_moving_schema_columns_to_the_index():
+    df = People(pd.DataFrame({'name': ['Alice', 'Bob'], 'age': [55, 58], 'extra': [1, 2]}))
+
+    assert type(df.set_index('extra')) is People
+    assert type(df.set_index('name')) is pd.DataFrame
+    assert type(df.T) is pd.DataFrame
+
+    with pytest.raises(RuntimeError):
+        df.set_index('name', inplace=True)
+    df.set_index('extra', inplace=True)
+    assert type(df) is People and list(df.index) == [1, 2]
+
+
+def test_inplace_drop_of_schema_columns():
+    df = People(pd.DataFrame({'name': ['Alice', 'Bob'], 'age': [55, 58], 'extra': [1, 2]}))
+
+    with pytest.raises(RuntimeError):
+        df.drop(columns='name', inplace=True)
+    with pytest.raises(RuntimeError):
+        df.drop(['name'], axis=1, inplace=True)
+    assert list(df.columns) == ['name', 'age', 'extra']
+
+    df.drop(columns='extra', inplace=True)
+    df.drop(index=0, inplace=True)
+    assert type(df) is People
+    assert df.to_dict('records') == [{'name': 'Bob', 'age': 58}]
+
+
+def test_parallel_validation():
+    class Wide(DataFramed, validation_workers=4):
+        class Schema:
+            name: str
+            age: int
+            height: float
+
+    class Wider(Wide):
+        pass
+
+    assert Wider._validation_workers == 4
+
+    data = {'name': np.array(['Alice', 'Bob'], dtype=object), 'age': [55, 58], 'height': [1.6, 1.8]}
+    assert list(Wider(pd.DataFrame(data))['age']) == [55, 58]
+
+    with pytest.raises(TypeError, match='column: height'):
+        Wider(pd.DataFrame({**data, 'height': [1, 2]}))
+
+    with pytest.raises(TypeError, match='column: name'):
+        Wider(pd.DataFrame({**data, 'name': np.array(['Alice', 1], dtype=object)}))
+
+
+def test_sample_validation():
+    class Big(DataFramed, validation=SamplePolicy(size=100, head_tail=10, seed=0)):
+        class Schema:
+            name: str
+            age: int
+
+    names = np.array(['Alice'] * 10_000, dtype=object)
+    names[5_000] = 1  # an invalid value that the sample is very unlikely to see
+    df = Big(pd.DataFrame({'name': names, 'age': np.arange(10_000)}))
+
+    # the dtype validates the whole age column, only the name column is sampled
+    assert set(df.validation_report) == {'name'}
+    report = df.validation_report['name']
+    assert report.checked <= 120 and report.total == 10_000
+    assert 'values checked' in str(report)
+
+    with pytest.raises(TypeError):
+        df.validate(full=True)
+
+    # the invalid values at the head or the tail are always caught
+    names[5_000], names[-1] = 'Alice', 1
+    with pytest.raises(TypeError):
+        Big(pd.DataFrame({'name': names, 'age': np.arange(10_000)}))
+
+    names[-1] = 'Alice'
+    df = Big(pd.DataFrame({'name': names, 'age': np.arange(10_000)}))
+    assert df.validate(full=True).validation_report == {}
+
+
+def test_unknown_validation_policy():
+    with pytest.raises(ValueError):
+        class MyDataFrame(DataFramed, validation='some'):
+            pass
+
+
+@pytest.fixture
+def people_records():
+    return [{'name': 'Alice', 'age': 55}, {'name': 'Bob', 'age': 58}, {'name': 'Charlie', 'age': 60}]
+
+
+class People(DataFramed):
+    class Schema:
+        name: str
+        age: int
+
+
+@pytest.mark.parametrize('chunksize', [None, 1, 2, 10])
+def test_from_csv(tmp_path, people_records, chunksize):
+    path = tmp_path / 'people.csv'
+    pd.DataFrame(people_records).to_csv(path, index=False)
+
+    df = People.from_csv(path, chunksize=chunksize)
+
+    assert type(df) is People
+    assert df.to_dict('records') == people_records
+    assert list(df.index) == [0, 1, 2]
+
+
+def test_from_json_lines_iterator(tmp_path, people_records):
+    path = tmp_path / 'people.jsonl'
+    path.write_text('\n'.join(json.dumps(r) for r in people_records))
+
+    chunks = list(People.from_json_lines(path, chunksize=2, iterator=True))
+
+    assert [type(c) for c in chunks] == [People, People]
+    assert [len(c) for c in chunks] == [2, 1]
+
+
+def test_bad_row_fails_when_its_chunk_arrives(tmp_path, people_records):
+    path = tmp_path / 'people.jsonl'
+    people_records[-1]['age'] = 'sixty'
+    path.write_text('\n'.join(json.dumps(r) for r in people_records))
+
+    chunks = People.from_json_lines(path, chunksize=2, iterator=True)
+
+    assert len(next(chunks)) == 2
+    with pytest.raises(TypeError):
+        next(chunks)
+
+    with pytest.raises(TypeError):
+        People.from_json_lines(path, chunksize=2)
+
+
+@pytest.mark.parametrize('chunksize', [None, 2])
+def test_from_parquet(tmp_path, people_records, chunksize):
+    pytest.importorskip('pyarrow')
+    path = tmp_path / 'people.parquet'
+    pd.DataFrame(people_records).to_parquet(path)
+
+    df = People.from_parquet(path, chunksize=chunksize)
+
+    assert type(df) is People
+    assert df.to_dict('records') == people_records
+    assert list(df.index) == [0, 1, 2]
+
+    if chunksize is not None:
+        chunks = People.from_parquet(path, chunksize=chunksize, iterator=True)
+        assert [list(c.index) for c in chunks] == [[0, 1], [2]]
+
+
+def test_optional_int_with_missing_values(tmp_path):
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            age: typing.Optional[int]
+
+    # pandas stores them as floats (with NaN)
+    for df in [MyDataFrame.from_csv(io.StringIO('name,age\nA,1\nB,\n')),
+               MyDataFrame.from_json('{"name": ["A", "B"], "age": [1, null]}'),
+               MyDataFrame(data=[{'name': 'A', 'age': 1}, {'name': 'B', 'age': None}])]:
+        assert type(df) is MyDataFrame
+        assert df['age'].isna().tolist() == [False, True]
+
+    df['age'] = [2, None]
+    assert df['age'].dtype.kind == 'f'
+
+    with pytest.raises(TypeError, match='got: float64'):
+        MyDataFrame.from_csv(io.StringIO('name,age\nA,1.5\nB,\n'))
+
+    pytest.importorskip('pyarrow')
+    df.to_parquet(tmp_path / 'people.parquet')
+    df = MyDataFrame.from_parquet(tmp_path / 'people.parquet')
+    assert df['age'].dtype == pd.Int64Dtype()
+    assert df['age'].isna().tolist() == [False, True]
+
+
+def test_chunks_with_only_missing_values(tmp_path):
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            nick: typing.Optional[str]
+
+    path = tmp_path / 'people.jsonl'
+    path.write_text('{"name": "A", "nick": null}\n{"name": "B", "nick": null}\n{"name": "C", "nick": "x"}\n')
+
+    # the first chunk has only missing nicks (pandas reads them as floats)
+    for df in [MyDataFrame.from_csv(io.StringIO('name,nick\nA,\nB,\nC,x\n'), chunksize=2),
+               MyDataFrame.from_json_lines(path, chunksize=2)]:
+        assert type(df) is MyDataFrame
+        assert df['nick'].isna().tolist() == [True, True, False]
+
+    with pytest.raises(TypeError):
+        MyDataFrame.from_csv(io.StringIO('name,nick\nA,\nB,1\nC,x\n'), chunksize=2)
+
+
+def test_arrow_schema():
+    pa = pytest.importorskip('pyarrow')
+
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            age: typing.Optional[int]
+
+    assert MyDataFrame.arrow_schema() == pa.schema([pa.field('name', pa.string(), nullable=False),
+                                                    pa.field('age', pa.int64())])
+
+
+def test_from_arrow_validates_on_the_arrow_side():
+    pa = pytest.importorskip('pyarrow')
+
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            age: typing.Optional[int]
+            status: typing.Literal['active', 'inactive']
+
+    table = pa.table({'name': ['Alice', 'Bob'], 'age': pa.array([55, None], pa.int32()),
+                      'status': ['active', 'inactive']})
+    df = MyDataFrame.from_arrow(table)
+
+    assert type(df) is MyDataFrame
+    assert df['name'].dtype == pd.StringDtype('pyarrow')
+    assert df['age'].dtype == pd.Int64Dtype()
+    assert df['age'].isna().tolist() == [False, True]
+
+    with pytest.raises(TypeError):
+        MyDataFrame.from_arrow(table.set_column(0, 'name', pa.array([1, 2])))
+
+    with pytest.raises(TypeError):
+        MyDataFrame.from_arrow(table.set_column(0, 'name', pa.array(['Alice', None])))
+
+    with pytest.raises(TypeError):
+        MyDataFrame.from_arrow(table.set_column(2, 'status', pa.array(['active', 'unknown'])))
+
+
+def test_from_arrow_keeps_the_integers_of_each_column():
+    pa = pytest.importorskip('pyarrow')
+
+    class MyDataFrame(DataFramed):
+        class Schema:
+            name: str
+            age: typing.Optional[int]
+
+    table = pa.table({'name': ['Alice', 'Bob'], 'age': pa.array([55, None], pa.int64()),
+                      'other': pa.array([1, 2], pa.int64()), 'extra': pa.array([None, 3], pa.int16())})
+    df = MyDataFrame.from_arrow(table)
+
+    # only the integer columns with nulls become nullable integers (of the same width)
+    assert df['age'].dtype == pd.Int64Dtype()
+    assert df['other'].dtype == np.int64
+    assert df['extra'].dtype == pd.Int16Dtype()
+    assert df['extra'].isna().tolist() == [True, False]
+
+    df = MyDataFrame.from_arrow(table.set_column(1, 'age', pa.array([55, 58])))
+    assert df['age'].dtype == np.int64
+
+
+def test_arrow_roundtrip(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    df = People(pd.DataFrame({'name': ['Alice', 'Bob'], 'age': [55, 58], 'extra': [1.5, 2.5]}))
+    table = df.to_arrow()
+
+    assert table.schema.field('age').nullable is False
+    assert People.from_arrow(table).to_dict('records') == df.to_dict('records')
+
+    df.to_feather(tmp_path / 'people.feather')
+    assert People.from_feather(tmp_path / 'people.feather').to_dict('records') == df.to_dict('records')
+
+
+def test_with_arrow_strings():
+    pytest.importorskip('pyarrow')
+
+    df = People(pd.DataFrame({'age': [55, 58]}))
+    df['name'] = pd.Series(['Alice', 'Bob'], dtype=object)
+    df2 = df.with_arrow_strings()
+
+    assert type(df2) is People
+    assert df2['name'].dtype.storage == 'pyarrow'
+    assert df['name'].dtype == object
@@ -0,0 +1,619 @@
+"""
+Vectorized validation of column values against the annotations of a DataFramed Schema.
+
+Instead of looking at every single element with ``isinstance`` we first look at the dtype of the column,
+which is enough for most of the columns (e.g. an ``int64`` column can only hold ints). Only ``object``
+columns (and plain lists) need to look at the values, and that is done by ``infer_dtype`` in a single
+pass in C. The element-wise ``isinstance`` check is only the last resort (and it's also used to find the
+offending value when reporting an error).
+
+Each annotation is compiled only once (when the DataFramed subclass is created) into a ColumnValidator,
+which is then reused for every construction and assignment. The supported annotations are:
+
+    - plain types (e.g. ``int``, ``str``, ``datetime.datetime`` or any user-defined class)
+    - ``Optional[T]`` / ``T | None`` - the column is nullable (None, NaN, NA and NaT are accepted)
+    - ``Union[T1, T2]`` / ``T1 | T2`` of plain types
+    - ``Literal['a', 'b']`` - the values must be one of the given choices
+    - ``Annotated[T, Check(...), Coerce(...)]`` - extra (vectorized) constraints and coercion
+"""
+from __future__ import annotations
+
+import atexit
+import concurrent.futures
+import dataclasses
+import datetime
+import functools
+import multiprocessing
+import pickle
+import types
+import typing
+from itertools import repeat
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.api.extensions import ExtensionArray
+from pandas.api.types import infer_dtype, is_list_like, is_scalar
+
+
+# The dtype kinds that can only hold values that are instances of the given type
+# (note that bool is a subclass of int, so we accept bool columns for int - same as isinstance would do)
+DTYPE_KINDS = {
+    str: 'U',
+    bytes: 'S',
+    bool: 'b',
+    int: 'biu',
+    float: 'f',
+    complex: 'c',
+    datetime.datetime: 'M',
+    datetime.date: 'M',
+    datetime.timedelta: 'm',
+}
+
+# The results of infer_dtype() that can only hold values that are instances of the given type
+INFERRED_TYPES = {
+    str: {'string'},
+    bytes: {'bytes'},
+    bool: {'boolean'},
+    int: {'integer', 'boolean'},
+    float: {'floating'},
+    complex: {'complex'},
+    datetime.datetime: {'datetime'},
+    datetime.date: {'datetime', 'date'},
+    datetime.timedelta: {'timedelta'},
+}
+
+ARRAY_TYPES = (list, np.ndarray, pd.Series, pd.Index, ExtensionArray)
+
+
+class Check:
+    """
+    ``Annotated`` metadata for an extra constraint on the values of a column.
+
+    The function is given the column values as a Series and must return a boolean mask (or a single bool),
+    e.g.: ``Annotated[int, Check(lambda s: s >= 0, 'non-negative')]``
+    """
+    def __init__(self, func: Callable[[pd.Series], Any], description: str | None = None):
+        self.func = func
+        self.description = description or getattr(func, '__name__', repr(func))
+
+    def __repr__(self):
+        return f'Check({self.description})'
+
+
+class Coerce:
+    """
+    ``Annotated`` metadata for a function that converts whatever is assigned to a column before it's validated.
+
+    The function is given either a scalar or the column values, e.g.:
+    ``Annotated[datetime.datetime, Coerce(pd.to_datetime)]``
+    """
+    def __init__(self, func: Callable[[Any], Any]):
+        self.func = func
+
+    def __repr__(self):
+        return f'Coerce({getattr(self.func, "__name__", repr(self.func))})'
+
+
+@dataclasses.dataclass
+class ColumnValidator:
+    """
+    The compiled form of a Schema annotation - see compile_column().
+    """
+    annotation: Any
+    types: tuple[type, ...] = (object,)
+    nullable: bool = False
+    choices: frozenset | None = None
+    checks: tuple[Check, ...] = ()
+    coerce: Callable[[Any], Any] | None = None
+
+    # dtype targets, derived from the types
+    kinds: str = dataclasses.field(init=False, repr=False)
+    inferred: frozenset[str] = dataclasses.field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.kinds = ''.join(DTYPE_KINDS.get(t, '') for t in self.types)
+        self.inferred = frozenset({'empty'}.union(*(INFERRED_TYPES.get(t, ()) for t in self.types)))
+
+    @functools.cached_property
+    def picklable(self) -> bool:
+        """
+        Whether the validator can be sent to another process (e.g. not when it has lambdas or local classes).
+        """
+        try:
+            pickle.dumps(self)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return False
+        return True
+
+    def prepare(self, value):
+        """
+        Returns ``value`` in a form that can be validated and later assigned to the DataFrame.
+
+        Generators and other iterables are consumed here (only once) and turned into a list,
+        and the coercion function (if any) is applied.
+        """
+        value = as_column_values(value)
+        if self.coerce is not None:
+            value = as_column_values(self.coerce(value))
+        return value
+
+    def is_proven_by(self, dtype) -> bool:
+        """
+        Whether any column of the given ``dtype`` is valid (i.e. there's no need to look at the values).
+        """
+        return (object in self.types or isinstance(dtype, np.dtype) and dtype.kind in self.kinds) \
+            and self.choices is None and not self.checks
+
+    def find_invalid_scalar(self, value) -> str | None:
+        """
+        Same as find_invalid() for a single value (e.g. a scalar being broadcast to the whole column).
+        """
+        if self.nullable and _is_missing(value):
+            return None
+        if not isinstance(value, self.types):
+            return type(value).__name__
+        return self._find_invalid_value([value])
+
+    def find_invalid(self, values) -> str | None:
+        """
+        Checks that all the ``values`` are valid for this column.
+
+        Returns None when all the values are valid, otherwise returns a description of the offending
+        value: the name of its type (or the name of the dtype when the whole column can be rejected
+        just by looking at its dtype), or its repr when it has the right type but fails a constraint.
+        """
+        return self._find_invalid_type(values) or self._find_invalid_value(values)
+
+    def _find_invalid_type(self, values) -> str | None:
+        if object in self.types:
+            return None
+
+        dtype = getattr(values, 'dtype', None)
+
+        if isinstance(dtype, pd.CategoricalDtype):
+            # only the (unique) categories need to be checked
+            return self._find_invalid_type(dtype.categories) or self._find_missing(values)
+
+        if dtype is not None:
+            if isinstance(dtype, pd.StringDtype):
+                if str not in self.types:
+                    return str.__name__
+                return self._find_missing(values)
+
+            if dtype.kind in self.kinds:
+                if isinstance(dtype, np.dtype):
+                    return None
+                # nullable extension arrays (e.g.: Int64, boolean) can still hold pd.NA
+                return self._find_missing(values)
+
+            if dtype.kind == 'f' and int in self.types and self.nullable:
+                # pandas stores int columns with missing values as floats (e.g. read_csv, read_json or
+                # the constructor), they're fine as long as the values that are there are integral
+                return None if _is_integral(values) else str(dtype)
+
+            if dtype.kind != 'O':
+                # a column with only missing values gets whatever dtype (e.g. float64 for a chunk of a CSV
+                # file where it's all empty), it's valid when they are allowed
+                if self.nullable and pd.isna(values).all():
+                    return None
+                return str(dtype)
+
+        if infer_dtype(values, skipna=self.nullable) in self.inferred:
+            return None
+
+        return self._find_first_invalid(values)
+
+    def _find_invalid_value(self, values) -> str | None:
+        if self.choices is None and not self.checks:
+            return None
+
+        s = values if isinstance(values, pd.Series) else pd.Series(values)
+        valid = pd.isna(s).to_numpy() if self.nullable else np.zeros(len(s), dtype=bool)
+
+        if self.choices is not None:
+            mask = valid | s.isin(self.choices).to_numpy()
+            if not mask.all():
+                return repr(s[~mask].tolist()[0])
+
+        for check in self.checks:
+            mask = valid | np.asarray(check.func(s), dtype=bool)
+            if not mask.all():
+                return f'{s[~mask].tolist()[0]!r} (failed {check.description})'
+
+        return None
+
+    def _find_missing(self, values) -> str | None:
+        if self.nullable:
+            return None
+        missing = pd.isna(values)
+        if missing.any():
+            return type(np.asarray(values, dtype=object)[missing][0]).__name__
+        return None
+
+    def _find_first_invalid(self, values) -> str | None:
+        if isinstance(values, (pd.Series, pd.Index)):
+            values = values.array
+        if all(map(isinstance, values, repeat(self.types))):
+            return None
+        for v in values:
+            if not isinstance(v, self.types) and not (self.nullable and _is_missing(v)):
+                return type(v).__name__
+        return None
+
+
+@dataclasses.dataclass(frozen=True)
+class SampleReport:
+    """
+    What was achieved by validating only a sample of the values of a column (see SamplePolicy).
+    """
+    checked: int
+    total: int
+    confidence: float
+
+    @property
+    def max_invalid_fraction(self) -> float:
+        """
+        The fraction of invalid values that can still be there, with the given confidence: if a fraction p
+        of the values were invalid, the chance of a random sample of n values missing all of them would be
+        (1 - p) ** n.
+        """
+        if self.checked >= self.total:
+            return 0.0
+        return 1 - (1 - self.confidence) ** (1 / self.checked)
+
+    def __str__(self):
+        return (f'{self.checked:,} of {self.total:,} values checked - with {self.confidence:.0%} confidence '
+                f'less than {self.max_invalid_fraction:.4%} of them are invalid')
+
+
+@dataclasses.dataclass(frozen=True)
+class SamplePolicy:
+    """
+    Validates only a sample of the values of the columns that can't be validated by their dtype alone
+    (the dtype itself is always checked): the first and last ``head_tail`` values, plus ``size`` values
+    taken at random (or evenly spaced, with ``method='stratified'``).
+
+    Note that the confidence reported for stratified samples assumes the invalid values are not laid out
+    in a pattern that matches the sampling step.
+    """
+    size: int = 10_000
+    method: typing.Literal['random', 'stratified'] = 'random'
+    head_tail: int = 100
+    confidence: float = 0.95
+    seed: int | None = None
+
+    def __post_init__(self):
+        if self.method not in ('random', 'stratified'):
+            raise ValueError(f'Unknown sampling method: {self.method!r}')
+
+    def positions(self, n: int) -> np.ndarray | None:
+        """
+        The (sorted, unique) positions of the sample, or None when the column is small enough to be checked fully.
+        """
+        if n <= self.size + 2 * self.head_tail:
+            return None
+        if self.method == 'random':
+            rng = np.random.default_rng(self.seed)
+            middle = rng.integers(self.head_tail, n - self.head_tail, self.size)
+        else:
+            middle = np.linspace(self.head_tail, n - self.head_tail - 1, self.size).astype(np.intp)
+        head, tail = np.arange(self.head_tail), np.arange(n - self.head_tail, n)
+        return np.unique(np.concatenate([head, middle, tail]))
+
+    def sample(self, validator: ColumnValidator, values) -> tuple[Any, SampleReport | None]:
+        """
+        Returns the values to be validated (with the report), or all the ``values`` (and no report) when
+        they have to be checked fully anyway.
+        """
+        dtype = getattr(values, 'dtype', None)
+        if dtype is not None and validator.is_proven_by(dtype):
+            return values, None
+        if (positions := self.positions(len(values))) is None:
+            return values, None
+        if isinstance(values, list):
+            sampled = [values[i] for i in positions]
+        else:
+            sampled = values.take(positions)
+        return sampled, SampleReport(len(positions), len(values), self.confidence)
+
+
+def _is_integral(values) -> bool:
+    floats = pd.Series(values).dropna().to_numpy(dtype=float)
+    return bool(np.isfinite(floats).all() and (floats == np.trunc(floats)).all())
+
+
+def compile_column(annotation) -> ColumnValidator:
+    """
+    Interprets a Schema annotation (see the module docstring for the supported ones).
+    """
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+
+    if origin is typing.Annotated:
+        validator = compile_column(args[0])
+        for metadata in annotation.__metadata__:
+            if isinstance(metadata, Check):
+                validator.checks += (metadata,)
+            elif isinstance(metadata, Coerce):
+                validator.coerce = metadata.func
+        validator.annotation = annotation
+        return validator
+
+    if origin is typing.Union or origin is types.UnionType:
+        non_null = [a for a in args if a is not type(None)]
+        if len(non_null) == 1:
+            validator = compile_column(non_null[0])
+        else:
+            members = [compile_column(a) for a in non_null]
+            if any(m.choices is not None or m.checks or m.coerce is not None for m in members):
+                raise TypeError(f'Unsupported Schema annotation: {annotation!r} '
+                                f'(only unions of plain types are supported)')
+            validator = ColumnValidator(annotation, types=tuple(t for m in members for t in m.types),
+                                        nullable=any(m.nullable for m in members))
+        validator.nullable = validator.nullable or len(non_null) < len(args)
+        validator.annotation = annotation
+        return validator
+
+    if origin is typing.Literal:
+        return ColumnValidator(annotation, types=tuple(dict.fromkeys(type(a) for a in args)),
+                               choices=frozenset(args))
+
+    if isinstance(origin, type):
+        # generic aliases (e.g.: list[int]) - we can only check the container type
+        return ColumnValidator(annotation, types=(origin,))
+
+    if isinstance(annotation, type):
+        return ColumnValidator(annotation, types=(annotation,))
+
+    raise TypeError(f'Unsupported Schema annotation: {annotation!r}')
+
+
+def compile_schema(type_hints: dict[str, Any]) -> dict[str, ColumnValidator]:
+    return {name: compile_column(annotation) for name, annotation in type_hints.items()}
+
+
+def find_invalid_columns(columns: list[tuple[ColumnValidator, Any]], workers: int | None = None) -> list[str | None]:
+    """
+    Validates several columns (given as pairs of validator and values), returning the result of
+    find_invalid() for each one of them.
+
+    With ``workers`` > 1 the columns are validated in parallel: the ``object`` columns (whose checks hold
+    the GIL) go to a process pool, when their validator can be pickled, and all the others (dtype checks
+    and NumPy-based checks, which release the GIL) go to a thread pool.
+    Note that the values of the columns sent to the process pool need to be pickled as well, so it only
+    pays off for wide frames with expensive object columns.
+    """
+    if not workers or workers <= 1 or len(columns) <= 1:
+        return [validator.find_invalid(values) for validator, values in columns]
+
+    futures = []
+    for validator, values in columns:
+        if getattr(values, 'dtype', None) == object and validator.picklable:
+            executor = _get_executor(concurrent.futures.ProcessPoolExecutor, workers)
+        else:
+            executor = _get_executor(concurrent.futures.ThreadPoolExecutor, workers)
+        futures.append(executor.submit(validator.find_invalid, values))
+    return [f.result() for f in futures]
+
+
+_executors = {}
+
+
+@atexit.register
+def _shutdown_executors() -> None:
+    for executor in _executors.values():
+        executor.shutdown(cancel_futures=True)
+    _executors.clear()
+
+
+def _get_executor(executor_class, workers: int) -> concurrent.futures.Executor:
+    """
+    The pools are created on first use and then kept around (starting processes is expensive).
+    """
+    key = (executor_class, workers)
+    if key not in _executors:
+        if executor_class is concurrent.futures.ProcessPoolExecutor:
+            # forking a process that may be running threads (e.g. the thread pool) is not safe
+            _executors[key] = executor_class(workers, mp_context=multiprocessing.get_context('forkserver'))
+        else:
+            _executors[key] = executor_class(workers, thread_name_prefix='dataframed')
+    return _executors[key]
+
+
+def as_column_values(value):
+    """
+    Generators and other iterables are consumed here (only once) and turned into a list.
+    """
+    if is_list_like(value) and not isinstance(value, ARRAY_TYPES):
+        return list(value)
+    return value
+
+
+def _is_missing(value) -> bool:
+    return is_scalar(value) and bool(pd.isna(value))
+
+
+def benchmark(n: int = 100_000) -> None:
+    """
+    Compares validating a column with a validator compiled on every call (i.e. re-interpreting the raw
+    annotation every time) against the validator that DataFramed caches when the subclass is created.
+    """
+    import timeit
+
+    values = np.arange(1_000)
+    for annotation in [int, typing.Optional[int], typing.Annotated[typing.Optional[int], Coerce(int)]]:
+        validator = compile_column(annotation)
+        uncached = min(timeit.repeat(lambda: compile_column(annotation).find_invalid(values), number=n, repeat=5))
+        cached = min(timeit.repeat(lambda: validator.find_invalid(values), number=n, repeat=5))
+        print(f'{annotation!r}')
+        print(f'    compiled on every call: {uncached / n * 1e6:6.2f} us/call')
+        print(f'    cached validator:       {cached / n * 1e6:6.2f} us/call')
+        print(f'    overhead removed:       {(uncached - cached) / n * 1e6:6.2f} us/call')
+
+
+if __name__ == '__main__':
+    benchmark()
+
+
+# Tests
+
+def find_invalid(values, annotation) -> str | None:
+    return compile_column(annotation).find_invalid(values)
+
+
+def test_numpy_dtypes_are_checked_without_looking_at_the_values():
+    assert find_invalid(np.arange(10), int) is None
+    assert find_invalid(np.array([True, False]), int) is None
+    assert find_invalid(np.arange(10.0), float) is None
+    assert find_invalid(np.arange(10), float) == 'int64'
+    assert find_invalid(np.arange(10.0), int) == 'float64'
+    assert find_invalid(pd.Series(pd.date_range('2020-01-01', periods=3)), datetime.datetime) is None
+    assert find_invalid(np.array(['a', 'bc']), str) is None
+    assert find_invalid(np.array([b'a', b'bc']), bytes) is None
+    assert find_invalid(np.array(['a', 'bc']), bytes) == '<U2'
+    assert find_invalid(np.array([np.nan, np.nan]), typing.Optional[str]) is None
+    assert find_invalid(np.array([np.nan, np.nan]), str) == 'float64'
+    assert find_invalid(np.array([np.nan, 1.0]), typing.Optional[str]) == 'float64'
+
+
+def test_is_proven_by():
+    assert compile_column(int).is_proven_by(np.dtype('int64'))
+    assert not compile_column(int).is_proven_by(np.dtype('float64'))
+    assert not compile_column(int).is_proven_by(pd.Int64Dtype())
+    assert not compile_column(str).is_proven_by(np.dtype(object))
+    assert not compile_column(typing.Literal[1, 2]).is_proven_by(np.dtype('int64'))
+
+
+def test_object_values():
+    assert find_invalid(['a', 'b'], str) is None
+    assert find_invalid(['a', 1], str) == 'int'
+    assert find_invalid(['a', None], str) == 'NoneType'
+    assert find_invalid([1, True], int) is None
+    assert find_invalid([], int) is None
+    assert find_invalid(np.array([1, 'a'], dtype=object), int) == 'str'
+
+
+def test_user_defined_types():
+    class Foo:
+        pass
+
+    class Bar(Foo):
+        pass
+
+    assert find_invalid([Foo(), Bar()], Foo) is None
+    assert find_invalid([Foo(), object()], Foo) == 'object'
+    assert find_invalid([1, 'a', object()], object) is None
+
+
+def test_extension_dtypes():
+    assert find_invalid(pd.array(['a', 'b'], dtype='string'), str) is None
+    assert find_invalid(pd.array(['a', None], dtype='string'), str) is not None
+    assert find_invalid(pd.array(['a', 'b'], dtype='string'), int) == 'str'
+    assert find_invalid(pd.array([1, 2], dtype='Int64'), int) is None
+    assert find_invalid(pd.array([1, None], dtype='Int64'), int) == 'NAType'
+    assert find_invalid(pd.Series(['a', 'b'], dtype='category'), str) is None
+    assert find_invalid(pd.Series(['a', 'b'], dtype='category'), int) == 'str'
+
+
+def test_optional():
+    assert find_invalid(['a', None], typing.Optional[str]) is None
+    assert find_invalid(['a', None], str | None) is None
+    assert find_invalid(pd.array([1, None], dtype='Int64'), typing.Optional[int]) is None
+    assert find_invalid(['a', 1], typing.Optional[str]) == 'int'
+    assert compile_column(typing.Optional[str]).find_invalid_scalar(None) is None
+    assert compile_column(str).find_invalid_scalar(None) == 'NoneType'
+
+
+def test_optional_int_stored_as_floats():
+    assert find_invalid(np.array([1.0, np.nan]), typing.Optional[int]) is None
+    assert find_invalid(pd.array([1.0, None], dtype='Float64'), typing.Optional[int]) is None
+    assert find_invalid(np.array([1.5, np.nan]), typing.Optional[int]) == 'float64'
+    assert find_invalid(np.array([1.0, np.inf]), typing.Optional[int]) == 'float64'
+    assert find_invalid(np.array([1.0, np.nan]), int) == 'float64'
+
+
+def test_union():
+    assert find_invalid(['a', 1], str | int) is None
+    assert find_invalid(['a', 1, None], str | int) == 'NoneType'
+    assert find_invalid(['a', 1, None], str | int | None) is None
+    assert find_invalid(np.arange(3.0), str | int) == 'float64'
+
+
+def test_literal():
+    assert find_invalid(['a', 'b', 'a'], typing.Literal['a', 'b']) is None
+    assert find_invalid(['a', 'c'], typing.Literal['a', 'b']) == "'c'"
+    assert find_invalid(['a', 1], typing.Literal['a', 'b']) == 'int'
+    assert find_invalid(['a', None], typing.Optional[typing.Literal['a', 'b']]) is None
+    assert compile_column(typing.Literal['a', 'b']).find_invalid_scalar('c') == "'c'"
+
+
+def test_annotated():
+    non_negative = Check(lambda s: s >= 0, 'non-negative')
+    assert find_invalid(np.arange(3), typing.Annotated[int, non_negative]) is None
+    assert find_invalid(np.arange(-1, 3), typing.Annotated[int, non_negative]) == '-1 (failed non-negative)'
+    assert find_invalid(np.arange(3.0), typing.Annotated[int, non_negative]) == 'float64'
+    assert compile_column(typing.Annotated[int, non_negative]).find_invalid_scalar(-5) == '-5 (failed non-negative)'
+
+    validator = compile_column(typing.Annotated[datetime.datetime, Coerce(pd.to_datetime)])
+    values = validator.prepare(['2020-01-01', '2020-01-02'])
+    assert validator.find_invalid(values) is None
+
+
+def test_unsupported_annotation():
+    with pytest.raises(TypeError):
+        compile_column('int')
+
+
+@pytest.mark.parametrize('workers', [None, 1, 4])
+def test_find_invalid_columns(workers):
+    columns = [
+        (compile_column(int), np.arange(10)),
+        (compile_column(str), np.array(['a', 'b'], dtype=object)),
+        (compile_column(typing.Optional[str]), np.array(['a', 1], dtype=object)),
+        (compile_column(typing.Annotated[int, Check(lambda s: s >= 0)]), np.arange(-1, 1)),
+        (compile_column(float), np.arange(10)),
+    ]
+    assert find_invalid_columns(columns, workers=workers) == [None, None, 'int', '-1 (failed <lambda>)', 'int64']
+
+
+def test_picklable():
+    assert compile_column(typing.Optional[str]).picklable
+    assert not compile_column(typing.Annotated[int, Check(lambda s: s >= 0)]).picklable
+
+
+def test_sample_policy_positions():
+    policy = SamplePolicy(size=10, head_tail=2, method='stratified')
+    assert policy.positions(14) is None
+    positions = policy.positions(1_000)
+    assert list(positions[:2]) == [0, 1] and list(positions[-2:]) == [998, 999]
+    assert len(positions) == 14
+
+    positions = SamplePolicy(size=10, head_tail=2, seed=0).positions(1_000)
+    assert len(positions) <= 14 and (np.diff(positions) > 0).all()
+
+    with pytest.raises(ValueError):
+        SamplePolicy(method='foo')
+
+
+def test_sample_policy_sample():
+    policy = SamplePolicy(size=10, head_tail=2, seed=0)
+    values = pd.Series(['a'] * 1_000, dtype=object)
+
+    sampled, report = policy.sample(compile_column(str), values)
+    assert len(sampled) == report.checked <= 14
+    assert report.total == 1_000
+    assert 0 < report.max_invalid_fraction < 1
+
+    # the dtype is enough to validate it - no need to sample
+    sampled, report = policy.sample(compile_column(int), pd.Series(np.arange(1_000)))
+    assert len(sampled) == 1_000 and report is None
+
+
+def test_as_column_values_consumes_generators_only_once():
+    assert as_column_values(x for x in 'ab') == ['a', 'b']
+    assert as_column_values((1, 2)) == [1, 2]
+    values = [1, 2]
+    assert as_column_values(values) is values
+    assert as_column_values('abc') == 'abc'
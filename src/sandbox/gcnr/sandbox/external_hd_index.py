@@ -1,12 +1,21 @@
 import os
 import datetime
 
-import shutil
-from sqlalchemy import Column, Integer, String, DateTime, create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
-import pandas as pd
+import sqlite3
+from collections import defaultdict
+
+from sqlalchemy import Column, Integer, String, DateTime, Index, create_engine, inspect, select, text, update
+from sqlalchemy import bindparam, case, event, func
+from sqlalchemy import table as sql_table, column as sql_column
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import declarative_base
+# pandas (and pyarrow) are imported by the functions that need them: indexing and searching don't
 import argparse
+import itertools
+import hashlib
+import concurrent.futures
+import queue
+import threading
 import time
 
 Base = declarative_base()
@@ -31,111 +40,1029 @@ class FileSystemEntry(Base):
     modified = Column(DateTime)
     created = Column(DateTime)
     comment = Column(String)
+    # when the entry was (last) indexed
     insert_datetime = Column(DateTime)
+    # when the entry was found to be gone from the volume (NULL while it is still there)
+    deleted = Column(DateTime)
+    # hashes of the content of the files (see find_duplicates), valid as long as size and modified don't change
+    partial_hash = Column(String)
+    content_hash = Column(String)
+
+    HASH_COLUMNS = ('partial_hash', 'content_hash')
+
+    __table_args__ = (
+        Index('ix_file_system_entry_volume_path', 'volume_name', 'full_path', unique=True),
+        Index('ix_file_system_entry_volume_dirname', 'volume_name', 'dirname'),
+        Index('ix_file_system_entry_extension', 'extension'),
+        Index('ix_file_system_entry_size', 'size'),
+        Index('ix_file_system_entry_modified', 'modified'),
+    )
+
 
-# TODO: make (volume_name, full_path) unique
+# Full-text index of the paths (an FTS5 "external content" table: it only stores the index, kept up to date
+# by the triggers). The trigram tokenizer makes it a (case insensitive) substring index.
+fts_table = sql_table('file_system_entry_fts', sql_column('rowid'), sql_column('full_path'),
+                      sql_column('basename'))
 
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE file_system_entry_fts USING fts5(
+           full_path, basename, content='file_system_entry', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER file_system_entry_fts_insert AFTER INSERT ON file_system_entry BEGIN
+           INSERT INTO file_system_entry_fts(rowid, full_path, basename)
+           VALUES (new.id, new.full_path, new.basename);
+       END""",
+    """CREATE TRIGGER file_system_entry_fts_delete AFTER DELETE ON file_system_entry BEGIN
+           INSERT INTO file_system_entry_fts(file_system_entry_fts, rowid, full_path, basename)
+           VALUES ('delete', old.id, old.full_path, old.basename);
+       END""",
+    """CREATE TRIGGER file_system_entry_fts_update AFTER UPDATE OF full_path, basename ON file_system_entry
+       BEGIN
+           INSERT INTO file_system_entry_fts(file_system_entry_fts, rowid, full_path, basename)
+           VALUES ('delete', old.id, old.full_path, old.basename);
+           INSERT INTO file_system_entry_fts(rowid, full_path, basename)
+           VALUES (new.id, new.full_path, new.basename);
+       END""",
+]
 
-path_to_db = os.path.expandvars('$HOME/external_hd.db')
-engine = create_engine('sqlite:///{}'.format(path_to_db))
 
-Base.metadata.create_all(engine)
+class Volume(Base):
+    __tablename__ = 'volume'
 
-Session = sessionmaker(bind=engine)
+    volume_name = Column(String(255), primary_key=True)
+    # number of directories listed in parallel when indexing the volume
+    workers = Column(Integer)
 
-session = Session()
 
-def backup_existing_db():
-    shutil.copy(path_to_db, path_to_db+'.bak')
+class DirectoryUsage(Base):
+    """
+    The space used under each directory (recursively), maintained by index_volume (see update_rollups).
+    """
+    __tablename__ = 'directory_usage'
+
+    volume_name = Column(String(255), primary_key=True)
+    full_path = Column(String, primary_key=True)
+    # the directory it is in (NULL for the top directory of the volume)
+    parent = Column(String)
+    size = Column(Integer)
+    files = Column(Integer)
+
+    __table_args__ = (
+        Index('ix_directory_usage_volume_parent', 'volume_name', 'parent'),
+    )
+
+
+class ExtensionUsage(Base):
+    """
+    The space used under each directory (recursively) by extension.
+    """
+    __tablename__ = 'extension_usage'
+
+    volume_name = Column(String(255), primary_key=True)
+    full_path = Column(String, primary_key=True)
+    extension = Column(String, primary_key=True)
+    size = Column(Integer)
+    files = Column(Integer)
+
+
+# the database is $HOME/external_hd.db, unless this environment variable says otherwise
+DB_PATH_VARIABLE = 'EXTERNAL_HD_DB'
+
+_engine = None
+# the session of the older versions' `session` global (see __getattr__)
+_session = None
+
+
+def get_db_path():
+    return os.environ.get(DB_PATH_VARIABLE) or os.path.expandvars('$HOME/external_hd.db')
+
+
+def get_engine():
+    """
+    The engine of the database (see get_db_path), created (and the database upgraded) on first use.
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_db_engine(get_db_path())
+    return _engine
+
+
+def get_session():
+    """ A new ORM session on the database (e.g. for IPython Notebook).
+    """
+    from sqlalchemy.orm import Session
+    return Session(bind=get_engine())
+
+
+def create_db_engine(path):
+    """
+    Creates an engine for the database at `path` (creating or upgrading it when needed).
+
+    The database is in WAL mode, so that several processes can use it at the same time (readers
+    don't block the writer, and a writer waits for the other one instead of failing).
+    """
+    engine = create_engine('sqlite:///{}'.format(path), connect_args={'timeout': 30})
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    upgrade_db(engine)
+    return engine
+
+
+def __getattr__(name):
+    # the module globals of the older versions (created on first use now)
+    if name == 'engine':
+        return get_engine()
+    if name == 'session':
+        # the same one every time, as it was (hd.session.add(entry); hd.session.commit())
+        global _session
+        if _session is None:
+            _session = get_session()
+        return _session
+    if name == 'path_to_db':
+        return get_db_path()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def upgrade_db(engine):
+    """
+    Creates the tables, and brings the databases created by older versions up to date:
+    adds the missing columns and the indexes (removing the duplicated entries first -
+    only the most recent one of each (volume_name, full_path) is kept), the full-text index and
+    the rollups.
+    """
+    missing_rollups = not inspect(engine).has_table(DirectoryUsage.__tablename__)
+    Base.metadata.create_all(engine)
+    table = FileSystemEntry.__table__
+    with engine.begin() as conn:
+        existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(engine.dialect))))
+
+        existing_indexes = {i['name'] for i in inspect(conn).get_indexes(table.name)}
+        if 'ix_file_system_entry_volume_path' not in existing_indexes:
+            conn.execute(text(
+                'DELETE FROM file_system_entry WHERE id NOT IN '
+                '(SELECT MAX(id) FROM file_system_entry GROUP BY volume_name, full_path)'))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+        if not inspect(conn).has_table(fts_table.name):
+            for ddl in FTS_DDL:
+                conn.execute(text(ddl))
+            # index the entries that are already there
+            conn.execute(text("INSERT INTO file_system_entry_fts(file_system_entry_fts) VALUES ('rebuild')"))
+
+        volumes = conn.execute(select(table.c.volume_name).distinct()).scalars().all() if missing_rollups else []
+    for volume_name in volumes:
+        update_rollups(volume_name, engine=engine)
+
+
+# a backup younger than this (and than the last change of the database) is not done again
+BACKUP_MAX_AGE = datetime.timedelta(hours=24)
+# pages copied at a time by the backup, the database can be used by other processes in between
+BACKUP_PAGES = 4096
+
+
+def backup_existing_db(path_to_db=None, max_age=BACKUP_MAX_AGE, pages=BACKUP_PAGES):
+    """
+    Backs up the database to <path>.bak, with the SQLite online backup API: it's a consistent
+    copy even while the database is being written, and it is done `pages` pages at a time.
+    It's written to a temporary file first, so a failed backup doesn't destroy the previous one.
+
+    Nothing is done when the backup is less than `max_age` old, or when the database didn't
+    change since (so re-indexing often only copies the database once in a while).
+
+    Returns whether the backup was done.
+    """
+    path_to_db = str(path_to_db or get_db_path())
+    backup_path = path_to_db + '.bak'
+    if not os.path.exists(path_to_db):
+        return False
+
+    if os.path.exists(backup_path):
+        backup_mtime = os.path.getmtime(backup_path)
+        db_mtime = max(os.path.getmtime(p) for p in [path_to_db, path_to_db + '-wal'] if os.path.exists(p))
+        if db_mtime <= backup_mtime or time.time() - backup_mtime < max_age.total_seconds():
+            return False
+
+    tmp_path = backup_path + '.tmp'
+    source = sqlite3.connect(path_to_db)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=pages)
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp_path, backup_path)
+    return True
+
+
+BATCH_SIZE = 10000
+# bytes hashed at the beginning and at the end of the files to tell apart the ones of the same size
+PARTIAL_HASH_SIZE = 64 * 1024
+HASH_BUFFER_SIZE = 1024 * 1024
+# directories listed (and waiting to be written) at most at any time by the parallel traversal
+QUEUE_SIZE = 1000
 
 
 def main():
     """
     This method creates a full catalogue/index of a directory.
     It stores the data in the Database file: $HOME/external_hd.db
+
+    When the volume was indexed before, only the directories whose mtime changed are
+    listed again (see index_volume) - use --full to rescan everything.
+    """
+    t0 = time.perf_counter()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('volume_name')
+    parser.add_argument('path', nargs='?', default='.',
+                        help='the directory to be indexed (default: current directory)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='number of rows written (and committed) at a time')
+    parser.add_argument('--full', action='store_true',
+                        help='rescan the whole volume, even the directories that did not change')
+    parser.add_argument('--workers', type=int,
+                        help='number of directories listed in parallel (remembered for the volume): '
+                             'a few for spinning disks, more for SSDs and network disks (default: 1)')
+    parser.add_argument('--backup-every', type=float, default=BACKUP_MAX_AGE.total_seconds() / 3600,
+                        help='back up the database when the last backup is older than this many hours '
+                             '(default: %(default)s, 0: every time)')
+    parser.add_argument('--no-backup', action='store_true')
+    args = parser.parse_args()
+
+    if not args.no_backup:
+        backup_existing_db(max_age=datetime.timedelta(hours=args.backup_every))
+
+    workers = volume_workers(args.volume_name, args.workers)
+    stats = index_volume(args.volume_name, args.path, batch_size=args.batch_size, full=args.full,
+                         workers=workers)
+
+    t1 = time.perf_counter()
+    print('Indexed %d entries, %d deleted, %d unchanged directories skipped - indexing took %.2f s'
+          % (stats['upserted'], stats['deleted'], stats['skipped'], t1-t0))
+
+
+def volume_workers(volume_name, workers=None, engine=None):
+    """
+    Returns the number of workers to index the volume with: `workers` when given (and then it is
+    stored for the next runs), otherwise the one stored for the volume (1 if there is none).
+    """
+    engine = engine or get_engine()
+    table = Volume.__table__
+    with engine.begin() as conn:
+        if workers is not None:
+            stmt = insert(table).values(volume_name=volume_name, workers=workers)
+            conn.execute(stmt.on_conflict_do_update(index_elements=['volume_name'],
+                                                    set_={'workers': workers}))
+            return workers
+        stored = conn.execute(select(table.c.workers).where(table.c.volume_name == volume_name)).scalar()
+    return stored or 1
+
+
+def index_volume(volume_name, top='.', engine=None, batch_size=BATCH_SIZE, full=False, workers=1, dirs=None):
+    """
+    Indexes the directory tree under `top` as `volume_name`.
+
+    The first time (or with full=True) every entry is scanned and upserted, and the entries of
+    the volume that were not seen are marked as deleted.
+
+    Otherwise it's incremental: a directory whose mtime didn't change since the last run has
+    the same entries, so it is not listed again (only its known subdirectories are visited).
+    The directories that changed are listed and only their new or modified entries are upserted,
+    the ones that are gone are marked as deleted (with all their contents).
+    Note that a directory mtime doesn't change when a file in it is modified in place - use
+    full=True to pick those up.
+
+    With workers > 1 the directories are listed by that many threads (see _walk), and all the
+    writes are done by the calling thread.
+
+    dirs: only list these directories of the volume (and the new directories found in them), whatever
+        their mtime - e.g. the ones where a file system watch saw changes.
+
+    The rollups of the directories that changed (and of their parents) are updated at the end.
+
+    Returns counts of what was done: upserted, deleted, listed and skipped (directories).
+    """
+    engine = engine or get_engine()
+    index_datetime = datetime.datetime.now()
+    top = os.path.normpath(top)
+    table = FileSystemEntry.__table__
+    stats = {'upserted': 0, 'deleted': 0, 'listed': 0, 'skipped': 0}
+    changed_dirs = set()
+
+    with engine.connect() as conn:
+        known_dirs = {} if full or dirs is not None else dict(conn.execute(
+            select(table.c.full_path, table.c.modified).where(
+                table.c.volume_name == volume_name,
+                table.c.type == FileSystemEntry.DIR,
+                table.c.deleted.is_(None))).all())
+        full_scan = not known_dirs and dirs is None
+
+        if not full_scan:
+            changes = _scan_changes(engine, volume_name, top, known_dirs, index_datetime, workers, dirs)
+        else:
+            changes = (('upsert', row) for row in scan(volume_name, top, index_datetime, workers))
+
+        for batch in _batched(changes, batch_size):
+            upserts = [row for op, row in batch if op == 'upsert']
+            if upserts:
+                conn.execute(_upsert_statement(), upserts)
+                stats['upserted'] += len(upserts)
+            for op, path in batch:
+                if op == 'delete':
+                    stats['deleted'] += _mark_deleted(conn, volume_name, path, index_datetime)
+                    changed_dirs.add(path)
+                elif op in ('listed', 'skipped'):
+                    stats[op] += 1
+                    if op == 'listed':
+                        changed_dirs.add(path)
+            conn.commit()
+
+        if full_scan:
+            # everything that is still there was just upserted
+            result = conn.execute(update(table).where(
+                table.c.volume_name == volume_name,
+                table.c.insert_datetime < index_datetime,
+                table.c.deleted.is_(None)).values(deleted=index_datetime))
+            stats['deleted'] += result.rowcount
+            conn.commit()
+
+    update_rollups(volume_name, None if full_scan else changed_dirs, engine)
+    return stats
+
+
+def _scan_changes(engine, volume_name, top, known_dirs, index_datetime, workers=1, dirs=None):
+    """
+    Yields ('upsert', row) and ('delete', full_path) for the changes since the last run
+    (see index_volume), and ('listed' | 'skipped', dirpath) for every directory visited.
+
+    When `dirs` are given, only those are visited (plus the new directories found in them).
+    """
+    table = FileSystemEntry.__table__
+    subdirs = defaultdict(list)
+    for path in known_dirs:
+        if path != top:
+            subdirs[os.path.dirname(path) or '.'].append(path)
+
+    def visit(item):
+        dirpath, st = item
+
+        if known_dirs.get(dirpath) == _utc(st.st_mtime):
+            children = []
+            for subdir in subdirs[dirpath]:
+                try:
+                    children.append((subdir, os.stat(subdir, follow_symlinks=False)))
+                except OSError:
+                    continue
+            return [('skipped', dirpath)], children
+
+        with engine.connect() as conn:
+            existing = {path: (type_, size, modified) for path, type_, size, modified in conn.execute(
+                select(table.c.full_path, table.c.type, table.c.size, table.c.modified).where(
+                    table.c.volume_name == volume_name,
+                    table.c.dirname == dirpath,
+                    table.c.deleted.is_(None)))}
+
+        changes, children, seen = [('listed', dirpath)], [], set()
+        for path, type_, entry_st in _list_dir(dirpath):
+            seen.add(path)
+            if type_ == FileSystemEntry.DIR:
+                # its own row is upserted when it is visited (if it is new or it changed)
+                if dirs is None or existing.get(path, (None,))[0] != FileSystemEntry.DIR:
+                    children.append((path, entry_st))
+            elif existing.get(path) != (type_, entry_st.st_size, _utc(entry_st.st_mtime)):
+                changes.append(('upsert', _file_row(volume_name, path, dirpath, type_, entry_st,
+                                                    index_datetime)))
+
+        changes.extend(('delete', path) for path in existing.keys() - seen)
+
+        parent = os.path.dirname(top) if dirpath == top else os.path.dirname(dirpath) or '.'
+        changes.append(('upsert', _dir_row(volume_name, dirpath, parent, st, index_datetime)))
+        return changes, children
+
+    if dirs is None:
+        return _walk((top, os.stat(top)), visit, workers)
+
+    def visit_dirs(item):
+        if item is not None:
+            return visit(item)
+        children = []
+        for dirpath in dirs:
+            try:
+                children.append((os.path.normpath(dirpath), os.stat(dirpath, follow_symlinks=False)))
+            except OSError:
+                # gone: it's marked as deleted when its parent is listed
+                continue
+        return [], children
+
+    return _walk(None, visit_dirs, workers)
+
+
+def _mark_deleted(conn, volume_name, path, index_datetime):
+    """
+    Marks the entry (and everything under it, when it is a directory) as deleted.
+    """
+    table = FileSystemEntry.__table__
+    result = conn.execute(update(table).where(
+        table.c.volume_name == volume_name,
+        _is_under(table.c.full_path, path),
+        table.c.deleted.is_(None)).values(deleted=index_datetime))
+    return result.rowcount
+
+
+def _upsert_statement():
+    table = FileSystemEntry.__table__
+    stmt = insert(table)
+    set_ = {c.name: stmt.excluded[c.name] for c in table.columns
+            if c.name not in ('id', 'volume_name', 'full_path') + FileSystemEntry.HASH_COLUMNS}
+    # the hashes are kept while the file didn't change
+    unchanged = (table.c.size == stmt.excluded.size) & (table.c.modified == stmt.excluded.modified)
+    for name in FileSystemEntry.HASH_COLUMNS:
+        set_[name] = case((unchanged, table.c[name]), else_=None)
+    return stmt.on_conflict_do_update(index_elements=['volume_name', 'full_path'], set_=set_)
+
+
+def scan(volume_name, top='.', insert_datetime=None, workers=1):
+    """
+    Walks the directory tree under `top` (with os.scandir, so the stat of every entry
+    is done only once) and yields the rows for the file_system_entry table as dicts.
+
+    With workers > 1 the directories are listed in parallel, and the rows are yielded
+    in no particular order.
+    """
+    insert_datetime = insert_datetime or datetime.datetime.now()
+    top = os.path.normpath(top)
+
+    def visit(dirpath):
+        rows, children = [], []
+        for path, type_, st in _list_dir(dirpath):
+            if type_ == FileSystemEntry.DIR:
+                children.append(path)
+                rows.append(_dir_row(volume_name, path, dirpath, st, insert_datetime))
+            else:
+                rows.append(_file_row(volume_name, path, dirpath, type_, st, insert_datetime))
+        return rows, children
+
+    yield _dir_row(volume_name, top, os.path.dirname(top), os.stat(top), insert_datetime)
+    yield from _walk(top, visit, workers)
+
+
+def _walk(top, visit, workers=1, queue_size=QUEUE_SIZE):
+    """
+    Calls `visit(item)` -> (results, children) for `top` and all the children it returns
+    (recursively), and yields the results.
+
+    With workers > 1 the items are visited by a pool of threads: every visit submits its children
+    to the pool, so an idle thread picks up whatever directory is waiting, wherever it is in the tree
+    (listing directories is bound by the I/O latency of the disk, the GIL is released meanwhile).
+    The results go through a bounded queue to the consumer, so a slow consumer (e.g. the
+    database writes) throttles the listing instead of piling up rows in memory.
+    """
+    if workers <= 1:
+        stack = [top]
+        while stack:
+            results, children = visit(stack.pop())
+            yield from results
+            stack.extend(children)
+        return
+
+    results = queue.Queue(queue_size)
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = 1
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=.1)
+                return
+            except queue.Full:
+                continue
+
+    def task(item):
+        nonlocal pending
+        try:
+            if stop.is_set():
+                return
+            items, children = visit(item)
+            with lock:
+                pending += len(children)
+            for child in children:
+                executor.submit(task, child)
+            put(items)
+        except BaseException as e:
+            put(e)
+        finally:
+            with lock:
+                pending -= 1
+                done = not pending
+            if done:
+                put(None)
+
+    executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='external_hd_index')
+    try:
+        executor.submit(task, top)
+        while (items := results.get()) is not None:
+            if isinstance(items, BaseException):
+                raise items
+            yield from items
+    finally:
+        stop.set()
+        executor.shutdown(cancel_futures=True)
+
+
+def _list_dir(dirpath):
+    """
+    Returns (path, type, stat) for every entry of the directory (nothing if it can't be read).
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+    except OSError:
+        # e.g.: permission denied - nothing we can index in there
+        return []
+
+    result = []
+    for entry in entries:
+        path = os.path.join(dirpath, entry.name) if dirpath != '.' else entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                type_ = FileSystemEntry.DIR
+            elif entry.is_symlink():
+                type_ = FileSystemEntry.LINK
+            else:
+                type_ = FileSystemEntry.FILE
+            result.append((path, type_, entry.stat(follow_symlinks=False)))
+        except OSError:
+            continue
+    return result
+
+
+def _dir_row(volume_name, path, dirname, st, insert_datetime):
+    return {
+        'volume_name': volume_name,
+        'full_path': path,
+        'dirname': dirname,
+        'basename': os.path.basename(path),
+        'basename_noext': None,
+        'extension': None,
+        'type': FileSystemEntry.DIR,
+        'size': None,
+        'modified': _utc(st.st_mtime),
+        'created': _utc(st.st_ctime),
+        'comment': None,
+        'insert_datetime': insert_datetime,
+    }
+
+
+def _file_row(volume_name, path, dirname, type_, st, insert_datetime):
+    basename = os.path.basename(path)
+    basename_noext, extension = os.path.splitext(basename)
+    return {
+        'volume_name': volume_name,
+        'full_path': path,
+        'dirname': dirname,
+        'basename': basename,
+        'basename_noext': basename_noext,
+        'extension': extension.lstrip('.').lower(),
+        'type': type_,
+        'size': st.st_size,
+        'modified': _utc(st.st_mtime),
+        'created': _utc(st.st_ctime),
+        'comment': None,
+        'insert_datetime': insert_datetime,
+    }
+
+
+def _utc(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _batched(iterable, n):
+    it = iter(iterable)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+
+def update_rollups(volume_name, dirs=None, engine=None):
+    """
+    Updates the directory_usage and extension_usage rollups of the volume: of all the directories,
+    or only of `dirs` (the directories that changed, or were deleted) and their parents.
+
+    The directories are done bottom up: the rollup of a directory is its files plus the
+    rollups of its subdirectories (the stored ones, for the subdirectories that didn't change).
+    """
+    engine = engine or get_engine()
+    table = FileSystemEntry.__table__
+    dir_usage = DirectoryUsage.__table__
+    ext_usage = ExtensionUsage.__table__
+
+    with engine.connect() as conn:
+        # {path: parent}
+        known = dict(conn.execute(select(table.c.full_path, table.c.dirname).where(
+            table.c.volume_name == volume_name, table.c.type == FileSystemEntry.DIR,
+            table.c.deleted.is_(None))).all())
+        children = defaultdict(list)
+        for path, parent in known.items():
+            if parent in known:
+                children[parent].append(path)
+
+        if dirs is None:
+            affected = set(known)
+            conn.execute(dir_usage.delete().where(dir_usage.c.volume_name == volume_name))
+            conn.execute(ext_usage.delete().where(ext_usage.c.volume_name == volume_name))
+        else:
+            affected = set()
+            for path in dirs:
+                if path not in known:
+                    # deleted (a directory, with its subdirectories, or a file)
+                    for usage in [dir_usage, ext_usage]:
+                        conn.execute(usage.delete().where(usage.c.volume_name == volume_name,
+                                                          _is_under(usage.c.full_path, path)))
+                    path = os.path.dirname(path) or '.'
+                while path in known and path not in affected:
+                    affected.add(path)
+                    path = known[path]
+
+        totals = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        # the files directly in the directories
+        files = (select(table.c.dirname, table.c.extension, func.coalesce(func.sum(table.c.size), 0), func.count())
+                 .where(table.c.volume_name == volume_name, table.c.type != FileSystemEntry.DIR,
+                        table.c.deleted.is_(None))
+                 .group_by(table.c.dirname, table.c.extension))
+        stored = [child for path in affected for child in children[path] if child not in affected]
+        for paths in ([None] if dirs is None else _batched(affected, 500)):
+            query = files if paths is None else files.where(table.c.dirname.in_(paths))
+            for dirname, extension, size, count in conn.execute(query):
+                if dirname in affected:
+                    totals[dirname][extension or ''] = [size, count]
+        # the subdirectories that didn't change
+        for paths in _batched(stored, 500):
+            for path, extension, size, count in conn.execute(
+                    select(ext_usage.c.full_path, ext_usage.c.extension, ext_usage.c.size, ext_usage.c.files)
+                    .where(ext_usage.c.volume_name == volume_name, ext_usage.c.full_path.in_(paths))):
+                totals[path][extension] = [size, count]
+
+        depths = {}
+
+        def depth(path):
+            if path not in depths:
+                parent = known[path]
+                depths[path] = depth(parent) + 1 if parent in known else 0
+            return depths[path]
+
+        for path in sorted(affected, key=depth, reverse=True):
+            for child in children[path]:
+                for extension, (size, count) in totals[child].items():
+                    total = totals[path][extension]
+                    total[0] += size
+                    total[1] += count
+
+        for paths in _batched(affected, 500):
+            if dirs is not None:
+                for usage in [dir_usage, ext_usage]:
+                    conn.execute(usage.delete().where(usage.c.volume_name == volume_name,
+                                                      usage.c.full_path.in_(paths)))
+            conn.execute(dir_usage.insert(), [
+                {'volume_name': volume_name, 'full_path': path,
+                 'parent': known[path] if known[path] in known else None,
+                 'size': sum(size for size, count in totals[path].values()),
+                 'files': sum(count for size, count in totals[path].values())}
+                for path in paths])
+            ext_rows = [{'volume_name': volume_name, 'full_path': path, 'extension': extension,
+                         'size': size, 'files': count}
+                        for path in paths for extension, (size, count) in totals[path].items()]
+            if ext_rows:
+                conn.execute(ext_usage.insert(), ext_rows)
+        conn.commit()
+
+
+def _is_under(column, path):
+    if path == '.':
+        # relative paths (the volume was indexed from its top directory)
+        return column.is_not(None)
+    # the paths under `path` are the ones between 'path/' and 'path0' ('0' comes right after '/')
+    return (column == path) | ((column > path + os.sep) & (column < path + chr(ord(os.sep) + 1)))
+
+
+def disk_usage(volume_name, path=None, engine=None):
+    """
+    Returns the space used (size and number of files) under the directory and under each of its
+    subdirectories (the largest first), from the rollups. The top directory of the volume by default.
+    """
+    engine = engine or get_engine()
+    usage = DirectoryUsage.__table__
+    with engine.connect() as conn:
+        if path is None:
+            directory = conn.execute(select(usage).where(usage.c.volume_name == volume_name,
+                                                         usage.c.parent.is_(None))).first()
+        else:
+            directory = conn.execute(select(usage).where(usage.c.volume_name == volume_name,
+                                                         usage.c.full_path == os.path.normpath(path))).first()
+        if directory is None:
+            return None, []
+        subdirectories = conn.execute(select(usage).where(usage.c.volume_name == volume_name,
+                                                          usage.c.parent == directory.full_path)
+                                      .order_by(usage.c.size.desc())).all()
+    return directory, subdirectories
+
+
+def top_extensions(volume_name, path=None, n=10, engine=None):
+    """
+    The extensions using the most space under the directory (the top directory of the volume by default).
+    """
+    engine = engine or get_engine()
+    dir_usage = DirectoryUsage.__table__
+    ext_usage = ExtensionUsage.__table__
+    if path is None:
+        directories = select(dir_usage.c.full_path).where(dir_usage.c.volume_name == volume_name,
+                                                          dir_usage.c.parent.is_(None))
+    else:
+        directories = [os.path.normpath(path)]
+    query = (select(ext_usage.c.extension, ext_usage.c.size, ext_usage.c.files)
+             .where(ext_usage.c.volume_name == volume_name, ext_usage.c.full_path.in_(directories))
+             .order_by(ext_usage.c.size.desc()).limit(n))
+    with engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def largest_files(volume_name=None, path=None, n=10, engine=None):
+    """
+    The largest files (of the volume, under the directory), from the index on size.
+    """
+    # (min_size: the directories have no size)
+    return search(volume_name=volume_name, under=path, min_size=0, order_by='size', limit=n, engine=engine)
+
+
+def du():
+    """
+    Prints the space used under a directory of a volume (like du), the extensions using most
+    of it and the largest files.
     """
-    t0 = time.clock()
     parser = argparse.ArgumentParser()
     parser.add_argument('volume_name')
+    parser.add_argument('path', nargs='?', help='default: the top directory of the volume')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of extensions and files reported (default: %(default)s, 0: none)')
     args = parser.parse_args()
 
-    backup_existing_db()
-
-    insert_datetime = datetime.datetime.now()
-    volume_name = args.volume_name
-    for dirpath, dirnames, filenames in os.walk(''):
-        normdir = os.path.normpath(dirpath).decode('utf-8')
-        entry = FileSystemEntry(
-            volume_name=volume_name,
-            full_path=normdir,
-            dirname=os.path.dirname(normdir),
-            basename=os.path.basename(normdir),
-            basename_noext=None,
-            extension=None,
-            type=FileSystemEntry.DIR,
-            size=None,
-            modified=datetime.datetime.utcfromtimestamp(
-                os.path.getmtime(normdir)),
-            created=datetime.datetime.utcfromtimestamp(
-                os.path.getctime(normdir)),
-            comment=None,
-            insert_datetime=insert_datetime,
-        )
-        session.add(entry)
-
-        for filename in filenames:
-                normfile = os.path.normpath(
-                    os.path.join(dirpath, filename)).decode('utf-8')
-                basename = os.path.basename(normfile)
-                basename_noext, extension = os.path.splitext(basename)
-                entry = FileSystemEntry(
-                    volume_name=volume_name,
-                    full_path=normfile,
-                    dirname=normdir,
-                    basename=basename,
-                    basename_noext=basename_noext,
-                    extension=extension.lstrip('.').lower(),
-                    type=FileSystemEntry.FILE,
-                    size=os.path.getsize(normfile),
-                    modified=datetime.datetime.utcfromtimestamp(
-                        os.path.getmtime(normfile)),
-                    created=datetime.datetime.utcfromtimestamp(
-                        os.path.getctime(normfile)),
-                    comment=None,
-                    insert_datetime=insert_datetime,
-                )
-                session.add(entry)
-
-    session.commit()
-
-    t1 = time.clock()
-    print 'Indexing took %.2f s' % (t1-t0)
-
-
-def get_df():
-    """
-    Queries the SQL database and returns a full pandas DataFrame
-    with the entire index of the files to be manipulated.
+    directory, subdirectories = disk_usage(args.volume_name, args.path)
+    if directory is None:
+        parser.exit(1, 'Unknown directory\n')
+    for row in subdirectories + [directory]:
+        print('{:>10}\t{:>8}\t{}'.format(_human_size(row.size), row.files, row.full_path))
+
+    if args.top:
+        print()
+        for row in top_extensions(args.volume_name, directory.full_path, args.top):
+            print('{:>10}\t{:>8}\t.{}'.format(_human_size(row.size), row.files, row.extension))
+        print()
+        for row in largest_files(args.volume_name, directory.full_path, args.top):
+            print('{:>10}\t{}'.format(_human_size(row.size), row.full_path))
+
+
+def _human_size(size):
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if size < 1024 or unit == 'T':
+            return '{:.1f}{}'.format(size, unit) if unit != 'B' else '{}B'.format(size)
+        size /= 1024
+
+
+def find_duplicates(volume_name=None, min_size=1, roots=None, engine=None):
+    """
+    Finds the files with the same content (across volumes, unless `volume_name` is given).
+
+    Only the files of the same size can be duplicates. Among those, the first and last
+    PARTIAL_HASH_SIZE bytes are hashed, and only the ones that still collide are hashed in full.
+    The hashes are stored in the database and reused as long as the files don't change (so
+    the volumes hashed before don't need to be mounted).
+
+    roots: {volume_name: directory} where the (relative) paths of each volume are found. The volumes
+        that are not in it are not read (only their stored hashes are used). By default, only the
+        files of `volume_name` are read, from the current directory: the paths of the other volumes
+        (e.g. '.' indexed by main() for every volume) could be the ones of another volume.
+
+    Returns the groups of duplicated entries (lists of rows), the largest files first.
+    """
+    engine = engine or get_engine()
+    if roots is None:
+        roots = {volume_name: '.'} if volume_name is not None else {}
+    table = FileSystemEntry.__table__
+    conditions = [table.c.type == FileSystemEntry.FILE, table.c.deleted.is_(None), table.c.size >= min_size]
+    if volume_name is not None:
+        conditions.append(table.c.volume_name == volume_name)
+    shared_sizes = select(table.c.size).where(*conditions).group_by(table.c.size).having(func.count() > 1)
+    query = (select(table.c.id, table.c.volume_name, table.c.full_path, table.c.size, table.c.modified,
+                    table.c.partial_hash, table.c.content_hash)
+             .where(*conditions, table.c.size.in_(shared_sizes))
+             .order_by(table.c.size.desc(), table.c.id))
+
+    duplicates = []
+    with engine.connect() as conn:
+        rows = conn.execute(query).all()
+        for size, same_size in itertools.groupby(rows, key=lambda r: r.size):
+            same_size = list(same_size)
+            partial_hashes = _hashes(conn, same_size, 'partial_hash', _partial_hash, roots)
+
+            for partial, candidates in _groups(same_size, partial_hashes).items():
+                if len(candidates) < 2:
+                    continue
+                if size <= 2 * PARTIAL_HASH_SIZE:
+                    # the partial hash covers the whole file
+                    content_hashes = {r.id: partial for r in candidates}
+                else:
+                    content_hashes = _hashes(conn, candidates, 'content_hash', _content_hash, roots)
+                duplicates.extend(group for group in _groups(candidates, content_hashes).values()
+                                  if len(group) > 1)
+            conn.commit()
+    return duplicates
+
+
+def _groups(rows, hashes):
+    groups = defaultdict(list)
+    for row in rows:
+        if hashes.get(row.id) is not None:
+            groups[hashes[row.id]].append(row)
+    return groups
+
+
+def _hashes(conn, rows, column, hash_file, roots):
+    """
+    Returns {id: hash} of the rows (None for the files that can't be read), computing and storing
+    the ones that are not in the database yet.
+    """
+    hashes = {row.id: getattr(row, column) for row in rows}
+    computed = []
+    for row in rows:
+        if hashes[row.id] is not None:
+            continue
+        path = _resolve(row, roots)
+        if path is None:
+            continue
+        try:
+            st = os.stat(path)
+            if st.st_size != row.size or _utc(st.st_mtime) != row.modified:
+                # it changed since it was indexed
+                continue
+            hashes[row.id] = hash_file(path, row.size)
+        except OSError:
+            continue
+        computed.append({'entry_id': row.id, 'hash': hashes[row.id]})
+
+    if computed:
+        table = FileSystemEntry.__table__
+        conn.execute(update(table).where(table.c.id == bindparam('entry_id')).values({column: bindparam('hash')}),
+                     computed)
+    return hashes
+
+
+def _resolve(row, roots):
+    if row.volume_name not in roots:
+        return None
+    return os.path.join(roots[row.volume_name], row.full_path)
+
+
+def _partial_hash(path, size):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        h.update(f.read(PARTIAL_HASH_SIZE))
+        if size > PARTIAL_HASH_SIZE:
+            f.seek(max(PARTIAL_HASH_SIZE, size - PARTIAL_HASH_SIZE))
+            h.update(f.read(PARTIAL_HASH_SIZE))
+    return h.hexdigest()
+
+
+def _content_hash(path, size):
+    h = hashlib.blake2b(digest_size=16)
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while n := f.readinto(buffer):
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+# the columns with few distinct values, loaded as categoricals
+CATEGORICAL_COLUMNS = ['volume_name', 'extension', 'type']
+DATETIME_COLUMNS = ['modified', 'created', 'insert_datetime', 'deleted']
+SHORT_COLUMNS = ['volume_name', 'basename_noext', 'extension', 'full_path', 'size']
+DF_CHUNKSIZE = 100000
+
+
+def get_df(columns=None, where=(), chunksize=None, engine=None):
+    """
+    Queries the SQL database and returns a pandas DataFrame
+    with the index of the files to be manipulated.
 
     Great for using in IPython Notebook.
+
+    columns: the columns to load (default: all of them).
+    where: conditions on the FileSystemEntry columns, e.g. [FileSystemEntry.size > 10**9]
+    chunksize: return an iterator of DataFrames of (at most) that many rows instead.
+
+    volume_name, extension and type are categoricals, the other strings are "string", the dates are
+    datetime64 and size is Int64, so even the whole catalogue fits in memory.
+    The rows are read DF_CHUNKSIZE at a time.
     """
-    query = session.query(FileSystemEntry)
-    df = pd.read_sql(query.statement.compile(engine), engine)
-    return df
+    import pandas as pd
+
+    engine = engine or get_engine()
+    table = FileSystemEntry.__table__
+    columns = list(columns) if columns is not None else [c.name for c in table.columns]
+    query = select(*(table.c[name] for name in columns)).where(*where)
+    parse_dates = [name for name in DATETIME_COLUMNS if name in columns]
+
+    def read_chunks():
+        with engine.connect() as conn:
+            for chunk in pd.read_sql_query(query, conn, chunksize=chunksize or DF_CHUNKSIZE,
+                                           parse_dates=parse_dates):
+                yield _typed(chunk)
+
+    if chunksize is not None:
+        return read_chunks()
+
+    chunks = list(read_chunks())
+    # the same categories for every chunk, so they stay categoricals when concatenated
+    for name in CATEGORICAL_COLUMNS:
+        if name in columns:
+            categories = sorted(set().union(*(c[name].cat.categories for c in chunks)))
+            for chunk in chunks:
+                chunk[name] = chunk[name].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _typed(df):
+    import pandas as pd
+
+    table = FileSystemEntry.__table__
+    # pandas "string" dtype, with pd.NA for the NULLs (otherwise it depends on the NULLs in the chunk)
+    dtypes = {name: pd.StringDtype() for name in df.columns if isinstance(table.c[name].type, String)}
+    dtypes.update({name: 'category' for name in CATEGORICAL_COLUMNS if name in df.columns})
+    if 'size' in df.columns:
+        # NULL for the directories
+        dtypes['size'] = 'Int64'
+    # the same unit in every chunk (a column with only NULLs would be in seconds)
+    dtypes.update({name: 'datetime64[us]' for name in DATETIME_COLUMNS if name in df.columns})
+    return df.astype(dtypes)
 
 
-def get_short_df():
+def get_short_df(where=(), chunksize=None, engine=None):
     """ Fewer columns of the DataFrame returned by get_df().
     """
+    import pandas as pd
+
     pd.set_option('display.width', 5000)
     pd.set_option('display.max_columns', 500)
 
-    df = get_df()
-    df2 = df[['volume_name', 'basename_noext', 'extension', 'full_path', 'size']]
-    return df2
+    return get_df(SHORT_COLUMNS, where, chunksize, engine)
+
+
+def save_snapshot(path, columns=None, where=(), engine=None):
+    """
+    Writes the DataFrame of get_df() to a Parquet file (chunk by chunk), to be loaded with load_snapshot.
+    Needs pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = FileSystemEntry.__table__
+    columns = list(columns) if columns is not None else [c.name for c in table.columns]
+    # the schema can't be taken from the chunks: a column can be all NULLs in one of them, and the
+    # dictionaries of the categoricals differ from chunk to chunk
+    arrow_types = {Integer: pa.int64(), String: pa.string(), DateTime: pa.timestamp('us')}
+    schema = pa.schema([
+        pa.field(name, pa.dictionary(pa.int32(), pa.string()) if name in CATEGORICAL_COLUMNS
+                 else arrow_types[type(table.c[name].type)])
+        for name in columns])
+
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in get_df(columns, where, DF_CHUNKSIZE, engine):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def load_snapshot(path, columns=None, filters=None):
+    """
+    Loads a Parquet file written by save_snapshot (only the given columns and the rows matching
+    the pyarrow `filters`, e.g. [('extension', '==', 'mp3')]).
+    """
+    import pandas as pd
+
+    # with the dtypes of get_df (the string columns would come back with another missing value)
+    return _typed(pd.read_parquet(path, columns=columns, filters=filters))
 
 
 def find(df, filename='', extension=''):
+    """
+    Filters a DataFrame returned by get_df() - use search() to query the database directly.
+    """
     if filename:
         mask = df.full_path.str.lower().str.contains(filename.lower())
         df = df[mask]
@@ -144,3 +1071,81 @@ def find(df, filename='', extension=''):
         df = df[mask]
     return df
 
+
+def search(pattern='', extension='', volume_name=None, min_size=None, max_size=None,
+           modified_after=None, modified_before=None, basename_only=False, include_deleted=False,
+           under=None, order_by=None, limit=None, engine=None):
+    """
+    Searches the index in the database (nothing else is loaded) and returns the matching entries.
+
+    pattern: a substring of the path (or of the basename, with basename_only), case insensitive -
+        looked up in the full-text index when it has at least 3 characters (trigrams).
+    extension: the extension, without the dot, case insensitive.
+    min_size, max_size, modified_after, modified_before: inclusive bounds.
+    under: only the entries under this directory.
+    order_by: 'size' for the largest first (by volume and path by default).
+    """
+    engine = engine or get_engine()
+    table = FileSystemEntry.__table__
+    if order_by == 'size':
+        query = select(table).order_by(table.c.size.desc(), table.c.id)
+    else:
+        query = select(table).order_by(table.c.volume_name, table.c.full_path)
+
+    if pattern:
+        if len(pattern) >= 3:
+            # a phrase: the pattern is matched literally (its quotes are doubled)
+            phrase = '"{}"'.format(pattern.replace('"', '""'))
+            match = fts_table.c.basename if basename_only else fts_table.c.full_path
+            query = query.join(fts_table, fts_table.c.rowid == table.c.id).where(match.match(phrase))
+        else:
+            column = table.c.basename if basename_only else table.c.full_path
+            query = query.where(column.icontains(pattern, autoescape=True))
+    if extension:
+        query = query.where(table.c.extension == extension.lstrip('.').lower())
+    if volume_name is not None:
+        query = query.where(table.c.volume_name == volume_name)
+    if under is not None:
+        under = os.path.normpath(under)
+        query = query.where(_is_under(table.c.full_path, under), table.c.full_path != under)
+    if min_size is not None:
+        query = query.where(table.c.size >= min_size)
+    if max_size is not None:
+        query = query.where(table.c.size <= max_size)
+    if modified_after is not None:
+        query = query.where(table.c.modified >= modified_after)
+    if modified_before is not None:
+        query = query.where(table.c.modified <= modified_before)
+    if not include_deleted:
+        query = query.where(table.c.deleted.is_(None))
+    if limit is not None:
+        query = query.limit(limit)
+
+    with engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def query():
+    """
+    Searches the index: prints the volume, size and path of the matching entries.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pattern', nargs='?', default='',
+                        help='a part of the path (case insensitive)')
+    parser.add_argument('--name', action='store_true', help='match the pattern against the basename only')
+    parser.add_argument('--ext', default='', help='the extension (e.g. mp3)')
+    parser.add_argument('--volume', help='only search in this volume')
+    parser.add_argument('--min-size', type=int, help='in bytes')
+    parser.add_argument('--max-size', type=int, help='in bytes')
+    parser.add_argument('--after', type=datetime.datetime.fromisoformat,
+                        help='modified after (ISO date, UTC)')
+    parser.add_argument('--before', type=datetime.datetime.fromisoformat,
+                        help='modified before (ISO date, UTC)')
+    parser.add_argument('--deleted', action='store_true', help='include the deleted entries')
+    parser.add_argument('--limit', type=int, default=1000, help='default: %(default)s')
+    args = parser.parse_args()
+
+    rows = search(args.pattern, args.ext, args.volume, args.min_size, args.max_size, args.after, args.before,
+                  basename_only=args.name, include_deleted=args.deleted, limit=args.limit)
+    for row in rows:
+        print('{}\t{}\t{}'.format(row.volume_name, '' if row.size is None else row.size, row.full_path))
@@ -0,0 +1,278 @@
+"""
+Keeps the index of a mounted volume up to date: watches its directories with inotify (Linux only)
+and applies the changes to the database (see external_hd_index) in batches.
+
+The events are not applied one by one: the directories they happen in are collected until things
+calm down (or for at most max_delay seconds, during a flood like an rsync), and only those
+directories are listed again. When the kernel event queue overflows, the events are lost: the
+volume is then re-indexed incrementally (only the directories whose mtime changed are listed).
+"""
+import argparse
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+from sandbox.gcnr.sandbox import external_hd_index as hd
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+# seconds without events before the changes are applied
+DEBOUNCE = 1.0
+# seconds at most between an event and the time it is applied (even if the events keep coming)
+MAX_DELAY = 30.0
+
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """
+    A minimal inotify binding (with ctypes, there's none in the standard library).
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+    def _raise(self, path=None):
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e), path)
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(path)
+        return wd
+
+    def rm_watch(self, wd):
+        # it fails (EINVAL) when the watch was already removed, because its directory is gone
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """
+        Returns the events that are ready as (wd, mask, cookie, name) tuples, waiting at most
+        `timeout` seconds for the first one.
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class VolumeWatcher:
+    """
+    Watches the directory tree under `top` and keeps the entries of `volume_name` up to date.
+
+    `counters` counts what was done: the events received, the flushes (batches of changes applied),
+    the directories listed, the entries upserted and deleted, the overflows and the rescans.
+    """
+
+    def __init__(self, volume_name, top='.', engine=None, debounce=DEBOUNCE, max_delay=MAX_DELAY,
+                 batch_size=hd.BATCH_SIZE):
+        self.volume_name = volume_name
+        self.top = os.path.normpath(top)
+        self.engine = engine or hd.get_engine()
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.counters = collections.Counter()
+        self.started = None
+        self._inotify = None
+        self._paths = {}
+        self._wds = {}
+        self._dirty = set()
+        self._rescan = False
+
+    def run(self, stop=None):
+        """
+        Watches (until `stop`, a threading.Event, is set): the volume is first re-indexed
+        (incrementally), so the changes done while it wasn't watched are caught up.
+        """
+        stop = stop or threading.Event()
+        self.started = time.monotonic()
+        with Inotify() as self._inotify:
+            self._watch_tree(self.top)
+            self._index()
+            first_event = last_event = None
+            while not stop.is_set():
+                timeout = .5
+                if first_event is not None:
+                    deadline = min(last_event + self.debounce, first_event + self.max_delay)
+                    timeout = min(timeout, max(0, deadline - time.monotonic()))
+                events = self._inotify.read(timeout)
+                now = time.monotonic()
+                if events:
+                    self._handle(events)
+                    last_event = now
+                    if first_event is None:
+                        first_event = now
+                if first_event is not None and (now >= last_event + self.debounce
+                                                or now >= first_event + self.max_delay):
+                    self.flush()
+                    first_event = last_event = None
+            self.flush()
+        self._inotify = None
+        self._paths.clear()
+        self._wds.clear()
+
+    def flush(self):
+        """
+        Applies the pending changes.
+        """
+        if self._rescan:
+            self._rescan = False
+            self._dirty.clear()
+            self.counters['rescans'] += 1
+            # the watches of the new directories (the events about them may have been lost)
+            self._watch_tree(self.top)
+            self._index()
+        elif self._dirty:
+            dirs, self._dirty = self._dirty, set()
+            self._index(dirs)
+
+    def stats(self):
+        """
+        The counters, and the events and upserted entries per second since the start.
+        """
+        elapsed = time.monotonic() - self.started if self.started else 0
+        stats = dict(self.counters, watches=len(self._wds))
+        for name in ['events', 'upserted']:
+            stats[name + '_per_second'] = self.counters[name] / elapsed if elapsed else 0.
+        return stats
+
+    def _index(self, dirs=None):
+        stats = hd.index_volume(self.volume_name, self.top, engine=self.engine, batch_size=self.batch_size,
+                                dirs=dirs)
+        self.counters['flushes'] += 1
+        for name in ['upserted', 'deleted', 'listed']:
+            self.counters[name] += stats[name]
+
+    def _handle(self, events):
+        for wd, mask, cookie, name in events:
+            self.counters['events'] += 1
+            if mask & IN_Q_OVERFLOW:
+                self.counters['overflows'] += 1
+                self._rescan = True
+                continue
+            if mask & IN_IGNORED:
+                # the directory is gone (or was moved)
+                path = self._paths.pop(wd, None)
+                if path is not None and self._wds.get(path) == wd:
+                    del self._wds[path]
+                continue
+            dirpath = self._paths.get(wd)
+            if dirpath is None:
+                continue
+
+            path = os.path.join(dirpath, name) if dirpath != '.' else name
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # the parent gets the event about it too
+                continue
+            self._dirty.add(dirpath)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path)
+                    # what was created in it before it was watched
+                    self._dirty.add(path)
+                elif mask & IN_MOVED_FROM:
+                    self._unwatch_tree(path)
+
+    def _watch_tree(self, top):
+        stack = [top]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                wd = self._inotify.add_watch(dirpath)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise OSError(e.errno, 'Too many directories to watch, '
+                                           'raise /proc/sys/fs/inotify/max_user_watches', dirpath)
+                # gone, or not readable
+                continue
+            self._paths[wd] = dirpath
+            self._wds[dirpath] = wd
+            stack.extend(path for path, type_, st in hd._list_dir(dirpath) if type_ == hd.FileSystemEntry.DIR)
+
+    def _unwatch_tree(self, top):
+        # the watches of a moved directory would report its old paths
+        prefix = top + os.sep
+        for path in [p for p in self._wds if p == top or p.startswith(prefix)]:
+            wd = self._wds.pop(path)
+            self._paths.pop(wd, None)
+            self._inotify.rm_watch(wd)
+
+
+def main():
+    """
+    Watches a (mounted) volume and keeps its index up to date, until interrupted.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('volume_name')
+    parser.add_argument('path', nargs='?', default='.',
+                        help='the directory of the volume (default: current directory)')
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE,
+                        help='seconds without events before the changes are applied (default: %(default)s)')
+    parser.add_argument('--max-delay', type=float, default=MAX_DELAY,
+                        help='seconds at most before the changes are applied (default: %(default)s)')
+    parser.add_argument('--stats-every', type=float, default=60,
+                        help='print the counters every that many seconds (default: %(default)s, 0: never)')
+    args = parser.parse_args()
+
+    watcher = VolumeWatcher(args.volume_name, args.path, debounce=args.debounce, max_delay=args.max_delay)
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,), daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(args.stats_every or None)
+            if args.stats_every and thread.is_alive():
+                print(' '.join('{}={:g}'.format(k, v) for k, v in sorted(watcher.stats().items())), flush=True)
+    except KeyboardInterrupt:
+        stop.set()
+        thread.join()
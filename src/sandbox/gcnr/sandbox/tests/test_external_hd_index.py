@@ -0,0 +1,383 @@
+import datetime
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select
+
+from sandbox.gcnr.sandbox import external_hd_index as hd
+
+
+@pytest.fixture
+def tree(tmp_path):
+    # not tmp_path itself: the database (and its journal) are written there
+    tmp_path = tmp_path / 'volume'
+    (tmp_path / 'music' / 'rock').mkdir(parents=True)
+    (tmp_path / 'music' / 'rock' / 'Song.MP3').write_bytes(b'x' * 10)
+    (tmp_path / 'music' / 'notes.txt').write_text('hello')
+    (tmp_path / 'empty').mkdir()
+    os.symlink(tmp_path / 'music' / 'notes.txt', tmp_path / 'link.txt')
+    return tmp_path
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return hd.create_db_engine(tmp_path / 'test.db')
+
+
+def test_import_is_lazy(tmp_path):
+    db = tmp_path / 'lazy.db'
+    code = ('import sys; import sandbox.gcnr.sandbox.external_hd_index as hd; '
+            'assert "pandas" not in sys.modules; assert hd._engine is None')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path), **{hd.DB_PATH_VARIABLE: str(db)})
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+    assert not db.exists()
+
+
+def test_get_engine(tmp_path, monkeypatch):
+    monkeypatch.setenv(hd.DB_PATH_VARIABLE, str(tmp_path / 'other.db'))
+    monkeypatch.setattr(hd, '_engine', None)
+    monkeypatch.setattr(hd, '_session', None)
+
+    engine = hd.get_engine()
+
+    assert hd.get_engine() is engine
+    assert hd.engine is engine
+    # the older versions' globals: the writes of the session are not lost
+    hd.session.add(hd.FileSystemEntry(volume_name='v', full_path='a', type=hd.FileSystemEntry.FILE))
+    hd.session.commit()
+    assert len(entries(engine)) == 1
+    hd.session.close()
+    assert (tmp_path / 'other.db').exists()
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+    engine.dispose()
+
+
+def test_scan(tree, monkeypatch):
+    monkeypatch.chdir(tree)
+    rows = {r['full_path']: r for r in hd.scan('myvolume')}
+
+    assert set(rows) == {'.', 'music', 'empty', 'link.txt',
+                         os.path.join('music', 'rock'),
+                         os.path.join('music', 'notes.txt'),
+                         os.path.join('music', 'rock', 'Song.MP3')}
+
+    song = rows[os.path.join('music', 'rock', 'Song.MP3')]
+    assert song['type'] == hd.FileSystemEntry.FILE
+    assert song['size'] == 10
+    assert song['extension'] == 'mp3'
+    assert song['basename_noext'] == 'Song'
+    assert song['dirname'] == os.path.join('music', 'rock')
+    assert song['volume_name'] == 'myvolume'
+
+    assert rows['music']['type'] == hd.FileSystemEntry.DIR
+    assert rows['music']['size'] is None
+    assert rows['link.txt']['type'] == hd.FileSystemEntry.LINK
+
+
+def test_scan_in_parallel(tree):
+    rows = sorted(hd.scan('myvolume', str(tree)), key=lambda r: r['full_path'])
+    parallel_rows = sorted(hd.scan('myvolume', str(tree), rows[0]['insert_datetime'], workers=4),
+                           key=lambda r: r['full_path'])
+    assert parallel_rows == rows
+
+
+def test_walk_raises_errors_of_the_workers():
+    def visit(depth):
+        if depth == 3:
+            raise OSError('boom')
+        return [depth], [depth + 1, depth + 1]
+
+    with pytest.raises(OSError, match='boom'):
+        list(hd._walk(0, visit, workers=4, queue_size=2))
+
+
+def entries(engine):
+    table = hd.FileSystemEntry.__table__
+    with engine.connect() as conn:
+        return {r.full_path: r for r in conn.execute(select(table))}
+
+
+def test_index_volume_in_batches(tree, engine):
+    rows = list(hd.scan('myvolume', str(tree)))
+
+    stats = hd.index_volume('myvolume', str(tree), engine=engine, batch_size=2)
+
+    assert stats['upserted'] == len(rows)
+    assert set(entries(engine)) == {r['full_path'] for r in rows}
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_index_volume_incremental(tree, engine, workers):
+    top = str(tree)
+    hd.index_volume('myvolume', top, engine=engine, workers=workers)
+    before = entries(engine)
+
+    (tree / 'music' / 'new.flac').write_bytes(b'y' * 3)
+    (tree / 'music' / 'notes.txt').unlink()
+    (tree / 'music' / 'rock' / 'Song.MP3').unlink()
+    (tree / 'music' / 'rock').rmdir()
+
+    stats = hd.index_volume('myvolume', top, engine=engine, workers=workers)
+    after = entries(engine)
+
+    music = os.path.join(top, 'music')
+    # new.flac and the music directory itself
+    assert stats['upserted'] == 2
+    assert stats['deleted'] == 3
+    # the top directory (its mtime didn't change) and 'empty' are not listed again
+    assert stats['skipped'] == 2
+    assert after[os.path.join(music, 'new.flac')].size == 3
+    assert after[os.path.join(music, 'new.flac')].deleted is None
+    for path in ['notes.txt', 'rock', os.path.join('rock', 'Song.MP3')]:
+        assert after[os.path.join(music, path)].deleted is not None
+    assert after[os.path.join(top, 'empty')] == before[os.path.join(top, 'empty')]
+
+    # a deleted entry that comes back is not deleted anymore (and is not duplicated)
+    (tree / 'music' / 'notes.txt').write_text('again')
+    hd.index_volume('myvolume', top, engine=engine)
+    notes = entries(engine)[os.path.join(music, 'notes.txt')]
+    assert notes.deleted is None
+    assert notes.size == 5
+
+
+def test_index_volume_full(tree, engine):
+    top = str(tree)
+    hd.index_volume('myvolume', top, engine=engine)
+    (tree / 'link.txt').unlink()
+
+    stats = hd.index_volume('myvolume', top, engine=engine, full=True)
+
+    assert stats['deleted'] == 1
+    assert entries(engine)[os.path.join(top, 'link.txt')].deleted is not None
+    with engine.connect() as conn:
+        count = conn.execute(select(func.count()).select_from(hd.FileSystemEntry.__table__)).scalar()
+    assert count == len(list(hd.scan('myvolume', top))) + 1
+
+
+def test_volume_workers(engine):
+    assert hd.volume_workers('ssd', engine=engine) == 1
+    assert hd.volume_workers('ssd', 8, engine=engine) == 8
+    assert hd.volume_workers('ssd', engine=engine) == 8
+    assert hd.volume_workers('usb', engine=engine) == 1
+
+
+def test_upgrade_db_removes_duplicates(tmp_path):
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'old.db'))
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE file_system_entry (id INTEGER PRIMARY KEY, volume_name VARCHAR(255),'
+                             ' full_path VARCHAR, dirname VARCHAR, basename VARCHAR, basename_noext VARCHAR,'
+                             ' extension VARCHAR, type VARCHAR, size INTEGER, modified DATETIME,'
+                             ' created DATETIME, comment VARCHAR, insert_datetime DATETIME)')
+        for size in [1, 2]:
+            conn.exec_driver_sql("INSERT INTO file_system_entry (volume_name, full_path, size)"
+                                 " VALUES ('v', 'a.txt', ?)", (size,))
+
+    hd.upgrade_db(engine)
+
+    rows = list(entries(engine).values())
+    assert [(r.full_path, r.size, r.deleted) for r in rows] == [('a.txt', 2, None)]
+
+
+def test_search(tree, engine):
+    top = str(tree)
+    hd.index_volume('myvolume', top, engine=engine)
+    (tree / 'music' / 'notes.txt').unlink()
+    hd.index_volume('myvolume', top, engine=engine)
+
+    def paths(*args, **kwargs):
+        return sorted(os.path.relpath(r.full_path, top) for r in hd.search(*args, engine=engine, **kwargs))
+
+    song = os.path.join('music', 'rock', 'Song.MP3')
+    assert paths('song') == [song]
+    assert paths('SONG.mp') == [song]
+    assert paths('rock') == [os.path.join('music', 'rock'), song]
+    assert paths('rock', basename_only=True) == [os.path.join('music', 'rock')]
+    # too short for the full-text index
+    assert paths('g.') == [song]
+    assert paths(extension='.mp3') == [song]
+    assert paths('notes') == []
+    assert paths('notes', include_deleted=True) == [os.path.join('music', 'notes.txt')]
+    assert paths(min_size=6, extension='mp3') == [song]
+    assert paths(max_size=5, extension='mp3') == []
+    assert paths('"quoted"') == []
+    assert len(hd.search(volume_name='myvolume', engine=engine, limit=2)) == 2
+    assert hd.search(volume_name='other', engine=engine) == []
+
+
+def test_find_duplicates(tmp_path, engine, monkeypatch):
+    monkeypatch.setattr(hd, 'PARTIAL_HASH_SIZE', 4)
+    for volume in ['disk1', 'disk2']:
+        (tmp_path / volume).mkdir()
+        (tmp_path / volume / 'a.bin').write_bytes(b'0123456789')
+        # same size and same beginning and end, different content
+        (tmp_path / volume / 'b.bin').write_bytes(b'0123xxxx89' if volume == 'disk1' else b'0123yyyy89')
+        (tmp_path / volume / 'small.txt').write_bytes(b'abc' if volume == 'disk1' else b'abd')
+    (tmp_path / 'disk1' / 'unique.txt').write_bytes(b'no other file has this size')
+    for volume in ['disk1', 'disk2']:
+        hd.index_volume(volume, str(tmp_path / volume), engine=engine)
+
+    def paths(groups):
+        return [sorted(os.path.relpath(r.full_path, tmp_path) for r in group) for group in groups]
+
+    roots = {volume: str(tmp_path / volume) for volume in ['disk1', 'disk2']}
+    expected = [[os.path.join('disk1', 'a.bin'), os.path.join('disk2', 'a.bin')]]
+    assert paths(hd.find_duplicates(roots=roots, engine=engine)) == expected
+    assert hd.find_duplicates('disk1', engine=engine) == []
+
+    # the stored hashes are used: the files are not read again
+    stored = entries(engine)
+    assert stored[str(tmp_path / 'disk1' / 'a.bin')].content_hash is not None
+    assert stored[str(tmp_path / 'disk1' / 'unique.txt')].partial_hash is None
+    monkeypatch.setattr(hd, '_content_hash', None)
+    monkeypatch.setattr(hd, '_partial_hash', None)
+    assert paths(hd.find_duplicates(roots=roots, engine=engine)) == expected
+    assert paths(hd.find_duplicates(engine=engine)) == expected
+
+    # and kept when re-indexing, unless the file changed
+    (tmp_path / 'disk2' / 'a.bin').write_bytes(b'9876543210')
+    hd.index_volume('disk2', str(tmp_path / 'disk2'), engine=engine, full=True)
+    stored = entries(engine)
+    assert stored[str(tmp_path / 'disk2' / 'a.bin')].partial_hash is None
+    assert stored[str(tmp_path / 'disk2' / 'b.bin')].partial_hash is not None
+
+
+def test_find_duplicates_reads_only_the_files_of_the_given_volume(tmp_path, engine, monkeypatch):
+    # both volumes indexed from the current directory (relative paths), only disk2 is mounted now
+    for volume in ['disk1', 'disk2']:
+        (tmp_path / volume).mkdir()
+        (tmp_path / volume / 'a.bin').write_bytes(b'same size' if volume == 'disk1' else b'different')
+        (tmp_path / volume / 'b.bin').write_bytes(b'different')
+        monkeypatch.chdir(tmp_path / volume)
+        hd.index_volume(volume, engine=engine)
+
+    # the files of disk1 would be read from disk2 (and its wrong hashes stored)
+    table = hd.FileSystemEntry.__table__
+    hashed = select(table.c.volume_name).where(table.c.partial_hash.is_not(None)).distinct()
+    assert hd.find_duplicates(engine=engine) == []
+    with engine.connect() as conn:
+        assert conn.execute(hashed).scalars().all() == []
+
+    groups = hd.find_duplicates('disk2', engine=engine)
+    assert [sorted(r.full_path for r in group) for group in groups] == [['a.bin', 'b.bin']]
+    with engine.connect() as conn:
+        assert conn.execute(hashed).scalars().all() == ['disk2']
+
+
+def test_get_df(tree, engine):
+    hd.index_volume('myvolume', str(tree), engine=engine)
+
+    df = hd.get_df(where=[hd.FileSystemEntry.type == hd.FileSystemEntry.FILE], engine=engine)
+    assert sorted(df.basename) == ['Song.MP3', 'notes.txt']
+    assert df.volume_name.dtype == 'category'
+    assert df.type.dtype == 'category'
+    assert df.extension.dtype == 'category'
+    assert df['size'].dtype == 'Int64'
+    assert df.comment.dtype == 'string'
+    assert df.modified.dtype == 'datetime64[us]'
+    assert df.deleted.dtype == 'datetime64[us]'
+
+    short = hd.get_short_df(engine=engine)
+    assert list(short.columns) == hd.SHORT_COLUMNS
+    assert len(short) == len(list(hd.scan('myvolume', str(tree))))
+
+    chunks = list(hd.get_df(['full_path', 'extension'], chunksize=3, engine=engine))
+    assert [len(c) for c in chunks] == [3, 3, 1]
+    assert all(c.extension.dtype == 'category' for c in chunks)
+
+    empty = hd.get_df(where=[hd.FileSystemEntry.size > 10**12], engine=engine)
+    assert empty.empty
+    assert empty.extension.dtype == 'category'
+    assert empty['size'].dtype == 'Int64'
+    assert empty.modified.dtype == 'datetime64[us]'
+
+
+def test_snapshot(tree, engine, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(hd, 'DF_CHUNKSIZE', 2)
+    hd.index_volume('myvolume', str(tree), engine=engine)
+    df = hd.get_df(engine=engine)
+
+    hd.save_snapshot(tmp_path / 'snapshot.parquet', engine=engine)
+
+    snapshot = hd.load_snapshot(tmp_path / 'snapshot.parquet')
+    # (the categories can be in another order)
+    pd.testing.assert_frame_equal(snapshot, df, check_categorical=False)
+    mp3 = hd.load_snapshot(tmp_path / 'snapshot.parquet', ['basename'], [('extension', '==', 'mp3')])
+    assert list(mp3.basename) == ['Song.MP3']
+
+
+def test_backup_existing_db(tree, tmp_path, engine):
+    db = tmp_path / 'test.db'
+    backup = tmp_path / 'test.db.bak'
+    hd.index_volume('myvolume', str(tree), engine=engine)
+
+    assert hd.backup_existing_db(db, pages=1)
+    backup_engine = create_engine('sqlite:///{}'.format(backup))
+    assert set(entries(backup_engine)) == set(entries(engine))
+    backup_engine.dispose()
+
+    # not changed since
+    assert not hd.backup_existing_db(db, max_age=datetime.timedelta(0))
+
+    os.utime(backup, (0, 0))
+    (tree / 'new.txt').write_text('new')
+    hd.index_volume('myvolume', str(tree), engine=engine)
+    # too recent
+    assert not hd.backup_existing_db(db, max_age=datetime.timedelta(days=100 * 365))
+    assert hd.backup_existing_db(db)
+    assert not (tmp_path / 'test.db.bak.tmp').exists()
+
+    assert not hd.backup_existing_db(tmp_path / 'missing.db')
+
+
+def rollups(engine):
+    with engine.connect() as conn:
+        directories = {r.full_path: (r.parent, r.size, r.files)
+                       for r in conn.execute(select(hd.DirectoryUsage.__table__))}
+        extensions = {(r.full_path, r.extension): (r.size, r.files)
+                      for r in conn.execute(select(hd.ExtensionUsage.__table__))}
+    return directories, extensions
+
+
+def test_rollups(tree, engine):
+    top = str(tree)
+    hd.index_volume('myvolume', top, engine=engine)
+    link_size = os.lstat(tree / 'link.txt').st_size
+
+    directory, subdirectories = hd.disk_usage('myvolume', engine=engine)
+    assert (directory.full_path, directory.size, directory.files) == (top, 15 + link_size, 3)
+    assert [(r.full_path, r.size, r.files) for r in subdirectories] == [
+        (os.path.join(top, 'music'), 15, 2), (os.path.join(top, 'empty'), 0, 0)]
+    assert [tuple(r) for r in hd.top_extensions('myvolume', engine=engine)] == sorted(
+        [('mp3', 10, 1), ('txt', 5 + link_size, 2)], key=lambda r: r[1], reverse=True)
+    assert [tuple(r) for r in hd.top_extensions('myvolume', os.path.join(top, 'music'), n=1,
+                                                engine=engine)] == [('mp3', 10, 1)]
+    assert [r.basename for r in hd.largest_files('myvolume', os.path.join(top, 'music'), engine=engine)] == [
+        'Song.MP3', 'notes.txt']
+
+    # incremental updates give the same rollups as computing them all again
+    (tree / 'music' / 'rock' / 'Song.MP3').unlink()
+    (tree / 'music' / 'rock').rmdir()
+    (tree / 'empty' / 'new').mkdir()
+    (tree / 'empty' / 'new' / 'a.mp3').write_bytes(b'a' * 100)
+    hd.index_volume('myvolume', top, engine=engine)
+    incremental = rollups(engine)
+    hd.update_rollups('myvolume', engine=engine)
+    assert incremental == rollups(engine)
+    assert incremental[0][os.path.join(top, 'empty')] == (top, 100, 1)
+    assert os.path.join(top, 'music', 'rock') not in incremental[0]
+
+
+def test_rollups_of_relative_paths(tree, engine, monkeypatch):
+    monkeypatch.chdir(tree)
+    hd.index_volume('myvolume', engine=engine)
+
+    directory, subdirectories = hd.disk_usage('myvolume', engine=engine)
+    assert directory.full_path == '.'
+    assert [r.full_path for r in subdirectories] == ['music', 'empty']
+    assert [r.basename for r in hd.largest_files('myvolume', 'music', n=1, engine=engine)] == ['Song.MP3']
+    assert len(hd.largest_files('myvolume', '.', engine=engine)) == 3
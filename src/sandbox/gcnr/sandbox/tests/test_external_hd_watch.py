@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from sandbox.gcnr.sandbox import external_hd_index as hd
+from sandbox.gcnr.sandbox import external_hd_watch as watch
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only')
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return hd.create_db_engine(tmp_path / 'test.db')
+
+
+@pytest.fixture
+def top(tmp_path):
+    top = tmp_path / 'volume'
+    (top / 'music').mkdir(parents=True)
+    (top / 'music' / 'notes.txt').write_text('hello')
+    return str(top)
+
+
+@pytest.fixture
+def watcher(top, engine):
+    watcher = watch.VolumeWatcher('myvolume', top, engine=engine, debounce=.1, max_delay=1)
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    wait_for(lambda: watcher.counters['flushes'])
+    yield watcher
+    stop.set()
+    thread.join()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(.05)
+
+
+def entries(engine, top):
+    return {os.path.relpath(r.full_path, top): r for r in hd.search(include_deleted=True, engine=engine)}
+
+
+def test_watcher(watcher, engine, top):
+    assert set(entries(engine, top)) == {'.', 'music', os.path.join('music', 'notes.txt')}
+
+    # a new directory, with something in it
+    os.makedirs(os.path.join(top, 'new', 'sub'))
+    with open(os.path.join(top, 'new', 'sub', 'a.txt'), 'w') as f:
+        f.write('a')
+    # a file modified in place (the mtime of its directory doesn't change)
+    with open(os.path.join(top, 'music', 'notes.txt'), 'a') as f:
+        f.write(' world')
+    wait_for(lambda: os.path.join('new', 'sub', 'a.txt') in entries(engine, top)
+             and entries(engine, top)[os.path.join('music', 'notes.txt')].size == 11)
+
+    os.remove(os.path.join(top, 'new', 'sub', 'a.txt'))
+    os.rename(os.path.join(top, 'music'), os.path.join(top, 'songs'))
+    with open(os.path.join(top, 'songs', 'b.txt'), 'w') as f:
+        f.write('b')
+    wait_for(lambda: os.path.join('songs', 'b.txt') in entries(engine, top))
+
+    rows = entries(engine, top)
+    assert rows[os.path.join('new', 'sub', 'a.txt')].deleted is not None
+    assert rows['music'].deleted is not None
+    assert rows[os.path.join('music', 'notes.txt')].deleted is not None
+    assert rows[os.path.join('songs', 'notes.txt')].deleted is None
+
+    stats = watcher.stats()
+    assert stats['events'] > 0
+    assert stats['flushes'] >= 3
+    assert stats['watches'] == 4
+
+
+def test_watcher_overflow(top, engine):
+    watcher = watch.VolumeWatcher('myvolume', top, engine=engine)
+    hd.index_volume('myvolume', top, engine=engine)
+    # the events about these were lost
+    os.mkdir(os.path.join(top, 'new'))
+    with open(os.path.join(top, 'new', 'lost.txt'), 'w') as f:
+        f.write('lost')
+
+    with watch.Inotify() as watcher._inotify:
+        watcher._handle([(-1, watch.IN_Q_OVERFLOW, 0, '')])
+        watcher.flush()
+
+        assert os.path.join('new', 'lost.txt') in entries(engine, top)
+        assert watcher.counters['overflows'] == 1
+        assert watcher.counters['rescans'] == 1
+        # only the directories that changed were listed again
+        assert watcher.counters['listed'] == 2
+        assert os.path.join(top, 'new') in watcher._wds
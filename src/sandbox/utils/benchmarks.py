@@ -0,0 +1,51 @@
+"""
+Benchmarks for the startup of the pyrun tasks: a shell command running a new interpreter, against an entry point
+forked from pyrun itself (a single call) or from a warm server process (the tasks of a manifest).
+
+They need pytest-benchmark and are not collected by default, run them with:
+
+    pytest sandbox/utils/benchmarks.py --benchmark-group-by=group
+
+Every call runs ``json.tool`` on a tiny file, so the times are (almost) all startup.
+"""
+import sys
+
+import pytest
+
+from sandbox.utils import pyrun
+
+pytest.importorskip('pytest_benchmark')
+
+
+@pytest.fixture
+def args(tmp_path):
+    (tmp_path / "in.json").write_text('{"a": 1}')
+    return [str(tmp_path / "in.json")]
+
+
+def run(benchmark, call):
+    def once():
+        with pyrun.OutputCapture(None, console=False) as output:
+            assert call(output) == 0
+        return output.text()
+
+    assert benchmark(once) == '{\n    "a": 1\n}\n'
+
+
+@pytest.mark.benchmark(group='startup')
+def test_shell(benchmark, args):
+    run(benchmark, lambda output: pyrun.call([f"{sys.executable} -m json.tool {args[0]}"], output))
+
+
+@pytest.mark.benchmark(group='startup')
+def test_fork(benchmark, args):
+    # (the single call of pyrun: a new runner every time, nothing preloaded)
+    run(benchmark, lambda output: pyrun.EntryPointRunner(method="fork").call("json.tool:main", args, output))
+
+
+@pytest.mark.benchmark(group='startup')
+def test_forkserver(benchmark, args):
+    runner = pyrun.EntryPointRunner(preload=["json.tool"])
+    # (the server is started by the first call, the benchmark measures the warm calls)
+    runner.call("json.tool:main", args, pyrun.OutputCapture(None, console=False))
+    run(benchmark, lambda output: runner.call("json.tool:main", args, output))
@@ -8,6 +8,21 @@ The following configuration is available:
     --recipients or PYRUN_RECIPIENTS     - the email addresses for the recipients, separated by comma
     --name or PYRUN_NAME                 - the name/id for the task/script
     --script or PYRUN_SCRIPT             - the path to entry point function for task (e.g.: foo.bar.app:main)
+    --spool-dir or PYRUN_SPOOL_DIR       - the directory where the whole output is written (default: temp dir)
+    --keep-spools or PYRUN_KEEP_SPOOLS   - the number of runs whose spool files are kept, per name (default: 10)
+    --manifest or PYRUN_MANIFEST         - run the tasks of this manifest (JSON file) instead of one script
+    --parallelism or PYRUN_PARALLELISM   - the number of tasks of the manifest run at the same time
+    --timeout or PYRUN_TIMEOUT           - the seconds an attempt can run before its processes are killed
+    --retries or PYRUN_RETRIES           - the number of times a failed task is run again (default: 0)
+    --retry-delay or PYRUN_RETRY_DELAY   - the seconds before the first retry, doubled at each one (default: 10)
+    --retry-max-delay or PYRUN_RETRY_MAX_DELAY - the seconds at most between two attempts (default: 300)
+    --retry-on or PYRUN_RETRY_ON         - the return codes that are retried, separated by comma (default: all)
+    --metrics-file or PYRUN_METRICS_FILE - the JSON-lines file the timings and resource usage are appended to
+
+The output of the script is shown as it comes, and written to a (rotating) spool file: only its beginning
+and its end are kept in memory, and attached to the email (the whole output is attached compressed when it
+is not too big). The spool files of the older runs with the same name (and of the same tasks, for a manifest)
+are deleted at the end of a run, only the ones of the last runs are kept.
 
 If both command line option and environment variable are provided, the value given to the command line option
 will take precedence / high priority and will override the value set to the environment variable.
@@ -21,33 +36,93 @@ This will invoke foo.bar entry point, and it will pass ["spam", "eggs", "--verbo
 to that script.
 
 Everything before the double dashes are treated/parsed as command line options for the pyrun command.
+
+An entry point (module:function) is not run by the shell: the function is called in a worker process forked
+from pyrun itself, so no new interpreter is started (only the module of the entry point is imported, after the
+ones given with --preload or PYRUN_PRELOAD which pyrun imports before forking). The tasks of a manifest are
+forked from a server process instead (pyrun runs them from threads, which don't mix well with fork): it's
+started once per manifest, with the modules of all the entry points imported, so each task only pays for
+the fork. Its return value (or SystemExit code) is the exit code, as for console scripts.
+
+A manifest lists named tasks, with the tasks they depend on:
+
+{"name": "nightly", "parallelism": 4, "tasks": [
+    {"name": "download", "call": "foo.download:main -- --all"},
+    {"name": "report", "call": ["foo.report:main", "--", "--daily"], "depends_on": ["download"]}]}
+
+The tasks run as soon as the ones they depend on have succeeded (they are skipped when one of them failed),
+at most `parallelism` at a time. Each one has its own output, and one email is sent for all of them.
+A task can override the timeout and retry options ("timeout", "retries", "retry_delay", "retry_max_delay",
+"retry_on").
+
+The script (or task) runs in its own process group: when it times out, the whole group is killed (SIGTERM,
+then SIGKILL after a few seconds), and the attempt has the return code 124 (as with the timeout command).
+The delay between two attempts grows exponentially, with a random part so the tasks failing together
+(e.g. because of a database restart) are not retried together. All the attempts are in the output and
+are listed in the email.
+
+The resources used by each attempt (its process and their subprocesses) are measured: wall time, user and
+system CPU time, peak RSS (of the biggest process, and of all of them together) and I/O. They come from
+wait4 (or getrusage in the entry point workers) and /proc/<pid>/io, completed by sampling /proc while it
+runs (the only source for the attempts that timed out). They are in the email, and a line per run (per task
+for a manifest) is appended to the metrics file, to follow them over time.
 """
 import argparse
+import collections
+import concurrent.futures
+import dataclasses
 import datetime
+import functools
 import getpass
+import gzip
+import importlib
+import io
+import json
+import multiprocessing
+import operator
 import os
+import random
+import re
+import resource
+import selectors
+import shlex
+import signal
 import smtplib
 import socket
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import traceback
 from email.message import EmailMessage
 from enum import Enum
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, List, Dict, Optional, Tuple, Union
 
 
 def main():
     config = get_config()
+    if config["manifest"]:
+        return main_batch(config)
     config["start"] = datetime.datetime.now()
 
     # run the script
-    returncode, output = call(config["executable_call"])
+    with OutputCapture(spool_path(config["spool_dir"], config["name"], config["start"])) as output:
+        # (a server process would cost more than the startup it saves for a single call)
+        runner = EntryPointRunner(preload=config["preload"], method="fork")
+        attempts = run_with_retries(config["executable_call"], output, runner, config["retry"])
+    returncode = attempts[-1].returncode
 
     config["end"] = datetime.datetime.now()
+    config["elapsed"] = (config["end"] - config["start"]).total_seconds()
+    if config["metrics_file"]:
+        write_metrics(config["metrics_file"], [metrics_record(config["name"], config["executable_call"], attempts)])
 
     # send the email
     if should_send_email(config, returncode):
-        config["elapsed"] = (config["end"] - config["start"]).seconds
-        send_email(config, returncode, output)
+        send_email(config, output, returncode, attempts)
+    prune_spools(config["spool_dir"], config["name"], config["keep_spools"])
+    return returncode
 
 
 def get_config(argv: List[str] = None):
@@ -59,6 +134,18 @@ def get_config(argv: List[str] = None):
     send_email_on_failure = args.failure or env_var("FAILURE", "false").lower() in ["1", "true"]
     send_email_on_success = args.success or env_var("SUCCESS", "false").lower() in ["1", "true"]
     executable_call = args.executable_call
+    spool_dir = args.spool_dir or env_var("SPOOL_DIR", tempfile.gettempdir())
+    keep_spools = args.keep_spools if args.keep_spools is not None else env_var("KEEP_SPOOLS")
+    preload = args.preload or env_var("PRELOAD", "")
+    manifest = args.manifest or env_var("MANIFEST")
+    parallelism = args.parallelism or env_var("PARALLELISM")
+    # (0 is a valid value for these)
+    timeout = args.timeout if args.timeout is not None else env_var("TIMEOUT")
+    retries = args.retries if args.retries is not None else env_var("RETRIES")
+    retry_delay = args.retry_delay if args.retry_delay is not None else env_var("RETRY_DELAY")
+    retry_max_delay = args.retry_max_delay if args.retry_max_delay is not None else env_var("RETRY_MAX_DELAY")
+    retry_on = args.retry_on or env_var("RETRY_ON", "")
+    metrics_file = args.metrics_file or env_var("METRICS_FILE")
 
     recipients = [r.strip() for r in recipients.strip().split(",")]
 
@@ -69,6 +156,19 @@ def get_config(argv: List[str] = None):
         "executable_call": executable_call,
         "send_email_on_failure": send_email_on_failure,
         "send_email_on_success": send_email_on_success,
+        "spool_dir": spool_dir,
+        "keep_spools": int(keep_spools) if keep_spools not in (None, "") else SPOOL_KEEP,
+        "preload": [m.strip() for m in preload.split(",") if m.strip()],
+        "manifest": manifest,
+        "parallelism": int(parallelism) if parallelism else None,
+        "retry": RetryPolicy(
+            retries=int(retries or 0),
+            retry_delay=float(retry_delay if retry_delay not in (None, "") else RETRY_DELAY),
+            retry_max_delay=float(retry_max_delay if retry_max_delay not in (None, "") else RETRY_MAX_DELAY),
+            retry_on=tuple(int(c) for c in retry_on.split(",") if c.strip()),
+            timeout=float(timeout) if timeout else None,
+        ),
+        "metrics_file": metrics_file,
     }
 
 
@@ -79,6 +179,17 @@ def parse_args(argv: List[str] = None):
     parser.add_argument("--name", help="the name/id for the task/script")
     parser.add_argument("-f", "--failure", action="store_true", help="send email on failures")
     parser.add_argument("-s", "--success", action="store_true", help="send email on successes")
+    parser.add_argument("--spool-dir", help="the directory where the whole output is written")
+    parser.add_argument("--keep-spools", type=int, help="the number of runs whose spool files are kept, per name")
+    parser.add_argument("--preload", help="modules imported in advance for the entry points, separated by comma")
+    parser.add_argument("--manifest", help="run the tasks of this manifest (JSON file)")
+    parser.add_argument("--parallelism", type=int, help="the number of tasks of the manifest run at the same time")
+    parser.add_argument("--timeout", type=float, help="the seconds an attempt can run before it's killed")
+    parser.add_argument("--retries", type=int, help="the number of times a failed task is run again")
+    parser.add_argument("--retry-delay", type=float, help="the seconds before the first retry")
+    parser.add_argument("--retry-max-delay", type=float, help="the seconds at most between two attempts")
+    parser.add_argument("--retry-on", help="the return codes that are retried, separated by comma")
+    parser.add_argument("--metrics-file", help="the JSON-lines file the timings and resource usage are appended to")
     parser.add_argument("executable_call", nargs=argparse.REMAINDER,
                         help="the path to the entry point function for task (e.g.: foo.bar.app:main)")
     args = parser.parse_args(argv if argv is not None else sys.argv[1:])
@@ -96,13 +207,816 @@ def should_send_email(config: Dict, returncode: int) -> bool:
         return config["send_email_on_success"]
 
 
-def call(program_args: List[str]) -> Tuple[int, str]:
+# what is kept in memory of the output: its beginning and its end
+HEAD_SIZE = 64 * 1024
+TAIL_SIZE = 256 * 1024
+# the spool file is rotated when it reaches this size, keeping this many rotated files
+SPOOL_MAX_BYTES = 100 * 1024 * 1024
+SPOOL_BACKUP_COUNT = 5
+# the number of runs (with the same name) whose spool files are kept
+SPOOL_KEEP = 10
+# the whole (compressed) output is attached to the email up to this size
+MAX_ATTACHMENT_SIZE = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class OutputCapture:
+    """
+    Captures the output of the script as it comes: shows it on the console, writes it to the spool file
+    (rotated every `max_bytes`, keeping `backup_count` files) and keeps only its first `head_size`
+    and last `tail_size` bytes in memory.
+    """
+
+    def __init__(self, spool_path: Optional[str], console=None, head_size: int = HEAD_SIZE,
+                 tail_size: int = TAIL_SIZE, max_bytes: int = SPOOL_MAX_BYTES,
+                 backup_count: int = SPOOL_BACKUP_COUNT):
+        self.spool_path = spool_path
+        self.console = console if console is not None else sys.stdout.buffer
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.head = bytearray()
+        self.tail = collections.deque()
+        self.tail_bytes = 0
+        self.total = 0
+        self.rotations = 0
+        self._spool = None
+
+    def __enter__(self):
+        if self.spool_path:
+            self._spool = open(self.spool_path, "wb")
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def write(self, chunk: bytes) -> None:
+        if self.console:
+            self.console.write(chunk)
+            self.console.flush()
+        if self._spool is not None:
+            if self._spool.tell() + len(chunk) > self.max_bytes and self._spool.tell():
+                self._rotate()
+            self._spool.write(chunk)
+
+        self.total += len(chunk)
+        if len(self.head) < self.head_size:
+            n = self.head_size - len(self.head)
+            self.head += chunk[:n]
+            chunk = chunk[n:]
+        if chunk:
+            self.tail.append(chunk)
+            self.tail_bytes += len(chunk)
+            while self.tail_bytes - len(self.tail[0]) >= self.tail_size:
+                self.tail_bytes -= len(self.tail.popleft())
+
+    def _rotate(self):
+        self._spool.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.spool_path}.{i}"):
+                os.replace(f"{self.spool_path}.{i}", f"{self.spool_path}.{i + 1}")
+        if self.backup_count:
+            os.replace(self.spool_path, f"{self.spool_path}.1")
+        self.rotations += 1
+        self._spool = open(self.spool_path, "wb")
+
+    @property
+    def truncated(self) -> int:
+        """ The number of bytes of the output that are not kept in memory. """
+        return self.total - len(self.head) - min(self.tail_bytes, self.tail_size)
+
+    def text(self) -> str:
+        """ The output (its beginning and its end, when it's too long). """
+        tail = b"".join(self.tail)[-self.tail_size:] if self.tail else b""
+        if self.truncated:
+            marker = f"\n\n[... {self.truncated:,} bytes truncated - see {self.spool_path} ...]\n\n".encode()
+            return (bytes(self.head) + marker + tail).decode(errors="replace")
+        return (bytes(self.head) + tail).decode(errors="replace")
+
+    def attachments(self) -> Dict[str, Union[str, bytes]]:
+        """
+        The output to attach to the email: the whole of it when it's kept in memory, otherwise its
+        beginning and its end, plus the whole of it compressed when that's not too big (and still in the
+        spool file).
+        """
+        attachments = {"output.txt": self.text()}
+        if self.truncated and not self.rotations and self.spool_path:
+            compressed = _gzip_file(self.spool_path, MAX_ATTACHMENT_SIZE)
+            if compressed is not None:
+                attachments["output.txt.gz"] = compressed
+        return attachments
+
+    def __str__(self):
+        return self.text()
+
+
+def spool_path(spool_dir: str, name: str, start: datetime.datetime) -> str:
+    """
+    The spool file of the run `name` started at `start` (with the pid, as runs can start in the same second).
+    """
+    return os.path.join(spool_dir, f"pyrun-{name}-{start:%Y%m%d-%H%M%S}-{os.getpid()}.log")
+
+
+def prune_spools(spool_dir: str, name: str, keep: int) -> None:
+    """
+    Deletes the spool files (and their rotated files) of the runs `name` in `spool_dir`, except the ones of the
+    last `keep` runs.
+    """
+    pattern = re.compile(rf"pyrun-{re.escape(name)}-(\d{{8}}-\d{{6}}-\d+)\.log(\.\d+)?")
+    runs = collections.defaultdict(list)
+    for filename in os.listdir(spool_dir):
+        match = pattern.fullmatch(filename)
+        if match:
+            runs[match.group(1)].append(filename)
+    # (the start times sort as the strings do)
+    for run in sorted(runs, reverse=True)[keep:]:
+        for filename in runs[run]:
+            try:
+                os.remove(os.path.join(spool_dir, filename))
+            except FileNotFoundError:
+                # deleted by another run at the same time
+                pass
+
+
+def _gzip_file(path: str, max_size: int) -> Optional[bytes]:
+    """ The file compressed, or None when it's bigger than `max_size` compressed. """
+    buffer = io.BytesIO()
+    with open(path, "rb") as f, gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
+        while chunk := f.read(CHUNK_SIZE):
+            gz.write(chunk)
+            if buffer.tell() > max_size:
+                return None
+    return buffer.getvalue() if buffer.tell() <= max_size else None
+
+
+def call(program_args: List[str], output: OutputCapture, timeout: Optional[float] = None,
+         usage: Optional["ResourceUsage"] = None) -> int:
+    """
+    Runs the program, streaming its output (stdout and stderr) to `output`, and returns its return code.
+    `usage` (when given) is filled with the resources used by the program and its subprocesses.
+
+    Raises subprocess.TimeoutExpired when it runs for more than `timeout` seconds: its process group is
+    killed then.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    with subprocess.Popen(program_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True,
+                          start_new_session=True) as process, _TreeSampler(process.pid, usage) as sampler:
+        # (it can close its output and keep running, e.g. when redirected to a log file)
+        if not (_stream({process.stdout.fileno(): output}, deadline) and _wait_exited(process.pid, deadline)):
+            _kill_group(process.pid, functools.partial(_wait_popen, process))
+            raise subprocess.TimeoutExpired(program_args, timeout)
+        sampler.stop()
+        # (wait4 instead of wait, for the resources used, and once it's a zombie for its I/O counters)
+        counters = _proc_io(process.pid)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if usage is not None:
+            usage.set_rusage(rusage)
+            usage.set_io(counters)
+    return process.returncode
+
+
+def _wait_exited(pid: int, deadline: Optional[float] = None) -> bool:
+    """
+    Waits until the child `pid` has exited, without reaping it, or until `deadline`: returns False then.
+    """
+    if deadline is None:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        return True
+    delay = .001
+    while os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT | os.WNOHANG) is None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, .05)
+    return True
+
+
+def _wait_popen(process: subprocess.Popen, timeout: Optional[float]) -> bool:
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+
+def _stream(targets: Dict[int, OutputCapture], deadline: Optional[float] = None) -> bool:
+    """
+    Writes what is read from the file descriptors to their outputs until they are all closed, or until
+    `deadline` (a time.monotonic() value): returns False then.
+    """
+    targets = dict(targets)
+    with selectors.DefaultSelector() as selector:
+        for fd in targets:
+            selector.register(fd, selectors.EVENT_READ)
+        while targets:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return False
+            for key, _ in selector.select(timeout):
+                chunk = os.read(key.fd, CHUNK_SIZE)
+                if chunk:
+                    targets[key.fd].write(chunk)
+                else:
+                    selector.unregister(key.fd)
+                    del targets[key.fd]
+    return True
+
+
+# the seconds the processes have to terminate (SIGTERM) before they are killed (SIGKILL)
+KILL_GRACE = 5.0
+
+
+def _kill_group(pid: int, wait: Callable[[Optional[float]], bool], grace: float = KILL_GRACE) -> None:
+    """
+    Terminates the process group of `pid` (its leader): SIGTERM, and SIGKILL for what is left of the group
+    after `grace` seconds, or once the leader is gone. `wait(timeout)` waits for the leader and returns
+    whether it is gone.
+    """
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        # (not the leader of its group yet)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    wait(grace)
+    # the processes of the group that survived the leader too (e.g. ignoring SIGTERM)
     try:
-        output = subprocess.check_output(program_args, stderr=subprocess.STDOUT, shell=True, universal_newlines=True)
-    except subprocess.CalledProcessError as e:
-        return e.returncode, e.output
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
     else:
-        return 0, output
+        wait(None)
+
+
+def run_call(executable_call: List[str], output: "OutputCapture", runner: "EntryPointRunner",
+             timeout: Optional[float] = None, usage: Optional["ResourceUsage"] = None) -> int:
+    """ Runs the entry point (with the runner) or the shell command, and returns its exit code. """
+    entry_point = parse_entry_point(executable_call)
+    if entry_point is not None:
+        return runner.call(*entry_point, output, timeout=timeout, usage=usage)
+    return call(executable_call, output, timeout, usage)
+
+
+# the seconds between two samples of the resources used by a running task
+SAMPLE_INTERVAL = 1.0
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+@dataclasses.dataclass
+class ResourceUsage:
+    """
+    The resources used by a process and its subprocesses (in seconds and bytes).
+    """
+    wall: float = 0.0
+    user: float = 0.0
+    system: float = 0.0
+    # of the biggest process (for a shell command, at least the RSS of pyrun when it was forked: the kernel
+    # counts the memory before the exec)
+    max_rss: int = 0
+    # of all the processes together (sampled)
+    peak_rss: int = 0
+    # from/to the storage
+    read_bytes: int = 0
+    write_bytes: int = 0
+    # with the read/write system calls (pipes, page cache... included)
+    read_chars: int = 0
+    write_chars: int = 0
+
+    def set_rusage(self, *rusages: resource.struct_rusage) -> None:
+        """ Sets the CPU times and the peak RSS from the ones of wait4 or getrusage (added up). """
+        self.user = sum(r.ru_utime for r in rusages)
+        self.system = sum(r.ru_stime for r in rusages)
+        # (in KiB on Linux)
+        self.max_rss = max(r.ru_maxrss for r in rusages) * 1024
+        self.peak_rss = max(self.peak_rss, self.max_rss)
+
+    def set_io(self, io: Dict[str, int]) -> None:
+        """ Sets the I/O counters from the ones of /proc/<pid>/io (unless they're not available). """
+        if io:
+            self.read_bytes = io["read_bytes"]
+            self.write_bytes = io["write_bytes"]
+            self.read_chars = io["rchar"]
+            self.write_chars = io["wchar"]
+
+    def __add__(self, other: "ResourceUsage") -> "ResourceUsage":
+        # (the usage of successive attempts: the times and the I/O add up, not the memory)
+        return ResourceUsage(**{
+            f.name: (max if f.name.endswith("rss") else operator.add)(getattr(self, f.name), getattr(other, f.name))
+            for f in dataclasses.fields(self)
+        })
+
+    def summary(self) -> str:
+        return (f"wall {self.wall:,.3f} s, user {self.user:,.2f} s, sys {self.system:,.2f} s, "
+                f"peak RSS {_mib(self.max_rss)} (all processes {_mib(self.peak_rss)}), "
+                f"read {_mib(self.read_bytes)}, written {_mib(self.write_bytes)}")
+
+
+def _mib(n: int) -> str:
+    return f"{n / 2 ** 20:,.1f} MiB"
+
+
+def _proc_io(pid) -> Dict[str, int]:
+    """ The I/O counters of the process (and of its subprocesses it waited for), empty when not available. """
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            return {k: int(v) for k, v in (line.split(":") for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def _session_stats(sid: int):
+    """ The fields of /proc/<pid>/stat (after the name) of the processes of the session `sid`, by pid. """
+    try:
+        pids = [int(p) for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return {}
+    stats = {}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # (the name, in parentheses, can have spaces)
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[3]) == sid:
+            stats[pid] = fields
+    return stats
+
+
+class _TreeSampler:
+    """
+    Samples the resources used by the processes of the session `sid` (a task and its subprocesses), every
+    `interval` seconds in a thread, into `usage`: the peak of their total RSS, and (the maximum seen of)
+    their CPU time and I/O counters, which is all there is when they're killed.
+    """
+
+    def __init__(self, sid: int, usage: Optional[ResourceUsage], interval: float = SAMPLE_INTERVAL):
+        self.sid = sid
+        self.usage = usage
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"sampler-{sid}", daemon=True)
+
+    def __enter__(self):
+        if self.usage is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                return
+
+    def sample(self) -> None:
+        usage, rss, user, system, io = self.usage, 0, 0.0, 0.0, collections.Counter()
+        for pid, fields in _session_stats(self.sid).items():
+            # utime, stime, cutime, cstime (in clock ticks) and rss (in pages)
+            user += (int(fields[11]) + int(fields[13])) / _CLOCK_TICKS
+            system += (int(fields[12]) + int(fields[14])) / _CLOCK_TICKS
+            rss += int(fields[21]) * _PAGE_SIZE
+            io.update(_proc_io(pid))
+        usage.peak_rss = max(usage.peak_rss, rss)
+        usage.user = max(usage.user, user)
+        usage.system = max(usage.system, system)
+        usage.read_bytes = max(usage.read_bytes, io["read_bytes"])
+        usage.write_bytes = max(usage.write_bytes, io["write_bytes"])
+        usage.read_chars = max(usage.read_chars, io["rchar"])
+        usage.write_chars = max(usage.write_chars, io["wchar"])
+
+
+# the return code of an attempt that timed out (as with the timeout command)
+TIMEOUT_RETURNCODE = 124
+RETRY_DELAY = 10.0
+RETRY_MAX_DELAY = 300.0
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+    # the number of attempts after the first one
+    retries: int = 0
+    retry_delay: float = RETRY_DELAY
+    retry_max_delay: float = RETRY_MAX_DELAY
+    # the return codes that are retried (all the failures when empty)
+    retry_on: Tuple[int, ...] = ()
+    # the seconds an attempt can run
+    timeout: Optional[float] = None
+
+    def should_retry(self, returncode: int, attempt: int) -> bool:
+        """ Whether the attempt number `attempt` (from 1) that returned `returncode` is followed by another. """
+        return bool(returncode) and attempt <= self.retries and (not self.retry_on or returncode in self.retry_on)
+
+    def delay(self, attempt: int) -> float:
+        """
+        The seconds to wait after the attempt number `attempt`: doubled at each attempt (up to
+        `retry_max_delay`), and between half of that and that ("jitter").
+        """
+        delay = min(self.retry_max_delay, self.retry_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+
+RETRY_FIELDS = [f.name for f in dataclasses.fields(RetryPolicy)]
+
+
+@dataclasses.dataclass
+class Attempt:
+    number: int
+    start: datetime.datetime
+    end: Optional[datetime.datetime] = None
+    returncode: Optional[int] = None
+    timed_out: bool = False
+    usage: ResourceUsage = dataclasses.field(default_factory=ResourceUsage)
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        return (self.end - self.start).total_seconds() if self.end else None
+
+
+def run_with_retries(executable_call: List[str], output: "OutputCapture", runner: "EntryPointRunner",
+                     retry: RetryPolicy) -> List[Attempt]:
+    """
+    Runs the entry point or the shell command until it succeeds, or fails in a way that isn't retried, or
+    there's no retry left. Returns the attempts (the return code is the one of the last one).
+    """
+    attempts = []
+    while True:
+        attempt = Attempt(len(attempts) + 1, datetime.datetime.now())
+        attempts.append(attempt)
+        start = time.perf_counter()
+        try:
+            attempt.returncode = run_call(executable_call, output, runner, retry.timeout, attempt.usage)
+        except subprocess.TimeoutExpired:
+            attempt.returncode = TIMEOUT_RETURNCODE
+            attempt.timed_out = True
+            output.write(f"\n[pyrun: attempt {attempt.number} timed out after {retry.timeout:g} s, "
+                         f"its processes were killed]\n".encode())
+        attempt.usage.wall = time.perf_counter() - start
+        attempt.end = datetime.datetime.now()
+
+        if not retry.should_retry(attempt.returncode, attempt.number):
+            return attempts
+        delay = retry.delay(attempt.number)
+        output.write(f"\n[pyrun: attempt {attempt.number} failed (return code: {attempt.returncode}), "
+                     f"retrying in {delay:,.1f} s]\n".encode())
+        time.sleep(delay)
+
+
+def format_attempts(attempts: List[Attempt]) -> str:
+    dt_fmt = "%d-%b-%Y %H:%M:%S"
+    return "\n".join(
+        f"#{a.number}: {a.start.strftime(dt_fmt)}, return code: {a.returncode}"
+        + (" (timed out)" if a.timed_out else "") + f", {a.usage.summary()}"
+        for a in attempts
+    )
+
+
+def total_usage(attempts: List[Attempt]) -> ResourceUsage:
+    return functools.reduce(operator.add, (a.usage for a in attempts), ResourceUsage())
+
+
+def metrics_record(name: str, executable_call: List[str], attempts: List[Attempt],
+                   task: Optional[str] = None) -> Dict:
+    """ The line of the metrics file for a run (of a task of the manifest `name`, when `task` is given). """
+    return {
+        "name": name,
+        "task": task,
+        "executable_call": " ".join(executable_call),
+        "hostname": socket.gethostname(),
+        "start": attempts[0].start.isoformat(),
+        "end": attempts[-1].end.isoformat(),
+        "returncode": attempts[-1].returncode,
+        "timed_out": attempts[-1].timed_out,
+        **dataclasses.asdict(total_usage(attempts)),
+        "attempts": [
+            dict(number=a.number, start=a.start.isoformat(), returncode=a.returncode, timed_out=a.timed_out,
+                 **dataclasses.asdict(a.usage))
+            for a in attempts
+        ],
+    }
+
+
+def write_metrics(path: str, records: List[Dict]) -> None:
+    """ Appends the records to the metrics file (JSON lines). """
+    with open(path, "a") as f:
+        f.write("".join(json.dumps(r) + "\n" for r in records))
+
+
+def entry_point_modules(executable_calls: List[List[str]]) -> List[str]:
+    """ The modules of the entry points (to be preloaded). """
+    entry_points = [parse_entry_point(c) for c in executable_calls]
+    return sorted({e[0].partition(":")[0] for e in entry_points if e is not None})
+
+
+@dataclasses.dataclass
+class Task:
+    name: str
+    executable_call: List[str]
+    depends_on: List[str] = dataclasses.field(default_factory=list)
+    # the RetryPolicy fields it overrides
+    retry: Dict = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class TaskResult:
+    task: Task
+    returncode: Optional[int] = None
+    # when one of the tasks it depends on failed
+    skipped: bool = False
+    output: Optional["OutputCapture"] = None
+    start: Optional[datetime.datetime] = None
+    end: Optional[datetime.datetime] = None
+    attempts: List[Attempt] = dataclasses.field(default_factory=list)
+
+    @property
+    def status(self) -> str:
+        if self.skipped:
+            return "SKIPPED"
+        if self.returncode is None:
+            return "PENDING"
+        return "FAILED" if self.returncode else "SUCCEEDED"
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        return (self.end - self.start).total_seconds() if self.start else None
+
+
+def load_manifest(path: str) -> Dict:
+    """
+    Reads the manifest: its name, parallelism and tasks (checking that their dependencies exist and
+    have no cycles).
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+
+    tasks = []
+    for t in manifest["tasks"]:
+        executable_call = t["call"] if isinstance(t["call"], list) else shlex.split(t["call"])
+        retry = {k: t[k] for k in RETRY_FIELDS if k in t}
+        if "retry_on" in retry:
+            retry["retry_on"] = tuple(retry["retry_on"])
+        tasks.append(Task(t["name"], executable_call, list(t.get("depends_on", [])), retry))
+
+    names = [t.name for t in tasks]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicated task names in {path}")
+    for task in tasks:
+        unknown = set(task.depends_on) - set(names)
+        if unknown:
+            raise ValueError(f"Task {task.name} depends on unknown tasks: {', '.join(sorted(unknown))}")
+    _check_cycles(tasks)
+
+    return {
+        "name": manifest.get("name", os.path.splitext(os.path.basename(path))[0]),
+        "parallelism": manifest.get("parallelism"),
+        "tasks": tasks,
+    }
+
+
+def _check_cycles(tasks: List[Task]) -> None:
+    depends_on = {t.name: t.depends_on for t in tasks}
+    done = set()
+    for task in tasks:
+        stack = [(task.name, iter(depends_on[task.name]))]
+        visiting = {task.name}
+        while stack:
+            name, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                stack.pop()
+                visiting.discard(name)
+                done.add(name)
+            elif dep in visiting:
+                cycle = [n for n, _ in stack] + [dep]
+                raise ValueError(f"Cycle in the task dependencies: {' -> '.join(cycle[cycle.index(dep):])}")
+            elif dep not in done:
+                visiting.add(dep)
+                stack.append((dep, iter(depends_on[dep])))
+
+
+def run_batch(tasks: List[Task], parallelism: int, spool_dir: Optional[str], runner: "EntryPointRunner",
+              name: str = "batch", retry: RetryPolicy = RetryPolicy()) -> Dict[str, TaskResult]:
+    """
+    Runs the tasks (as soon as the ones they depend on have succeeded, at most `parallelism` at a time) and
+    returns their results by name. The output of each task is written to its own spool file in `spool_dir`.
+    `retry` is the retry policy of the tasks that don't override it.
+    """
+    results = {t.name: TaskResult(t) for t in tasks}
+    waiting = list(tasks)
+    start = datetime.datetime.now()
+
+    def run(task: Task) -> None:
+        result = results[task.name]
+        path = spool_path(spool_dir, f"{name}-{task.name}", start) if spool_dir else None
+        result.start = datetime.datetime.now()
+        # (the outputs of the tasks running at the same time would be mixed up on the console)
+        with OutputCapture(path, console=False) as result.output:
+            result.attempts = run_with_retries(task.executable_call, result.output, runner,
+                                               dataclasses.replace(retry, **task.retry))
+        result.returncode = result.attempts[-1].returncode
+        result.end = datetime.datetime.now()
+
+    with concurrent.futures.ThreadPoolExecutor(parallelism) as executor:
+        running = {}
+        while waiting or running:
+            for task in list(waiting):
+                statuses = [results[d].status for d in task.depends_on]
+                if any(s in ("FAILED", "SKIPPED") for s in statuses):
+                    waiting.remove(task)
+                    results[task.name].skipped = True
+                    print(f"{task.name}: SKIPPED", flush=True)
+                elif all(s == "SUCCEEDED" for s in statuses):
+                    waiting.remove(task)
+                    running[executor.submit(run, task)] = task
+            if not running:
+                # (the skipped tasks can make others skipped)
+                continue
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                result = results[task.name]
+                if future.exception() is not None:
+                    # it could not be run at all
+                    traceback.print_exception(future.exception())
+                    result.returncode = 1
+                    result.end = datetime.datetime.now()
+                print(f"{task.name}: {result.status} (return code: {result.returncode}, "
+                      f"{result.elapsed:,.2f} s, attempts: {len(result.attempts)})", flush=True)
+    return results
+
+
+def main_batch(config: Dict) -> int:
+    manifest = load_manifest(config["manifest"])
+    config["name"] = config["name"] or manifest["name"]
+    config["executable_call"] = ["--manifest", config["manifest"]]
+    parallelism = config["parallelism"] or manifest["parallelism"] or os.cpu_count()
+    tasks = manifest["tasks"]
+    runner = EntryPointRunner(preload=config["preload"] + entry_point_modules([t.executable_call for t in tasks]))
+
+    config["start"] = datetime.datetime.now()
+    results = run_batch(tasks, parallelism, config["spool_dir"], runner, config["name"], config["retry"])
+    config["end"] = datetime.datetime.now()
+    config["elapsed"] = (config["end"] - config["start"]).total_seconds()
+    if config["metrics_file"]:
+        write_metrics(config["metrics_file"], [metrics_record(config["name"], r.task.executable_call, r.attempts, name)
+                                               for name, r in results.items() if r.attempts])
+
+    failed = sum(r.status != "SUCCEEDED" for r in results.values())
+    if should_send_email(config, failed):
+        send_batch_email(config, results)
+    for task in tasks:
+        prune_spools(config["spool_dir"], f"{config['name']}-{task.name}", config["keep_spools"])
+    return 1 if failed else 0
+
+
+ENTRY_POINT = re.compile(r"^[\w.]+:[\w.]+$")
+
+
+def parse_entry_point(executable_call: List[str]) -> Optional[Tuple[str, List[str]]]:
+    """
+    Returns the entry point (module:function) and its arguments, or None when it's a shell command.
+    """
+    if not executable_call or not ENTRY_POINT.match(executable_call[0]):
+        return None
+    args = executable_call[1:]
+    if args[:1] == ["--"]:
+        args = args[1:]
+    return executable_call[0], args
+
+
+def resolve_entry_point(entry_point: str):
+    module_name, _, attrs = entry_point.partition(":")
+    return functools.reduce(getattr, attrs.split("."), importlib.import_module(module_name))
+
+
+class EntryPointRunner:
+    """
+    Runs entry points (module:function) in worker processes: forked from a pre-warmed server process that
+    has the `preload` modules imported ("forkserver"), or from this process, once it has imported them ("fork").
+
+    The server is started on the first call, and reused by the next ones. Starting it costs a new interpreter,
+    so it only pays off for several calls, and it's what calls from several threads need.
+    """
+
+    def __init__(self, preload: List[str] = (), method: str = "forkserver"):
+        self.context = multiprocessing.get_context(method)
+        self.preload = list(preload)
+        if method == "forkserver":
+            # multiprocessing runs the __main__ module (the pyrun script) again in every worker, with this module
+            # imported in the server that's only running the script (its imports are done already)
+            self.context.set_forkserver_preload([__spec__.name if __spec__ else __name__] + self.preload)
+
+    def call(self, entry_point: str, args: List[str], output: "OutputCapture",
+             errors: Optional["OutputCapture"] = None, timeout: Optional[float] = None,
+             usage: Optional[ResourceUsage] = None) -> int:
+        """
+        Calls the entry point with `args` as its command line arguments and returns its exit code.
+        Its stdout goes to `output`, its stderr to `errors` (to `output` too by default). `usage` (when given)
+        is filled with the resources used by the worker and its subprocesses.
+
+        Raises subprocess.TimeoutExpired when it runs for more than `timeout` seconds: the worker and its
+        subprocesses (its process group) are killed then.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if self.context.get_start_method() == "fork":
+            for module in self.preload:
+                importlib.import_module(module)
+        stdout_reader, stdout_writer = self.context.Pipe(duplex=False)
+        stderr_reader, stderr_writer = self.context.Pipe(duplex=False)
+        usage_reader, usage_writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_run_entry_point, name=entry_point,
+                                       args=(entry_point, args, stdout_writer, stderr_writer, usage_writer))
+        process.start()
+        # the worker has its own copies (so the pipes are closed when it's done)
+        stdout_writer.close()
+        stderr_writer.close()
+        usage_writer.close()
+
+        # (the worker isn't a child of this process with the forkserver, it measures itself at the end)
+        with _TreeSampler(process.pid, usage):
+            completed = _stream({stdout_reader.fileno(): output, stderr_reader.fileno(): errors or output},
+                                deadline)
+            if completed:
+                # (it can close its output and keep running)
+                process.join(None if deadline is None else max(0, deadline - time.monotonic()))
+                completed = process.exitcode is not None
+            if not completed:
+                _kill_group(process.pid, lambda t: process.join(t) or process.exitcode is not None)
+        stdout_reader.close()
+        stderr_reader.close()
+        process.join()
+        if completed and usage is not None and usage_reader.poll():
+            try:
+                rusages, counters = usage_reader.recv()
+            except EOFError:
+                # it died before measuring itself (os._exit, a signal): the sampled values are kept
+                pass
+            else:
+                usage.set_rusage(*rusages)
+                usage.set_io(counters)
+        usage_reader.close()
+        if not completed:
+            raise subprocess.TimeoutExpired(entry_point, timeout)
+        return process.exitcode
+
+
+def _run_entry_point(entry_point: str, args: List[str], stdout, stderr, usage) -> None:
+    # (in the worker process) its own process group, so its subprocesses are killed with it on timeout
+    os.setsid()
+    # the file descriptors 1 and 2 are redirected, so the output of C extensions and subprocesses is
+    # captured too
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(stdout.fileno(), 1)
+    os.dup2(stderr.fileno(), 2)
+    stdout.close()
+    stderr.close()
+    # (they might not be on the file descriptors 1 and 2 anymore, e.g. under pytest)
+    sys.stdout = open(1, "w", closefd=False)
+    sys.stderr = open(2, "w", closefd=False, errors="backslashreplace")
+
+    sys.argv = [entry_point] + list(args)
+    try:
+        code = resolve_entry_point(entry_point)()
+    except SystemExit as e:
+        code = e.code
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    if code is not None and not isinstance(code, int):
+        # as Python does with sys.exit("message")
+        print(code, file=sys.stderr)
+        code = 1
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except (OSError, ValueError):
+            # closed by the entry point (e.g. json.tool closes its output file, sys.stdout by default)
+            pass
+    # (the resources used by the worker and by the subprocesses it waited for)
+    usage.send(([resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)],
+                _proc_io("self")))
+    usage.close()
+    # not sys.exit: when forked from a thread (see run_batch) the exit handlers inherited from the parent
+    # (e.g. the ones of concurrent.futures) would turn any code into 1
+    os._exit(code or 0)
 
 
 def format_dict(d: Dict, sep: str = ":") -> str:
@@ -111,7 +1025,7 @@ def format_dict(d: Dict, sep: str = ":") -> str:
     return lines
 
 
-def send_email(config: Dict, output: str, returncode: int) -> None:
+def send_email(config: Dict, output: "OutputCapture", returncode: int, attempts: List[Attempt] = ()) -> None:
     status = "FAILED" if returncode else "SUCCEEDED"
     dt_fmt = "%d-%b-%Y %H:%M:%S"
     fields = {
@@ -122,11 +1036,18 @@ def send_email(config: Dict, output: str, returncode: int) -> None:
         "Started at": config["start"].strftime(dt_fmt),
         "Finished at": config["end"].strftime(dt_fmt),
         "Total Runtime": "{:,.2f}".format(config["elapsed"]),
+        "Output size": f"{output.total:,} bytes",
+        "Output file": output.spool_path,
+        "Attempts": len(attempts) or 1,
+        "Resources": total_usage(attempts).summary() if attempts else None,
         "Username": getpass.getuser(),
         "Hostname": socket.gethostname(),
     }
     formatted_fields = format_dict(fields)
-    body = f"<h1>{config['name']} - {status}</h1><br><pre>{formatted_fields}</pre><h2>Please check output attached.</h2>"
+    body = f"<h1>{config['name']} - {status}</h1><br><pre>{formatted_fields}</pre>"
+    if attempts:
+        body += f"<h2>Attempts</h2><pre>{format_attempts(attempts)}</pre>"
+    body += "<h2>Please check output attached.</h2>"
     _send_email(
         sender=config["sender"],
         recipients=config["recipients"],
@@ -134,11 +1055,57 @@ def send_email(config: Dict, output: str, returncode: int) -> None:
         body=body,
         html=True,
         priority=EmailPriority.HIGH if returncode else EmailPriority.NORMAL,
-        attachments={"output.txt": output},
+        attachments=output.attachments(),
     )
 
 
 
+def send_batch_email(config: Dict, results: Dict[str, TaskResult]) -> None:
+    """ One email for all the tasks of a manifest, with the output of each one attached. """
+    failed = [r for r in results.values() if r.status != "SUCCEEDED"]
+    status = f"{len(failed)} OF {len(results)} FAILED" if failed else "SUCCEEDED"
+    dt_fmt = "%d-%b-%Y %H:%M:%S"
+    fields = {
+        "Name": config["name"],
+        "Manifest": config["manifest"],
+        "Status": status,
+        "Started at": config["start"].strftime(dt_fmt),
+        "Finished at": config["end"].strftime(dt_fmt),
+        "Total Runtime": "{:,.2f}".format(config["elapsed"]),
+        "Username": getpass.getuser(),
+        "Hostname": socket.gethostname(),
+    }
+    tasks = {
+        name: f"{r.status:<9} return code: {r.returncode}"
+              + (f", {r.elapsed:,.2f} s" if r.elapsed is not None else "")
+              + (f", {len(r.attempts)} attempts" if len(r.attempts) > 1 else "")
+              + (" (timed out)" if r.attempts and r.attempts[-1].timed_out else "")
+        for name, r in results.items()
+    }
+    retried = {name: format_attempts(r.attempts) for name, r in results.items() if len(r.attempts) > 1}
+    resources = {name: total_usage(r.attempts).summary() for name, r in results.items() if r.attempts}
+    body = (f"<h1>{config['name']} - {status}</h1><br><pre>{format_dict(fields)}</pre>"
+            f"<h2>Tasks</h2><pre>{format_dict(tasks)}</pre>"
+            + (f"<h2>Resources</h2><pre>{format_dict(resources)}</pre>" if resources else "")
+            + "".join(f"<h3>{name} - attempts</h3><pre>{lines}</pre>" for name, lines in retried.items())
+            + "<h2>Please check outputs attached.</h2>")
+
+    attachments = {}
+    for name, result in results.items():
+        if result.output is not None:
+            for filename, contents in result.output.attachments().items():
+                attachments[f"{name}-{filename}"] = contents
+    _send_email(
+        sender=config["sender"],
+        recipients=config["recipients"],
+        subject=f"Tasks: {config['name']} - {status}",
+        body=body,
+        html=True,
+        priority=EmailPriority.HIGH if failed else EmailPriority.NORMAL,
+        attachments=attachments,
+    )
+
+
 class EmailPriority(str, Enum):
     LOW = "5"
     NORMAL = "3"
@@ -168,11 +1135,14 @@ def _send_email(sender: str,
 
     attachments = attachments or {}
     for filename, contents in attachments.items():
-        message.add_attachment(contents, filename=filename)
+        if isinstance(contents, bytes):
+            message.add_attachment(contents, maintype="application", subtype="octet-stream", filename=filename)
+        else:
+            message.add_attachment(contents, filename=filename)
 
     with smtplib.SMTP(smtp_hostname) as smtp:
         smtp.send_message(message)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
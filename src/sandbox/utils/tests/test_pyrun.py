@@ -1,4 +1,9 @@
+import datetime
+import gzip
+import io
+import json
 import os
+import time
 from typing import Dict
 
 import pytest
@@ -69,3 +74,390 @@ foo       : 1
 barbarbar : 2
 hello     : world"""
     assert expected == pyrun.format_dict(d)
+
+
+def test_output_capture_keeps_head_and_tail(tmp_path):
+    console = io.BytesIO()
+    spool_path = str(tmp_path / "out.log")
+    with pyrun.OutputCapture(spool_path, console=console, head_size=4, tail_size=6) as output:
+        for chunk in [b"abc", b"defgh", b"ijk", b"lmnop"]:
+            output.write(chunk)
+
+    assert console.getvalue() == b"abcdefghijklmnop"
+    assert open(spool_path, "rb").read() == b"abcdefghijklmnop"
+    assert output.total == 16
+    assert output.truncated == 6
+    assert output.text().startswith("abcd")
+    assert output.text().endswith("klmnop")
+    assert "6 bytes truncated" in output.text()
+
+    attachments = output.attachments()
+    assert gzip.decompress(attachments["output.txt.gz"]) == b"abcdefghijklmnop"
+
+
+def test_output_capture_short_output(tmp_path):
+    with pyrun.OutputCapture(str(tmp_path / "out.log"), console=io.BytesIO()) as output:
+        output.write(b"hello\n")
+    assert output.attachments() == {"output.txt": "hello\n"}
+
+
+def test_output_capture_rotates_the_spool(tmp_path):
+    spool_path = str(tmp_path / "out.log")
+    with pyrun.OutputCapture(spool_path, console=io.BytesIO(), head_size=1, tail_size=1,
+                             max_bytes=4, backup_count=2) as output:
+        for chunk in [b"aaa", b"bbb", b"ccc", b"ddd"]:
+            output.write(chunk)
+
+    assert open(spool_path, "rb").read() == b"ddd"
+    assert open(spool_path + ".1", "rb").read() == b"ccc"
+    assert open(spool_path + ".2", "rb").read() == b"bbb"
+    assert not os.path.exists(spool_path + ".3")
+    # the whole output isn't there anymore
+    assert list(output.attachments()) == ["output.txt"]
+
+
+def test_prune_spools(tmp_path):
+    start = datetime.datetime(2024, 1, 1)
+    paths = [pyrun.spool_path(str(tmp_path), "job", start + datetime.timedelta(seconds=i)) for i in range(4)]
+    for path in paths + [paths[0] + ".1", paths[3] + ".1"]:
+        open(path, "w").close()
+    other = tmp_path / "pyrun-job-other-20240101-000000-1.log"
+    other.touch()
+
+    pyrun.prune_spools(str(tmp_path), "job", 2)
+
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(paths[2]), os.path.basename(paths[3]),
+                                                   os.path.basename(paths[3]) + ".1", other.name])
+    assert str(os.getpid()) in paths[0]
+
+
+def test_call_streams_the_output(tmp_path):
+    with pyrun.OutputCapture(str(tmp_path / "out.log"), console=io.BytesIO(), head_size=10,
+                             tail_size=10) as output:
+        returncode = pyrun.call(["for i in $(seq 10000); do echo line $i; done; echo oops >&2; exit 3"], output)
+
+    assert returncode == 3
+    assert output.text().startswith("line 1\nlin\n")
+    assert output.text().endswith("0000\noops\n")
+    assert output.total == os.path.getsize(tmp_path / "out.log")
+
+
+@pytest.mark.parametrize(
+    ["executable_call", "expected"],
+    [
+        (["foo.bar:main"], ("foo.bar:main", [])),
+        (["foo.bar:App.main", "--", "spam", "--verbose"], ("foo.bar:App.main", ["spam", "--verbose"])),
+        (["echo foo:bar"], None),
+        (["ls", "-l"], None),
+        ([], None),
+    ]
+)
+def test_parse_entry_point(executable_call, expected):
+    assert pyrun.parse_entry_point(executable_call) == expected
+
+
+TASKS = '''
+import json
+import os
+import time
+import sys
+
+
+def main():
+    print("args:", sys.argv[1:])
+    sys.stdout.flush()
+    os.system("echo from a subprocess")
+    print("warning", file=sys.stderr)
+    return int(sys.argv[1])
+
+
+def fail():
+    raise ValueError("boom")
+
+
+def message():
+    sys.exit("bad arguments")
+
+
+def hang():
+    print("hanging", flush=True)
+    time.sleep(30)
+
+
+def crash():
+    x = b"x" * 100 * 2 ** 20
+    time.sleep(1.5)
+    os._exit(3)
+
+
+def detach():
+    print("detaching", flush=True)
+    os.close(1)
+    os.close(2)
+    time.sleep(30)
+
+
+def busy():
+    data = bytearray(50 * 2 ** 20)
+    with open(sys.argv[1], "wb") as f:
+        f.write(data)
+        os.fsync(f.fileno())
+    end = time.process_time() + 0.2
+    while time.process_time() < end:
+        pass
+'''
+
+
+@pytest.fixture
+def tasks(tmp_path, monkeypatch):
+    (tmp_path / "pyrun_tasks.py").write_text(TASKS)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return "pyrun_tasks"
+
+
+@pytest.mark.parametrize(
+    ["function", "args", "returncode", "stdout", "stderr"],
+    [
+        ("main", ["0"], 0, "args: ['0']\nfrom a subprocess\n", "warning\n"),
+        ("main", ["3"], 3, "args: ['3']\nfrom a subprocess\n", "warning\n"),
+        ("fail", [], 1, "", "ValueError: boom\n"),
+        ("message", [], 1, "", "bad arguments\n"),
+    ]
+)
+def test_entry_point_runner(tasks, function, args, returncode, stdout, stderr):
+    runner = pyrun.EntryPointRunner(method="fork")
+    with pyrun.OutputCapture(None, console=io.BytesIO()) as output, \
+            pyrun.OutputCapture(None, console=io.BytesIO()) as errors:
+        assert runner.call(f"{tasks}:{function}", args, output, errors) == returncode
+    assert output.text() == stdout
+    assert errors.text().endswith(stderr)
+
+
+def test_entry_point_runner_with_forkserver():
+    runner = pyrun.EntryPointRunner(preload=["timeit"])
+    with pyrun.OutputCapture(None, console=io.BytesIO()) as output:
+        assert runner.call("timeit:main", ["-n", "1", "-r", "1", "pass"], output) == 0
+        assert runner.call("timeit:main", ["-n", "1", "-r", "1", "1/0"], output) == 1
+    assert "1 loop, best of 1" in output.text()
+    assert output.text().endswith("ZeroDivisionError: division by zero\n")
+
+
+def test_entry_point_runner_runs_a_console_script(tmp_path):
+    # (the startup times are compared in sandbox/utils/benchmarks.py)
+    (tmp_path / "in.json").write_text('{"a": 1}')
+    args = [str(tmp_path / "in.json")]
+    for runner in [pyrun.EntryPointRunner(method="fork"), pyrun.EntryPointRunner(preload=["json.tool"])]:
+        with pyrun.OutputCapture(None, console=False) as output:
+            assert runner.call("json.tool:main", args, output) == 0
+        assert output.text() == '{\n    "a": 1\n}\n'
+
+
+def write_manifest(tmp_path, tasks, **kwargs):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(dict(kwargs, tasks=tasks)))
+    return str(path)
+
+
+def test_load_manifest(tmp_path):
+    path = write_manifest(tmp_path, [
+        {"name": "a", "call": "foo.bar:main -- --all 'x y'"},
+        {"name": "b", "call": ["echo", "hello"], "depends_on": ["a"]},
+    ], parallelism=2)
+
+    manifest = pyrun.load_manifest(path)
+
+    assert manifest["name"] == "manifest"
+    assert manifest["parallelism"] == 2
+    assert manifest["tasks"] == [pyrun.Task("a", ["foo.bar:main", "--", "--all", "x y"]),
+                                 pyrun.Task("b", ["echo", "hello"], ["a"])]
+
+
+@pytest.mark.parametrize(
+    ["tasks", "message"],
+    [
+        ([{"name": "a", "call": "x", "depends_on": ["b"]}], "unknown tasks: b"),
+        ([{"name": "a", "call": "x"}, {"name": "a", "call": "y"}], "Duplicated"),
+        ([{"name": "a", "call": "x", "depends_on": ["c"]},
+          {"name": "b", "call": "x", "depends_on": ["a"]},
+          {"name": "c", "call": "x", "depends_on": ["b"]}], "Cycle in the task dependencies: a -> c -> b -> a"),
+    ]
+)
+def test_load_manifest_errors(tmp_path, tasks, message):
+    with pytest.raises(ValueError, match=message):
+        pyrun.load_manifest(write_manifest(tmp_path, tasks))
+
+
+def test_run_batch(tmp_path, tasks):
+    batch = [
+        pyrun.Task("first", ["echo first"]),
+        pyrun.Task("fails", [f"{tasks}:main", "--", "2"], ["first"]),
+        pyrun.Task("skipped", ["echo never"], ["fails"]),
+        pyrun.Task("also_skipped", ["echo never"], ["skipped", "first"]),
+        pyrun.Task("slow1", ["sleep 0.5"]),
+        pyrun.Task("slow2", ["sleep 0.5"]),
+    ]
+
+    results = pyrun.run_batch(batch, 3, str(tmp_path), pyrun.EntryPointRunner(method="fork"), "test")
+
+    # the slow tasks ran at the same time
+    slow1, slow2 = results["slow1"], results["slow2"]
+    assert slow1.start < slow2.end and slow2.start < slow1.end
+    assert {name: r.status for name, r in results.items()} == {
+        "first": "SUCCEEDED", "fails": "FAILED", "skipped": "SKIPPED", "also_skipped": "SKIPPED",
+        "slow1": "SUCCEEDED", "slow2": "SUCCEEDED"}
+    assert results["fails"].returncode == 2
+    assert results["first"].output.text() == "first\n"
+    assert results["fails"].output.text().startswith("args: ['2']")
+    assert results["skipped"].output is None
+    assert results["skipped"].returncode is None
+    assert len(list(tmp_path.glob("pyrun-test-*.log"))) == 4
+
+
+def test_send_batch_email(tmp_path, mocker):
+    _send_email = mocker.patch.object(pyrun, "_send_email")
+    results = pyrun.run_batch([pyrun.Task("ok", ["echo ok"]), pyrun.Task("ko", ["exit 1"])], 2, None,
+                              pyrun.EntryPointRunner(method="fork"))
+    now = datetime.datetime.now()
+    config = {"name": "nightly", "manifest": "nightly.json", "sender": "me", "recipients": ["you"],
+              "start": now, "end": now, "elapsed": 0}
+
+    pyrun.send_batch_email(config, results)
+
+    kwargs = _send_email.call_args.kwargs
+    assert kwargs["subject"] == "Tasks: nightly - 1 OF 2 FAILED"
+    assert kwargs["attachments"] == {"ok-output.txt": "ok\n", "ko-output.txt": ""}
+    assert "ko : FAILED    return code: 1" in kwargs["body"]
+
+
+def test_retry_policy():
+    retry = pyrun.RetryPolicy(retries=3, retry_delay=2, retry_max_delay=5, retry_on=(1, 124))
+
+    assert [retry.should_retry(1, attempt) for attempt in range(1, 5)] == [True, True, True, False]
+    assert not retry.should_retry(0, 1)
+    assert not retry.should_retry(2, 1)
+    assert pyrun.RetryPolicy(retries=1).should_retry(2, 1)
+    for attempt, delay in [(1, 2), (2, 4), (3, 5), (10, 5)]:
+        assert delay / 2 <= retry.delay(attempt) <= delay
+
+
+def test_run_with_retries(tmp_path):
+    counter = tmp_path / "counter"
+    # fails the first 2 times
+    command = [f"echo -n x >> {counter}; echo attempt; test $(cat {counter}) = xxx"]
+    retry = pyrun.RetryPolicy(retries=3, retry_delay=0)
+    with pyrun.OutputCapture(None, console=False) as output:
+        attempts = pyrun.run_with_retries(command, output, pyrun.EntryPointRunner(method="fork"), retry)
+
+    assert [a.returncode for a in attempts] == [1, 1, 0]
+    assert all(a.elapsed is not None and not a.timed_out for a in attempts)
+    assert output.text().count("attempt\n") == 3
+    assert "[pyrun: attempt 2 failed (return code: 1), retrying in 0.0 s]" in output.text()
+
+
+def _is_running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # (a zombie is not running anymore)
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_call_timeout_kills_the_process_group(tmp_path):
+    pid_path = tmp_path / "pid"
+    start = time.monotonic()
+    with pyrun.OutputCapture(None, console=False) as output:
+        with pytest.raises(pyrun.subprocess.TimeoutExpired):
+            pyrun.call([f"echo started; sleep 30 & echo $! > {pid_path}; wait"], output, timeout=0.5)
+
+    assert time.monotonic() - start < 5
+    assert output.text() == "started\n"
+    assert not _is_running(int(pid_path.read_text()))
+
+
+def test_timeout_when_the_output_is_closed(tasks):
+    retry = pyrun.RetryPolicy(timeout=1)
+    runner = pyrun.EntryPointRunner(method="fork")
+    for executable_call in [["echo detaching; exec sleep 30 > /dev/null 2>&1"], [f"{tasks}:detach"]]:
+        start = time.monotonic()
+        with pyrun.OutputCapture(None, console=False) as output:
+            attempt, = pyrun.run_with_retries(executable_call, output, runner, retry)
+
+        assert time.monotonic() - start < 5
+        assert (attempt.returncode, attempt.timed_out) == (124, True)
+        assert output.text().startswith("detaching\n")
+
+
+def test_entry_point_timeout(tasks):
+    retry = pyrun.RetryPolicy(retries=1, retry_delay=0, retry_on=(124,), timeout=0.5)
+    start = time.monotonic()
+    with pyrun.OutputCapture(None, console=False) as output:
+        attempts = pyrun.run_with_retries([f"{tasks}:hang"], output, pyrun.EntryPointRunner(method="fork"), retry)
+
+    assert time.monotonic() - start < 5
+    assert [(a.returncode, a.timed_out) for a in attempts] == [(124, True), (124, True)]
+    assert output.text().count("hanging\n") == 2
+    assert "[pyrun: attempt 2 timed out after 0.5 s, its processes were killed]" in output.text()
+
+
+def test_call_measures_the_resources(tmp_path):
+    usage = pyrun.ResourceUsage()
+    command = [f"head -c 20000000 /dev/zero > {tmp_path / 'out'}; sync; python -c 'x = bytearray(50 * 2 ** 20)'"]
+    with pyrun.OutputCapture(None, console=False) as output:
+        assert pyrun.call(command, output, usage=usage) == 0
+
+    # (the resources of the subprocesses are included)
+    assert usage.user + usage.system > 0
+    assert usage.max_rss > 50 * 2 ** 20
+    assert usage.write_chars >= 20_000_000
+
+
+@pytest.mark.parametrize("method", ["fork", "forkserver"])
+def test_entry_point_runner_measures_the_resources(tasks, tmp_path, method):
+    usage = pyrun.ResourceUsage()
+    with pyrun.OutputCapture(None, console=False) as output:
+        assert pyrun.EntryPointRunner(method=method).call(f"{tasks}:busy", [str(tmp_path / "out")], output,
+                                                          usage=usage) == 0
+
+    assert usage.user + usage.system >= 0.2
+    assert usage.max_rss > 50 * 2 ** 20
+    assert usage.write_chars >= 50 * 2 ** 20
+
+
+def test_entry_point_runner_keeps_the_sampled_resources_of_a_crashed_worker(tasks):
+    usage = pyrun.ResourceUsage()
+    with pyrun.OutputCapture(None, console=False) as output:
+        assert pyrun.EntryPointRunner(method="fork").call(f"{tasks}:crash", [], output, usage=usage) == 3
+
+    assert usage.peak_rss > 50 * 2 ** 20
+
+
+def test_sampler_measures_the_processes_that_timed_out():
+    retry = pyrun.RetryPolicy(timeout=1.5)
+    with pyrun.OutputCapture(None, console=False) as output:
+        attempt, = pyrun.run_with_retries(["python -c 'x = bytearray(50 * 2 ** 20); import time; time.sleep(30)'"],
+                                          output, pyrun.EntryPointRunner(method="fork"), retry)
+
+    assert attempt.timed_out
+    assert 1.5 <= attempt.usage.wall < 5
+    assert attempt.usage.peak_rss > 50 * 2 ** 20
+
+
+def test_metrics_record(tmp_path):
+    retry = pyrun.RetryPolicy(retries=1, retry_delay=0)
+    with pyrun.OutputCapture(None, console=False) as output:
+        attempts = pyrun.run_with_retries(["sleep 0.1; exit 3"], output, pyrun.EntryPointRunner(method="fork"), retry)
+    path = str(tmp_path / "metrics.jsonl")
+
+    pyrun.write_metrics(path, [pyrun.metrics_record("nightly", ["sleep 0.1; exit 3"], attempts, "sleep")])
+    pyrun.write_metrics(path, [pyrun.metrics_record("nightly", ["sleep 0.1; exit 3"], attempts[:1])])
+
+    first, second = [json.loads(line) for line in open(path)]
+    assert first["task"] == "sleep"
+    assert first["returncode"] == 3
+    assert [a["number"] for a in first["attempts"]] == [1, 2]
+    assert first["wall"] == pytest.approx(sum(a["wall"] for a in first["attempts"]))
+    assert first["wall"] >= 0.2
+    assert first["max_rss"] == max(a["max_rss"] for a in first["attempts"])
+    assert second["task"] is None
+    assert len(second["attempts"]) == 1